@@ -24,6 +24,14 @@ import uuid  # For generating unique UIDs
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 import math
+from hackrf_stream import HackRFStream
+from capture_file import FileCapture
+from iq_convert import int8_to_complex64
+from psd import welch_power
+from fft_backend import get_backend, get_window, window_gain
+from dsp_pipeline import DSPPipeline
+from sweep_engine import SweepEngine
+from detection import noise_floor, cfar_detect
 
 # === LOGGING ===
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(levelname)s: %(message)s')
@@ -61,6 +69,20 @@ monitor_config = {
     "dest_ip": "239.2.3.1",
     "dest_port": 18999,
     "capture_size": 2**22,  # Increased from 2**20
+    "capture_mode": "stream",  # "stream" (persistent hackrf_transfer), "file" (one capture per frame) or "sweep" (hackrf_sweep)
+    "capture_path": "memfd",   # File mode target: "memfd" or a tmpfs path such as /dev/shm/buffer.iq
+    "fft_averages": 0,         # Welch frames averaged per spectrum (0 = whole capture, 1 = single FFT)
+    "fft_overlap": 0.5,        # Overlap between Welch frames
+    "fft_backend": "auto",     # "auto", "pyfftw", "scipy" or "numpy"
+    "fft_workers": -1,         # FFT threads for scipy/pyfftw (-1 = all cores)
+    "dsp_workers": 0,          # DSP worker processes in stream mode (0 = single monitor loop)
+    "sweep_start": 1000000,    # Sweep mode range and bin width (Hz)
+    "sweep_stop": 6000000000,
+    "sweep_bin_width": 1000000,
+    "cfar_method": "ca",       # Signal detector: "ca" (cell averaging) or "os" (ordered statistic) CFAR
+    "cfar_train_bins": 16,     # CFAR training bins on each side of the bin under test
+    "cfar_guard_bins": 4,      # Bins next to the bin under test left out of the noise estimate
+    "cfar_offset_db": 10,      # Detection threshold above the local noise level
     "running": False        # Add running state
 }
 
@@ -568,6 +590,10 @@ def setup_multicast_socket():
 # Global socket for CoT messages
 cot_sock = setup_multicast_socket()
 
+def current_fft_backend():
+    """FFT backend selected by "fft_backend"/"fft_workers" in the config (see fft_backend.py)."""
+    return get_backend(monitor_config.get("fft_backend", "auto"), int(monitor_config.get("fft_workers", -1)))
+
 def calculate_rssi(iq_data, freq_bins=None, bin_center=None):
     """
     Calculate RSSI more accurately by focusing on the peak in the FFT or 
@@ -594,11 +620,11 @@ def calculate_rssi(iq_data, freq_bins=None, bin_center=None):
         iq_segment = iq_data[:max_samples]
         
         # Apply window
-        window = np.hanning(len(iq_segment))
+        window = get_window("hanning", len(iq_segment), np.float32)
         windowed_iq = iq_segment * window
         
         # Calculate FFT
-        fft_result = np.fft.fftshift(np.fft.fft(windowed_iq))
+        fft_result = np.fft.fftshift(current_fft_backend().fft(windowed_iq))
         power_db = 10 * np.log10(np.abs(fft_result)**2 / len(fft_result)**2 + 1e-10)
         
         # Find power in the region of interest
@@ -623,77 +649,68 @@ def calculate_rssi(iq_data, freq_bins=None, bin_center=None):
 def dbfs(iq):
     return calculate_rssi(iq)
 
+def spectrum_rssi(power_spectrum, peak_idx):
+    """
+    RSSI of the peak region of a Welch power spectrum, on the same scale as
+    calculate_rssi() but without another FFT (used by the DSP pipeline).
+    """
+    nfft = len(power_spectrum)
+    bin_width = max(3, nfft // 100)
+    region = power_spectrum[max(0, peak_idx - bin_width):min(nfft, peak_idx + bin_width)]
+    return 10 * np.log10(np.max(region) / nfft**2 + 1e-10)
+
+MAX_SIGNALS = 20  # Signals reported per spectrum
+
+def find_signals(power_spectrum, freqs):
+    """
+    Every signal above the CFAR threshold in a linear power spectrum, as
+    dicts with the peak bin, frequency and bandwidth (MHz) and SNR,
+    strongest first. See detection.py.
+    """
+    try:
+        return cfar_detect(
+            power_spectrum, freqs,
+            train=int(monitor_config.get("cfar_train_bins", 16)),
+            guard=int(monitor_config.get("cfar_guard_bins", 4)),
+            offset_db=float(monitor_config.get("cfar_offset_db", 10)),
+            method=monitor_config.get("cfar_method", "ca"),
+            max_signals=MAX_SIGNALS
+        )
+    except Exception as e:
+        logging.error(f"Signal detection error: {str(e)}")
+        return []
+
+def welch_spectrum(iq_data):
+    """
+    Welch-averaged power spectrum of a capture: overlapping 8192-sample
+    frames, their power averaged ("fft_averages" frames, 0 = the whole
+    capture), which lowers the noise variance. Returns (power, nfft).
+    """
+    # FFT size per frame
+    nfft = min(len(iq_data), 8192)
+    
+    # Window function (DC offset is removed inside welch_power)
+    window = get_window("hanning", nfft, np.float32)
+    
+    # Average the power spectrum over overlapping frames, zero frequency at the center
+    power_spectrum, frames_used = welch_power(
+        iq_data, nfft, window,
+        averages=int(monitor_config.get("fft_averages", 0)),
+        overlap=float(monitor_config.get("fft_overlap", 0.5)),
+        fft=current_fft_backend().fft
+    )
+    logging.debug(f"Welch PSD averaged over {frames_used} frames")
+    return power_spectrum, nfft
+
 def calculate_fft(iq_data):
     """
     Calculate FFT from IQ data with proper signal processing.
+    
+    The spectrum is Welch-averaged (see welch_spectrum) and converted to
+    the display trace by display_spectrum.
     """
     try:
-        global peak_hold, last_peak_reset
-        
-        # Use a reasonable segment size for processing
-        max_samples = min(len(iq_data), 8192)
-        iq_segment = iq_data[:max_samples]
-        
-        # Remove DC offset first
-        iq_segment = iq_segment - np.mean(iq_segment)
-        
-        # Apply window function
-        window = np.hanning(len(iq_segment))
-        windowed_iq = iq_segment * window
-        
-        # Calculate FFT and shift zero frequency to center
-        fft_result = np.fft.fftshift(np.fft.fft(windowed_iq))
-        
-        # Calculate power spectrum
-        power_spectrum = np.abs(fft_result)**2
-        
-        # Normalize by window power and FFT size
-        window_power = np.sum(window**2)
-        power_spectrum = power_spectrum / (window_power * len(fft_result))
-        
-        # Convert to dB with proper reference level for 8-bit samples
-        reference_level = 1.0 / (2**8)
-        power_db = 10 * np.log10(power_spectrum / reference_level + 1e-10)
-        
-        # Calculate noise floor from the lower 10% of values
-        sorted_power = np.sort(power_db)
-        noise_floor = np.mean(sorted_power[:len(sorted_power)//10])
-        
-        # Set minimum noise floor to -90 dB
-        noise_floor = max(noise_floor, -90)
-        
-        # Subtract noise floor
-        power_db = power_db - noise_floor
-        
-        # Apply minimal smoothing to preserve signal detail
-        power_db_smooth = smooth(power_db, 3)
-        
-        # Update peak hold
-        current_time = time.time()
-        if current_time - last_peak_reset > peak_hold_time:
-            # Reset peak hold periodically
-            peak_hold = np.full_like(power_db_smooth, -90)
-            last_peak_reset = current_time
-        
-        # Update peak hold values
-        peak_hold = np.maximum(peak_hold, power_db_smooth)
-        
-        # Mix current and peak hold values (95% current, 5% peak)
-        power_db_smooth = 0.95 * power_db_smooth + 0.05 * peak_hold
-        
-        # Scale to display range
-        power_db_smooth = np.clip(power_db_smooth, -90, -20)
-        
-        # Generate frequency array (in MHz)
-        freq_step = sample_rate / len(iq_segment)
-        freqs = np.arange(-len(iq_segment)//2, len(iq_segment)//2) * freq_step + center_freq
-        freq_mhz = freqs / 1e6
-        
-        # Log the frequency range for debugging
-        logging.debug(f"Frequency range: {freq_mhz[0]:.3f} MHz to {freq_mhz[-1]:.3f} MHz")
-        logging.debug(f"Center frequency: {center_freq/1e6:.3f} MHz")
-        
-        return freq_mhz, power_db_smooth
+        return display_spectrum(*welch_spectrum(iq_data))
     except Exception as e:
         logging.error(f"FFT calculation error: {str(e)}")
         # Return dummy data in case of error
@@ -701,6 +718,61 @@ def calculate_fft(iq_data):
         dummy_power = np.random.uniform(-80, -40, DISPLAY_FFT_SIZE)
         return dummy_freq, dummy_power
 
+def display_spectrum(power_spectrum, nfft):
+    """
+    Turn a Welch power spectrum (see psd.welch_power) into the display
+    trace: dB relative to the noise floor, smoothed, with peak hold.
+    Returns (frequencies in MHz, power in dB).
+    """
+    global peak_hold, last_peak_reset
+    
+    # Normalize by window power and FFT size
+    window_power = window_gain("hanning", nfft)[1]
+    power_spectrum = power_spectrum / (window_power * nfft)
+    
+    # Convert to dB with proper reference level for 8-bit samples
+    reference_level = 1.0 / (2**8)
+    power_db = 10 * np.log10(power_spectrum / reference_level + 1e-10)
+    
+    # Noise floor from the lower 10% of values (np.partition, no full sort)
+    floor = noise_floor(power_db, 0.1)
+    
+    # Set minimum noise floor to -90 dB
+    floor = max(floor, -90)
+    
+    # Subtract noise floor
+    power_db = power_db - floor
+    
+    # Apply minimal smoothing to preserve signal detail
+    power_db_smooth = smooth(power_db, 3)
+    
+    # Update peak hold
+    current_time = time.time()
+    if current_time - last_peak_reset > peak_hold_time:
+        # Reset peak hold periodically
+        peak_hold = np.full_like(power_db_smooth, -90)
+        last_peak_reset = current_time
+    
+    # Update peak hold values
+    peak_hold = np.maximum(peak_hold, power_db_smooth)
+    
+    # Mix current and peak hold values (95% current, 5% peak)
+    power_db_smooth = 0.95 * power_db_smooth + 0.05 * peak_hold
+    
+    # Scale to display range
+    power_db_smooth = np.clip(power_db_smooth, -90, -20)
+    
+    # Generate frequency array (in MHz)
+    freq_step = sample_rate / nfft
+    freqs = np.arange(-nfft//2, nfft//2) * freq_step + center_freq
+    freq_mhz = freqs / 1e6
+    
+    # Log the frequency range for debugging
+    logging.debug(f"Frequency range: {freq_mhz[0]:.3f} MHz to {freq_mhz[-1]:.3f} MHz")
+    logging.debug(f"Center frequency: {center_freq/1e6:.3f} MHz")
+    
+    return freq_mhz, power_db_smooth
+
 def update_waterfall(fft_data):
     """
     Create a waterfall display with proper signal scaling.
@@ -719,6 +791,10 @@ def update_waterfall(fft_data):
         normalized = np.interp(clipped_data, [-90, -20], [0, 255]).astype(np.uint8)
         logging.debug(f"Waterfall: normalized min/max: {np.min(normalized)}/{np.max(normalized)}")
         
+        # Start a new history when the row width changes (e.g. switching to or from sweep mode)
+        if waterfall_history and len(waterfall_history[-1]) != len(normalized):
+            waterfall_history.clear()
+        
         # Add to waterfall history
         waterfall_history.append(normalized)
         logging.debug(f"Added to waterfall_history. History length: {len(waterfall_history)}")
@@ -862,15 +938,235 @@ def get_current_location():
     
     return None, None
 
+# === SPECTRUM OUTPUT ===
+last_detection_time = 0  # Last CoT message time
+detection_counter = 0
+
+def publish_spectrum(freqs, fft_values, rssi, peak_idx=None, signals=None):
+    """
+    Publish one processed spectrum: GPS and status update, /fft data and
+    detected signals, waterfall row, and a CoT message every 5 seconds.
+    """
+    global latest_fft_data, last_detection_time, detection_counter
+    
+    # Get GPS location
+    lat, lon = get_current_location()
+    
+    if lat is not None and lon is not None:
+        latest_status["lat"] = lat
+        latest_status["lon"] = lon
+        latest_status["gps_message"] = "Fix Acquired"
+    else: # lat or lon is None, or both are None
+        # Retain last known lat/lon for display, update message
+        if gps_socket is None: # Check if init_gps failed
+            latest_status["gps_message"] = "GPSD Connection Failed"
+        else:
+            # If gps_socket exists, but no coords, it means we are waiting or no fix
+            # If latest_status["gps_message"] is already "GPSD Connection Failed", don't override it
+            if latest_status["gps_message"] != "GPSD Connection Failed":
+                latest_status["gps_message"] = "Awaiting Fix / No Fix"
+    
+    # Update status information (rssi, running, last_update)
+    latest_status.update({
+        "rssi": round(float(rssi), 2),
+        "signals": signals or [],
+        # lat, lon, and gps_message are already updated above
+        "running": monitor_config["running"],
+        "last_update": datetime.now().isoformat()
+    })
+    
+    logging.info(f"📶 RSSI: {rssi:.2f} dBFS | 🛰️ GPS Status: {latest_status['gps_message']} | 📍 Coords: {latest_status['lat']:.4f}, {latest_status['lon']:.4f}")
+    
+    # Store FFT data for web access
+    latest_fft_data = {
+        "freq": freqs.tolist(),
+        "power": fft_values.tolist(),
+        "signals": signals or [],
+        "timestamp": time.time()
+    }
+    # New detailed log for latest_fft_data update:
+    logging.info(f"latest_fft_data updated. TS: {latest_fft_data['timestamp']:.0f}, " +
+                 f"Points: {len(latest_fft_data['freq'])}, " +
+                 f"Freq Range: {latest_fft_data['freq'][0]:.2f}-{latest_fft_data['freq'][-1]:.2f} MHz" 
+                 if latest_fft_data['freq'] else "Freq: N/A")
+    
+    # Update waterfall with new FFT data
+    update_waterfall(fft_values)
+    
+    # Check if signal is above threshold for CoT message
+    current_time = time.time()
+    
+    # Send CoT messages every 5 seconds
+    if (current_time - last_detection_time >= 5):
+        
+        # Get the frequency of the peak signal if available
+        peak_freq = center_freq/1e6  # Default to center frequency
+        if peak_idx is not None and len(freqs) > 0:
+            peak_freq = freqs[peak_idx]
+        
+        # Generate a CoT message with accurate frequency information
+        detection_counter += 1
+        cot_msg = generate_cot(lat, lon, rssi, peak_freq)
+        
+        # Send to configured destination
+        cot_sock.sendto(cot_msg.encode('utf-8'), (monitor_config["dest_ip"], monitor_config["dest_port"]))
+        logging.info(f"🚨 CoT alert sent to {monitor_config['dest_ip']}:{monitor_config['dest_port']} (RSSI: {rssi:.1f} dB at {peak_freq:.3f} MHz)")
+        
+        # Update last detection time
+        last_detection_time = current_time
+
+def pipeline_spectrum(power_spectrum, info):
+    """DSP pipeline detection stage: display trace, detected signals, strongest peak and its RSSI."""
+    freqs, fft_values = display_spectrum(power_spectrum, info["nfft"])
+    signals = find_signals(power_spectrum, freqs)
+    peak_idx = signals[0]["peak"] if signals else int(np.argmax(fft_values))
+    rssi = spectrum_rssi(power_spectrum, peak_idx)
+    if info["max_amplitude"] < 5:  # Very low signal
+        logging.warning(f"Very low signal amplitude: {info['max_amplitude']}")
+    logging.info(f"Max power: {fft_values[peak_idx]:.1f} dB at {freqs[peak_idx]:.3f} MHz "
+                 f"(worker {info['worker']}, {info['dsp_ms']:.1f} ms, {info['frames_used']} frames)")
+    return freqs, fft_values, rssi, peak_idx, signals
+
+# === HACKRF CAPTURE STREAM ===
+capture_stream = None  # Persistent hackrf_transfer process while monitoring is on
+
+def start_capture_stream():
+    """
+    Return the running capture stream, starting hackrf_transfer if needed.
+    The frame size is fixed by the stream's ring, so a changed capture_size
+    restarts the stream.
+    """
+    global capture_stream
+    if capture_stream is not None and capture_stream.ring.frame_samples != monitor_config["capture_size"]:
+        logging.info(f"Capture size changed to {monitor_config['capture_size']}, restarting the HackRF stream")
+        stop_capture_stream()
+    if capture_stream is None:
+        capture_stream = HackRFStream(
+            frequency=center_freq,
+            sample_rate=monitor_config["sample_rate"],
+            lna_gain=monitor_config["lna_gain"],
+            vga_gain=monitor_config["vga_gain"],
+            frame_samples=monitor_config["capture_size"]
+        )
+        capture_stream.start()
+    return capture_stream
+
+def stop_capture_stream():
+    """Stop hackrf_transfer so the HackRF is released while monitoring is off."""
+    global capture_stream
+    if capture_stream is not None:
+        capture_stream.stop()
+        capture_stream = None
+        logging.info("HackRF capture stream stopped")
+
+file_capture = None  # In-memory capture file for "file" capture mode
+
+def get_file_capture():
+    """Return the FileCapture for the configured capture_path, recreating it if the path changed."""
+    global file_capture
+    path = monitor_config.get("capture_path", "memfd")
+    if file_capture is None or path not in (file_capture.location, file_capture.path):
+        if file_capture is not None:
+            file_capture.close()
+        file_capture = FileCapture(path)
+        logging.info(f"HackRF file capture target: {file_capture.location}")
+    return file_capture
+
+dsp_pipeline = None  # Multi-process DSP pipeline when "dsp_workers" > 0 in stream mode
+
+def run_dsp_pipeline():
+    """
+    Keep the DSP pipeline and its capture stream running with the current
+    settings. The stream writes straight into the pipeline's shared-memory ring.
+    """
+    global dsp_pipeline, capture_stream
+    workers = int(monitor_config["dsp_workers"])
+    if dsp_pipeline is not None and (dsp_pipeline.workers != workers or
+                                     dsp_pipeline.frame_samples != monitor_config["capture_size"]):
+        stop_dsp_pipeline()
+    if dsp_pipeline is None:
+        stop_capture_stream()  # The single-loop stream has its own ring
+        dsp_pipeline = DSPPipeline(
+            frame_samples=monitor_config["capture_size"],
+            workers=workers,
+            nfft=8192,
+            window="hanning",
+            on_spectrum=pipeline_spectrum,
+            on_publish=publish_spectrum
+        )
+        dsp_pipeline.start()
+        capture_stream = HackRFStream(
+            frequency=center_freq,
+            sample_rate=monitor_config["sample_rate"],
+            lna_gain=monitor_config["lna_gain"],
+            vga_gain=monitor_config["vga_gain"],
+            ring=dsp_pipeline.ring
+        )
+        capture_stream.start()
+    dsp_pipeline.configure(
+        averages=int(monitor_config.get("fft_averages", 0)),
+        overlap=float(monitor_config.get("fft_overlap", 0.5)),
+        fft_backend=monitor_config.get("fft_backend", "auto")
+    )
+    capture_stream.retune(
+        frequency=int(center_freq),
+        sample_rate=int(monitor_config["sample_rate"]),
+        lna_gain=monitor_config["lna_gain"],
+        vga_gain=monitor_config["vga_gain"]
+    )
+    # Spectra of frames captured before a retune (here or from /update_settings) are dropped
+    dsp_pipeline.tag = capture_stream.generation
+
+def stop_dsp_pipeline():
+    """Stop the capture stream feeding the pipeline, then the pipeline and its workers."""
+    global dsp_pipeline
+    if dsp_pipeline is not None:
+        stop_capture_stream()
+        dsp_pipeline.stop()
+        dsp_pipeline = None
+
+sweep_engine = None  # hackrf_sweep process in "sweep" capture mode
+
+def publish_sweep(power_db, info):
+    """Sweep engine callback: publish a complete wideband sweep like a spectrum."""
+    freqs = sweep_engine.frequencies_mhz
+    signals = find_signals(10 ** (power_db / 10), freqs)
+    peak_idx = signals[0]["peak"] if signals else int(np.argmax(power_db))
+    rssi = float(power_db[peak_idx])
+    logging.info(f"Sweep {info['sweep']}: {len(signals)} signals, peak {rssi:.1f} dB at {freqs[peak_idx]:.3f} MHz "
+                 f"({info['sweep_ms']:.0f} ms, {info['coverage']*100:.0f}% of bins)")
+    publish_spectrum(freqs, power_db, rssi, peak_idx, signals)
+
+def run_sweep():
+    """Keep hackrf_sweep running over the configured range with the current gains."""
+    global sweep_engine
+    settings = {
+        "start": monitor_config.get("sweep_start", 1000000),
+        "stop": monitor_config.get("sweep_stop", 6000000000),
+        "bin_width": monitor_config.get("sweep_bin_width", 1000000),
+        "lna_gain": monitor_config["lna_gain"],
+        "vga_gain": monitor_config["vga_gain"]
+    }
+    if sweep_engine is None:
+        sweep_engine = SweepEngine(on_sweep=publish_sweep, **settings)
+        sweep_engine.start()
+    sweep_engine.retune(**settings)
+
+def stop_sweep():
+    """Stop hackrf_sweep so the HackRF is free for the other capture modes."""
+    global sweep_engine
+    if sweep_engine is not None:
+        sweep_engine.stop()
+        sweep_engine = None
+        logging.info("HackRF sweep stopped")
+
 def monitor_loop():
     """
     Main monitoring loop that captures data from HackRF, 
     processes it, and updates displays and CoT messages.
     """
     # Initialize variables
-    last_detection_time = 0
-    detection_interval = 2  # seconds between detections
-    detection_counter = 0
+    iq_buffer = None  # complex64 samples, reused every frame
     global latest_fft_data
     
     # Log initial state
@@ -893,12 +1189,31 @@ def monitor_loop():
         try:
             # Check if monitoring is enabled
             if not monitor_config["running"]:
+                stop_sweep()
+                stop_dsp_pipeline()
+                stop_capture_stream()
                 # Only log occasional updates to avoid filling logs
                 if int(time.time()) % 30 == 0:  # Log every 30 seconds
                     logging.debug("Monitoring is OFF - waiting for user to start")
                 time.sleep(1)
                 continue
             
+            if monitor_config.get("capture_mode", "stream") == "sweep":
+                # hackrf_sweep publishes each complete sweep from its reader thread
+                stop_dsp_pipeline()
+                stop_capture_stream()
+                run_sweep()
+                time.sleep(0.5)
+                continue
+            stop_sweep()
+            
+            if int(monitor_config.get("dsp_workers", 0)) > 0 and monitor_config.get("capture_mode", "stream") != "file":
+                # Capture, DSP, detection and publishing run in the pipeline; just supervise it
+                run_dsp_pipeline()
+                time.sleep(0.5)
+                continue
+            stop_dsp_pipeline()
+            
             # Monitoring is active, capture data from HackRF
             logging.info(f"📡 Capturing samples from HackRF at {center_freq/1e6:.3f} MHz...")
             
@@ -908,43 +1223,45 @@ def monitor_loop():
             logging.info(f"Preparing HackRF capture with LNA Gain: {current_lna_gain} dB, VGA Gain: {current_vga_gain} dB")
 
             capture_success = False
+            raw_data = None
             try:
-                # Run hackrf_transfer with better parameters and more verbose error capturing
-                cmd = [
-                    "hackrf_transfer",
-                    "-r", "buffer.iq",
-                    "-f", str(center_freq),  # Use center_freq directly for consistency
-                    "-s", str(monitor_config["sample_rate"]),
-                    "-n", str(monitor_config["capture_size"]),
-                    "-a", "1",  # Enable amplifier
-                    "-l", str(current_lna_gain),  # LNA gain from config (using logged variable)
-                    "-g", str(current_vga_gain)   # VGA gain from config (using logged variable)
-                ]
-                
-                logging.debug(f"HackRF command: {' '.join(cmd)}")
-                
-                # Capture stderr to diagnose any issues
-                process = subprocess.run(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=5
-                )
-                
-                # Check result
-                if process.returncode == 0:
-                    capture_success = True
-                    logging.debug(f"HackRF capture successful, captured {os.path.getsize('buffer.iq')} bytes")
+                if monitor_config.get("capture_mode", "stream") == "file":
+                    # One hackrf_transfer run per frame into a RAM-backed file, read back via mmap
+                    stop_capture_stream()
+                    capture = get_file_capture()
+                    raw_data = capture.capture(
+                        center_freq,
+                        monitor_config["sample_rate"],
+                        monitor_config["capture_size"],
+                        lna_gain=current_lna_gain,
+                        vga_gain=current_vga_gain,
+                        timeout=5
+                    )
+                    if raw_data is not None:
+                        capture_success = True
+                        logging.debug(f"HackRF capture successful, {raw_data.size} bytes "
+                                      f"(capture {capture.last_capture_seconds*1000:.1f} ms, read {capture.last_read_seconds*1000:.1f} ms)")
+                    else:
+                        logging.error(f"HackRF capture failed: {capture.last_error}")
+                        time.sleep(1)  # Do not respawn a failing hackrf_transfer in a tight loop
                 else:
-                    stderr_output = process.stderr.decode('utf-8')
-                    logging.error(f"HackRF capture failed with return code {process.returncode}: {stderr_output}")
-                    capture_success = False
-                    
-            except subprocess.TimeoutExpired as e:
-                logging.error(f"HackRF capture timed out: {str(e)}")
-                capture_success = False
+                    # Samples come from the persistent hackrf_transfer stream; settings
+                    # changes restart it with the new frequency/gains
+                    stream = start_capture_stream()
+                    stream.retune(
+                        frequency=int(center_freq),
+                        sample_rate=int(monitor_config["sample_rate"]),
+                        lna_gain=current_lna_gain,
+                        vga_gain=current_vga_gain
+                    )
+                    raw_data = stream.read_frame(timeout=5)
+                    if raw_data is not None:
+                        capture_success = True
+                        logging.debug(f"HackRF frame received, {raw_data.size} bytes ({stream.dropped_samples} samples dropped so far)")
+                    else:
+                        logging.error(f"No samples from HackRF stream within 5 s: {stream.last_error}")
             except Exception as e:
-                logging.error(f"Error running HackRF: {str(e)}")
+                logging.error(f"Error reading HackRF samples: {str(e)}")
                 capture_success = False
             
             if not capture_success:
@@ -953,120 +1270,61 @@ def monitor_loop():
                 test_iq = np.random.normal(0, 0.5, 4096*2).view(np.complex64)
                 freqs, fft_values = calculate_fft(test_iq)
                 rssi = -70  # Default RSSI value
+                peak_idx = None
+                signals = None
             else:
                 # Process the captured IQ data
                 try:
-                    with open("buffer.iq", "rb") as f:
-                        raw_data = f.read()
-                        if len(raw_data) < 1000:
-                            logging.error(f"Captured IQ file too small: {len(raw_data)} bytes")
-                            raise ValueError("Invalid IQ data size")
-                            
-                        raw = np.frombuffer(raw_data, dtype=np.int8)
-                        iq = raw[::2] + 1j * raw[1::2]
-                        
-                        # Check if IQ data looks reasonable
-                        max_amplitude = np.max(np.abs(iq))
-                        if max_amplitude < 5:  # Very low signal
-                            logging.warning(f"Very low signal amplitude: {max_amplitude}")
-                        
-                        # Scale IQ data to proper range (-1 to 1)
-                        iq = iq.astype(np.float32) / 128.0
-                        
-                        # DC spike removal - subtract mean from IQ data
-                        iq = iq - np.mean(iq)
-                        
-                        # Calculate FFT for spectrum display
-                        freqs, fft_values = calculate_fft(iq)
-                        
-                        # Output max power for diagnostics
-                        max_power = np.max(fft_values)
-                        max_power_idx = np.argmax(fft_values)
-                        max_power_freq = freqs[max_power_idx]
-                        logging.info(f"Max power: {max_power:.1f} dB at {max_power_freq:.3f} MHz")
-                        
-                        # Find the strongest peak in the FFT
-                        peak_idx = max_power_idx
-                        
-                        # Calculate RSSI focusing on the peak
-                        rssi = calculate_rssi(iq, len(fft_values), peak_idx)
-                        
+                    raw = raw_data  # int8 view into the capture ring, valid until the next read_frame()
+                    
+                    # Check if IQ data looks reasonable (peak I/Q component, no temporary arrays)
+                    max_amplitude = max(int(raw.max()), -int(raw.min()))
+                    if max_amplitude < 5:  # Very low signal
+                        logging.warning(f"Very low signal amplitude: {max_amplitude}")
+                    
+                    # Convert and scale IQ data to complex64 in the proper range (-1 to 1), in one pass
+                    if iq_buffer is None or iq_buffer.size != raw.size // 2:
+                        iq_buffer = np.empty(raw.size // 2, dtype=np.complex64)
+                    iq = int8_to_complex64(raw, out=iq_buffer)
+                    
+                    # DC spike removal - subtract mean from IQ data in place
+                    iq -= np.mean(iq)
+                    
+                    # Welch power spectrum, display trace and every signal above the CFAR threshold
+                    power_spectrum, nfft = welch_spectrum(iq)
+                    freqs, fft_values = display_spectrum(power_spectrum, nfft)
+                    signals = find_signals(power_spectrum, freqs)
+                    
+                    # Output max power for diagnostics
+                    max_power_idx = int(np.argmax(fft_values))
+                    logging.info(f"Max power: {fft_values[max_power_idx]:.1f} dB at {freqs[max_power_idx]:.3f} MHz, "
+                                 f"{len(signals)} signals detected")
+                    for signal in signals[:5]:
+                        logging.debug(f"Signal at {signal['freq']:.3f} MHz: SNR {signal['snr_db']:.1f} dB, "
+                                      f"{signal['bandwidth']*1000:.1f} kHz")
+                    
+                    # Strongest detected signal, or the highest bin if nothing crossed the threshold
+                    peak_idx = signals[0]["peak"] if signals else max_power_idx
+                    
+                    # RSSI of the peak region, from the same Welch spectrum (no second FFT)
+                    rssi = spectrum_rssi(power_spectrum, peak_idx)
+                    
                 except Exception as e:
                     logging.error(f"Error processing IQ data: {str(e)}")
                     # Use random data if processing failed
                     test_iq = np.random.normal(0, 0.5, 4096*2).view(np.complex64)
                     freqs, fft_values = calculate_fft(test_iq)
                     rssi = -70  # Default RSSI value
+                    peak_idx = None
+                    signals = None
             
-            # Get GPS location
-            lat, lon = get_current_location()
-            
-            if lat is not None and lon is not None:
-                latest_status["lat"] = lat
-                latest_status["lon"] = lon
-                latest_status["gps_message"] = "Fix Acquired"
-            else: # lat or lon is None, or both are None
-                # Retain last known lat/lon for display, update message
-                if gps_socket is None: # Check if init_gps failed
-                    latest_status["gps_message"] = "GPSD Connection Failed"
-                else:
-                    # If gps_socket exists, but no coords, it means we are waiting or no fix
-                    # If latest_status["gps_message"] is already "GPSD Connection Failed", don't override it
-                    if latest_status["gps_message"] != "GPSD Connection Failed":
-                        latest_status["gps_message"] = "Awaiting Fix / No Fix"
-            
-            # Update status information (rssi, running, last_update)
-            latest_status.update({
-                "rssi": round(rssi, 2),
-                # lat, lon, and gps_message are already updated above
-                "running": monitor_config["running"],
-                "last_update": datetime.now().isoformat()
-            })
-            
-            logging.info(f"📶 RSSI: {rssi:.2f} dBFS | 🛰️ GPS Status: {latest_status['gps_message']} | 📍 Coords: {latest_status['lat']:.4f}, {latest_status['lon']:.4f}")
-            
-            # Store FFT data for web access
-            latest_fft_data = {
-                "freq": freqs.tolist(),
-                "power": fft_values.tolist(),
-                "timestamp": time.time()
-            }
-            # New detailed log for latest_fft_data update:
-            logging.info(f"latest_fft_data updated. TS: {latest_fft_data['timestamp']:.0f}, " +
-                         f"Points: {len(latest_fft_data['freq'])}, " +
-                         f"Freq Range: {latest_fft_data['freq'][0]:.2f}-{latest_fft_data['freq'][-1]:.2f} MHz" 
-                         if latest_fft_data['freq'] else "Freq: N/A")
-            
-            # Update waterfall with new FFT data
-            update_waterfall(fft_values)
-            
-            # Check if signal is above threshold for CoT message
-            current_time = time.time()
-            
-            # Send CoT messages every 5 seconds
-            if (current_time - last_detection_time >= 5):
-                
-                # Get the frequency of the peak signal if available
-                peak_freq = center_freq/1e6  # Default to center frequency
-                if 'peak_idx' in locals() and len(freqs) > 0:
-                    peak_freq = freqs[peak_idx]
-                
-                # Generate a CoT message with accurate frequency information
-                detection_counter += 1
-                cot_msg = generate_cot(lat, lon, rssi, peak_freq)
-                
-                # Send to configured destination
-                cot_sock.sendto(cot_msg.encode('utf-8'), (monitor_config["dest_ip"], monitor_config["dest_port"]))
-                logging.info(f"🚨 CoT alert sent to {monitor_config['dest_ip']}:{monitor_config['dest_port']} (RSSI: {rssi:.1f} dB at {peak_freq:.3f} MHz)")
-                
-                # Update last detection time
-                last_detection_time = current_time
+            # Status, /fft data, waterfall and CoT
+            publish_spectrum(freqs, fft_values, rssi, peak_idx, signals)
                 
         except Exception as e:
             logging.error(f"Error in monitor loop: {str(e)}")
-        
-        # Sleep briefly before next iteration
-        time.sleep(1)
+            # Back off briefly so a persistent error does not spin
+            time.sleep(1)
 
 # === FLASK ROUTES ===
 @app.route("/", methods=["GET"])
@@ -1165,14 +1423,9 @@ def update_settings():
                 except Exception as e:
                     logging.error(f"Error creating empty waterfall: {str(e)}")
                 
-                # If monitoring is active, restart the HackRF capture immediately
-                if monitor_config["running"]:
-                    try:
-                        # Run HackRF reset to stop any ongoing transfers
-                        subprocess.run(["hackrf_reset"], check=True, timeout=2)
-                        logging.info("Reset HackRF for frequency change")
-                    except Exception as e:
-                        logging.error(f"Failed to reset HackRF: {str(e)}")
+                # If monitoring is active, retune the HackRF capture stream immediately
+                if capture_stream is not None:
+                    capture_stream.retune(frequency=int(center_freq))
         
         # Save configuration to file
         save_config()
@@ -1258,7 +1511,13 @@ def get_status():
         "vga_gain": monitor_config.get("vga_gain", 62),
         "last_update": latest_status["last_update"],
         "center_freq": monitor_config.get("frequency", center_freq),
-        "sample_rate": monitor_config.get("sample_rate", sample_rate)
+        "sample_rate": monitor_config.get("sample_rate", sample_rate),
+        "capture_mode": monitor_config.get("capture_mode", "stream"),
+        "capture": capture_stream.stats() if capture_stream is not None else None,
+        "file_capture": file_capture.stats() if file_capture is not None else None,
+        "pipeline": dsp_pipeline.stats() if dsp_pipeline is not None else None,
+        "sweep": sweep_engine.stats() if sweep_engine is not None else None,
+        "signals": latest_status.get("signals", [])
     })
 
 # === ENSURE GPSD RUNNING ===
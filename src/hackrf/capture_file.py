@@ -0,0 +1,124 @@
+"""
+One-shot HackRF captures into an in-memory file.
+
+`hackrf_transfer -r <file> -n N` needs a file name. Writing `buffer.iq` in
+the working directory puts every capture on the SD card and reads it back.
+Here the file is a memfd (anonymous RAM-backed file, passed to the child as
+/proc/self/fd/N) or a path on a tmpfs such as /dev/shm. It is read back
+through mmap into a preallocated buffer.
+
+The stream mode in hackrf_stream.py avoids files entirely. This mode is for
+setups that need the HackRF released between captures.
+"""
+import logging
+import mmap
+import os
+import subprocess
+import time
+
+import numpy as np
+
+MEMFD = "memfd"
+TMPFS_FALLBACK = "/dev/shm/hackrf_buffer.iq"
+
+
+class FileCapture:
+    """Runs one hackrf_transfer capture at a time into `path` ("memfd" or a file path)."""
+
+    def __init__(self, path=MEMFD, command="hackrf_transfer"):
+        self.command = command
+        self._fd = None
+        if path == MEMFD and hasattr(os, "memfd_create"):
+            self._fd = os.memfd_create("hackrf-capture")
+            self.path = f"/proc/{os.getpid()}/fd/{self._fd}"
+            self.location = MEMFD
+        else:
+            if path == MEMFD:
+                path = TMPFS_FALLBACK
+                logging.warning(f"memfd not available, capturing to {path}")
+            self.path = path
+            self.location = path
+        self._buffer = np.zeros(0, dtype=np.int8)
+        self.captures = 0
+        self.last_bytes = 0
+        self.last_capture_seconds = 0.0
+        self.last_read_seconds = 0.0
+        self.total_read_seconds = 0.0
+        self.last_error = None
+
+    def capture(self, frequency, sample_rate, samples, lna_gain=None, vga_gain=None, amp=True, timeout=5):
+        """
+        Capture `samples` IQ samples; returns a read-only int8 array of
+        interleaved I/Q, or None on failure. The array is reused by the next
+        capture.
+        """
+        cmd = [self.command, "-r", self.path, "-f", str(int(frequency)), "-s", str(int(sample_rate)),
+               "-n", str(int(samples))]
+        if amp:
+            cmd += ["-a", "1"]
+        if lna_gain is not None:
+            cmd += ["-l", str(lna_gain)]
+        if vga_gain is not None:
+            cmd += ["-g", str(vga_gain)]
+
+        started = time.perf_counter()
+        try:
+            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        except (subprocess.TimeoutExpired, OSError) as e:
+            self.last_error = f"hackrf_transfer failed: {e}"
+            return None
+        self.last_capture_seconds = time.perf_counter() - started
+        if process.returncode != 0:
+            self.last_error = (f"hackrf_transfer exited with code {process.returncode}: "
+                               f"{process.stderr.decode('utf-8', 'ignore').strip()}")
+            return None
+
+        started = time.perf_counter()
+        frame = self._read()
+        self.last_read_seconds = time.perf_counter() - started
+        self.total_read_seconds += self.last_read_seconds
+        if frame is None:
+            self.last_error = "Capture file is empty"
+            return None
+        self.captures += 1
+        self.last_bytes = frame.size
+        self.last_error = None
+        return frame
+
+    def _read(self):
+        fd = self._fd if self._fd is not None else os.open(self.path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            size -= size % 2  # Whole I/Q pairs only
+            if size == 0:
+                return None
+            if self._buffer.size < size:
+                self._buffer = np.zeros(size, dtype=np.int8)
+            # Copy out of the mapping at once: the next capture truncates the
+            # file, and touching a truncated mapping would raise SIGBUS
+            with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mapped:
+                source = np.frombuffer(mapped, dtype=np.int8)
+                np.copyto(self._buffer[:size], source)
+                del source
+        finally:
+            if self._fd is None:
+                os.close(fd)
+        frame = self._buffer[:size]
+        frame.flags.writeable = False
+        return frame
+
+    def stats(self):
+        return {
+            "location": self.location,
+            "captures": self.captures,
+            "last_bytes": self.last_bytes,
+            "last_capture_ms": round(self.last_capture_seconds * 1000, 2),
+            "last_read_ms": round(self.last_read_seconds * 1000, 2),
+            "mean_read_ms": round(self.total_read_seconds * 1000 / self.captures, 2) if self.captures else None,
+            "last_error": self.last_error,
+        }
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
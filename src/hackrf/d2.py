@@ -24,6 +24,10 @@ import uuid  # For generating unique UIDs
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 import math
+from hackrf_stream import HackRFStream
+from iq_convert import int8_to_complex64
+from psd import welch_power
+from fft_backend import get_backend, get_window, window_gain
 
 # === LOGGING ===
 logging.basicConfig(level=logging.DEBUG, format='[%(asctime)s] %(levelname)s: %(message)s')
@@ -61,6 +65,10 @@ monitor_config = {
     "dest_ip": "239.2.3.1",
     "dest_port": 18999,
     "capture_size": 2**22,  # Increased from 2**20
+    "fft_averages": 0,  # Welch frames averaged per spectrum (0 = whole capture, 1 = single FFT)
+    "fft_overlap": 0.5,  # Overlap between Welch frames
+    "fft_backend": "auto",  # "auto", "pyfftw", "scipy" or "numpy"
+    "fft_workers": -1,  # FFT threads for scipy/pyfftw (-1 = all cores)
     "running": False        # Add running state
 }
 
@@ -563,6 +571,10 @@ def setup_multicast_socket():
 # Global socket for CoT messages
 cot_sock = setup_multicast_socket()
 
+def current_fft_backend():
+    """FFT backend selected by "fft_backend"/"fft_workers" in the config (see fft_backend.py)."""
+    return get_backend(monitor_config.get("fft_backend", "auto"), int(monitor_config.get("fft_workers", -1)))
+
 def calculate_rssi(iq_data, freq_bins=None, bin_center=None):
     """
     Calculate RSSI more accurately by focusing on the peak in the FFT or 
@@ -589,11 +601,11 @@ def calculate_rssi(iq_data, freq_bins=None, bin_center=None):
         iq_segment = iq_data[:max_samples]
         
         # Apply window
-        window = np.hanning(len(iq_segment))
+        window = get_window("hanning", len(iq_segment), np.float32)
         windowed_iq = iq_segment * window
         
         # Calculate FFT
-        fft_result = np.fft.fftshift(np.fft.fft(windowed_iq))
+        fft_result = np.fft.fftshift(current_fft_backend().fft(windowed_iq))
         power_db = 10 * np.log10(np.abs(fft_result)**2 / len(fft_result)**2 + 1e-10)
         
         # Find power in the region of interest
@@ -621,7 +633,9 @@ def dbfs(iq):
 def calculate_fft(iq_data, center_freq, sample_rate):
     """
     Calculate FFT from IQ data with proper normalization and windowing.
-    Includes DC cancellation and enhanced signal visibility.
+    Includes DC cancellation and enhanced signal visibility. The power is
+    Welch-averaged over overlapping 8192-sample frames of the capture
+    ("fft_averages" frames, 0 = the whole capture).
     
     Args:
         iq_data: Complex IQ samples
@@ -633,23 +647,25 @@ def calculate_fft(iq_data, center_freq, sample_rate):
         power: Array of power values in dB
     """
     try:
-        # Use a reasonable segment size for processing
-        max_samples = min(len(iq_data), 8192)  # Increased for better resolution
-        iq_segment = iq_data[:max_samples]
-        
-        # DC offset removal (important to remove the center spike)
-        iq_segment = iq_segment - np.mean(iq_segment)
+        # FFT size per frame
+        nfft = min(len(iq_data), 8192)  # Increased for better resolution
         
         # Apply Blackman window for better side-lobe suppression
-        window = np.blackman(len(iq_segment))
-        windowed_iq = iq_segment * window
+        window = get_window("blackman", nfft, np.float32)
         
-        # Calculate FFT and shift zero frequency to center
-        fft_result = np.fft.fftshift(np.fft.fft(windowed_iq))
+        # Average |FFT|^2 over overlapping frames (welch_power removes the DC offset,
+        # important to remove the center spike, and shifts zero frequency to center)
+        power, frames_used = welch_power(
+            iq_data, nfft, window,
+            averages=int(monitor_config.get("fft_averages", 0)),
+            overlap=float(monitor_config.get("fft_overlap", 0.5)),
+            fft=current_fft_backend().fft
+        )
+        logging.debug(f"Welch PSD averaged over {frames_used} frames")
         
         # Calculate power in dB (with normalization)
         # Add small constant to avoid log of zero
-        power_db = 10 * np.log10(np.abs(fft_result)**2 / len(fft_result)**2 + 1e-10)
+        power_db = 10 * np.log10(power / nfft**2 + 1e-10)
         
         # Apply smoothing with a 81-point window for better visibility (increased from 7)
         # Increased further to 101 points for even more smoothing
@@ -661,8 +677,7 @@ def calculate_fft(iq_data, center_freq, sample_rate):
         power_db_smooth = power_db_smooth * (80 / max(np.max(power_db_smooth), 1)) - 110
         
         # Generate frequency array (in MHz)
-        freq_step = sample_rate / len(iq_segment)
-        freqs = np.fft.fftshift(np.fft.fftfreq(len(iq_segment), 1/sample_rate))
+        freqs = np.fft.fftshift(np.fft.fftfreq(nfft, 1/sample_rate))
         freq_mhz = freqs / 1e6
         
         # Adjust frequency to account for center frequency
@@ -869,6 +884,31 @@ def get_current_location():
     
     return None, None
 
+# === HACKRF CAPTURE STREAM ===
+capture_stream = None  # Persistent hackrf_transfer process while monitoring is on
+
+def start_capture_stream():
+    """Return the running capture stream, starting hackrf_transfer if needed."""
+    global capture_stream
+    if capture_stream is None:
+        capture_stream = HackRFStream(
+            frequency=monitor_config["frequency"],
+            sample_rate=monitor_config["sample_rate"],
+            lna_gain=monitor_config["lna_gain"],
+            vga_gain=monitor_config["vga_gain"],
+            frame_samples=monitor_config["capture_size"]
+        )
+        capture_stream.start()
+    return capture_stream
+
+def stop_capture_stream():
+    """Stop hackrf_transfer so the HackRF is released while monitoring is off."""
+    global capture_stream
+    if capture_stream is not None:
+        capture_stream.stop()
+        capture_stream = None
+        logging.info("HackRF capture stream stopped")
+
 def monitor_loop():
     """
     Main monitoring loop that captures data from HackRF, 
@@ -878,6 +918,7 @@ def monitor_loop():
     last_detection_time = 0
     # detection_interval = 2  # seconds between detections # Unused variable
     detection_counter = 0 # Unused variable, can be removed if not planned for future use
+    iq_buffer = None # complex64 samples, reused every frame
     global latest_fft_data, center_freq # Ensure center_freq is accessible if used for defaults
     
     logging.info(f"Monitor loop starting (monitoring is {'ON' if monitor_config['running'] else 'OFF'})")
@@ -900,6 +941,7 @@ def monitor_loop():
     while True:
         try:
             if not monitor_config["running"]:
+                stop_capture_stream()
                 if int(time.time()) % 30 == 0:
                     logging.debug("Monitoring is OFF - waiting for user to start")
                 time.sleep(1)
@@ -911,26 +953,24 @@ def monitor_loop():
             logging.info(f"Preparing HackRF capture with LNA Gain: {current_lna_gain} dB, VGA Gain: {current_vga_gain} dB")
 
             capture_success = False
+            raw_data = None
             try:
-                cmd = [
-                    "hackrf_transfer", "-r", "buffer.iq",
-                    "-f", str(monitor_config["frequency"]), # Use frequency from monitor_config
-                    "-s", str(monitor_config["sample_rate"]),
-                    "-n", str(monitor_config["capture_size"]),
-                    "-a", "1", "-l", str(current_lna_gain), "-g", str(current_vga_gain)
-                ]
-                logging.debug(f"HackRF command: {' '.join(cmd)}")
-                process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10) # Increased timeout slightly
-                if process.returncode == 0:
+                # Persistent hackrf_transfer stream; retune restarts it only when settings change
+                stream = start_capture_stream()
+                stream.retune(
+                    frequency=int(monitor_config["frequency"]),
+                    sample_rate=int(monitor_config["sample_rate"]),
+                    lna_gain=current_lna_gain,
+                    vga_gain=current_vga_gain
+                )
+                raw_data = stream.read_frame(timeout=10)
+                if raw_data is not None:
                     capture_success = True
-                    logging.debug(f"HackRF capture successful, captured {os.path.getsize('buffer.iq')} bytes")
+                    logging.debug(f"HackRF frame received, {raw_data.size} bytes ({stream.dropped_samples} samples dropped so far)")
                 else:
-                    stderr_output = process.stderr.decode('utf-8', 'ignore')
-                    logging.error(f"HackRF capture failed with return code {process.returncode}: {stderr_output}")
-            except subprocess.TimeoutExpired as e:
-                logging.error(f"HackRF capture timed out: {str(e)}")
+                    logging.error(f"No samples from HackRF stream within 10 s: {stream.last_error}")
             except Exception as e:
-                logging.error(f"Error running HackRF: {str(e)}")
+                logging.error(f"Error reading HackRF stream: {str(e)}")
 
             # Initialize defaults for this iteration's values
             freqs_for_display = []
@@ -950,16 +990,14 @@ def monitor_loop():
                 rssi_for_ui_panel = -70.0
             else:  # Capture was successful
                 try:
-                    with open("buffer.iq", "rb") as f:
-                        raw_data = f.read()
-                        if len(raw_data) < 1000:
-                            logging.error(f"Captured IQ file too small: {len(raw_data)} bytes")
-                            raise ValueError("Invalid IQ data size")
-                        raw = np.frombuffer(raw_data, dtype=np.int8)
-                        local_iq_data_for_calc_rssi = raw[::2] + 1j * raw[1::2]
-                        max_amplitude = np.max(np.abs(local_iq_data_for_calc_rssi))
-                        if max_amplitude < 5: logging.warning(f"Very low signal amplitude: {max_amplitude}")
-                        local_iq_data_for_calc_rssi = local_iq_data_for_calc_rssi - np.mean(local_iq_data_for_calc_rssi)
+                    raw = raw_data  # int8 view into the capture ring, valid until the next read_frame()
+                    max_amplitude = max(int(raw.max()), -int(raw.min())) # Peak I/Q component, no temporaries
+                    if max_amplitude < 5: logging.warning(f"Very low signal amplitude: {max_amplitude}")
+                    if iq_buffer is None or iq_buffer.size != raw.size // 2:
+                        iq_buffer = np.empty(raw.size // 2, dtype=np.complex64)
+                    # Unscaled (raw int8 units) complex64, as the display/RSSI scaling here expects
+                    local_iq_data_for_calc_rssi = int8_to_complex64(raw, out=iq_buffer, scale=1.0)
+                    local_iq_data_for_calc_rssi -= np.mean(local_iq_data_for_calc_rssi)
                     
                     valid_iq_data_available_for_calculate_rssi = True
                     # Pass current monitor_config frequency to calculate_fft
@@ -1041,8 +1079,7 @@ def monitor_loop():
                 
         except Exception as e:
             logging.error(f"Major error in monitor_loop: {str(e)}", exc_info=True) # Add exc_info for traceback
-        
-        time.sleep(1) # Brief sleep before next iteration
+            time.sleep(1) # Back off so a persistent error does not spin
 
 # === FLASK ROUTES ===
 @app.route("/", methods=["GET"])
@@ -1141,14 +1178,9 @@ def update_settings():
                 except Exception as e:
                     logging.error(f"Error creating empty waterfall: {str(e)}")
                 
-                # If monitoring is active, restart the HackRF capture immediately
-                if monitor_config["running"]:
-                    try:
-                        # Run HackRF reset to stop any ongoing transfers
-                        subprocess.run(["hackrf_reset"], check=True, timeout=2)
-                        logging.info("Reset HackRF for frequency change")
-                    except Exception as e:
-                        logging.error(f"Failed to reset HackRF: {str(e)}")
+                # If monitoring is active, retune the HackRF capture stream immediately
+                if capture_stream is not None:
+                    capture_stream.retune(frequency=int(center_freq))
         
         # Save configuration to file
         save_config()
@@ -1234,7 +1266,8 @@ def get_status():
         "vga_gain": monitor_config.get("vga_gain", 36),
         "last_update": latest_status["last_update"],
         "center_freq": monitor_config.get("frequency", center_freq),
-        "sample_rate": monitor_config.get("sample_rate", sample_rate)
+        "sample_rate": monitor_config.get("sample_rate", sample_rate),
+        "capture": capture_stream.stats() if capture_stream is not None else None
     })
 
 # === ENSURE GPSD RUNNING ===
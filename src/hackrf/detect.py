@@ -11,6 +11,9 @@ from datetime import datetime, timedelta
 from flask import Flask, render_template_string, request
 from flask_socketio import SocketIO
 from gps3 import gps3
+from hackrf_stream import HackRFStream
+from capture_file import FileCapture
+from iq_convert import int8_to_complex64
 
 # === FLASK SETUP ===
 app = Flask(__name__)
@@ -21,13 +24,15 @@ monitor_config = {
     "frequency": 433000000,
     "sample_rate": 2000000,
     "capture_size": 2**20,
+    "capture_mode": "stream",  # "stream" or "file" (one hackrf_transfer run per frame)
+    "capture_path": "memfd",   # File mode target: "memfd" or a tmpfs path
     "threshold": -30,
     "dest_ip": "192.168.1.100",
     "dest_port": 9999,
     "running": False
 }
 
-latest_status = {"rssi": None, "lat": None, "lon": None}
+latest_status = {"rssi": None, "lat": None, "lon": None, "dropped_samples": 0, "capture_ms": None, "read_ms": None}
 
 # === LOGGING ===
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -103,6 +108,11 @@ TEMPLATE = """
     <h3>Status:</h3>
     <p><strong>Last RSSI:</strong> {{ status.rssi }}</p>
     <p><strong>Last GPS:</strong> {{ status.lat }}, {{ status.lon }}</p>
+    {% if config.capture_mode == 'file' %}
+    <p><strong>Capture / read time:</strong> {{ status.capture_ms }} ms / {{ status.read_ms }} ms ({{ config.capture_path }})</p>
+    {% else %}
+    <p><strong>Dropped samples:</strong> {{ status.dropped_samples }}</p>
+    {% endif %}
   </div>
 </div>
 </body>
@@ -175,24 +185,59 @@ def generate_cot(uid, cot_type, lat, lon, freq):
   </detail>
 </event>"""
 
+capture_stream = None
+file_capture = None
+
+def read_stream():
+    global capture_stream
+    if capture_stream is None:
+        logging.info("📡 Starting HackRF sample stream...")
+        capture_stream = HackRFStream(monitor_config["frequency"], monitor_config["sample_rate"],
+                                      amp=False, frame_samples=monitor_config["capture_size"])
+        capture_stream.start()
+    capture_stream.retune(frequency=monitor_config["frequency"])
+
+    data = capture_stream.read_frame(timeout=5)
+    latest_status["dropped_samples"] = capture_stream.dropped_samples
+    if data is None:
+        logging.warning(f"⚠️ No samples from HackRF: {capture_stream.last_error}")
+    return data
+
+def read_file_capture():
+    global file_capture
+    if file_capture is None or monitor_config["capture_path"] not in (file_capture.location, file_capture.path):
+        if file_capture is not None:
+            file_capture.close()
+        file_capture = FileCapture(monitor_config["capture_path"])
+
+    logging.info("📡 Capturing samples from HackRF...")
+    data = file_capture.capture(monitor_config["frequency"], monitor_config["sample_rate"],
+                                monitor_config["capture_size"], amp=False)
+    stats = file_capture.stats()
+    latest_status.update({"capture_ms": stats["last_capture_ms"], "read_ms": stats["last_read_ms"]})
+    if data is None:
+        logging.warning(f"⚠️ HackRF capture failed: {file_capture.last_error}")
+        time.sleep(1)
+    return data
+
 def monitor_loop():
+    global capture_stream
+    iq_buffer = None
     while True:
+        file_mode = monitor_config["capture_mode"] == "file"
+        if capture_stream is not None and (file_mode or not monitor_config["running"]):
+            capture_stream.stop()
+            capture_stream = None
         if not monitor_config["running"]:
             time.sleep(1)
             continue
 
-        logging.info("📡 Capturing samples from HackRF...")
-        subprocess.run(
-            ["hackrf_transfer", "-r", "buffer.iq",
-             "-f", str(monitor_config["frequency"]),
-             "-s", str(monitor_config["sample_rate"]),
-             "-n", str(monitor_config["capture_size"])],
-            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        )
-
-        with open("buffer.iq", "rb") as f:
-            raw = np.frombuffer(f.read(), dtype=np.int8)
-            iq = raw[::2] + 1j * raw[1::2]
+        raw = read_file_capture() if file_mode else read_stream()  # int8 view, valid until the next read
+        if raw is None:
+            continue
+        if iq_buffer is None or iq_buffer.size != raw.size // 2:
+            iq_buffer = np.empty(raw.size // 2, dtype=np.complex64)
+        iq = int8_to_complex64(raw, out=iq_buffer, scale=1.0)  # Raw int8 units, as before
 
         rssi = dbfs(iq)
         lat, lon = get_current_location()
@@ -204,8 +249,6 @@ def monitor_loop():
             sock.sendto(cot_msg.encode('utf-8'), (monitor_config["dest_ip"], monitor_config["dest_port"]))
             logging.info(f"🚨 CoT alert sent to {monitor_config['dest_ip']}:{monitor_config['dest_port']}")
 
-        time.sleep(1)
-
 # === FLASK ROUTES ===
 @app.route("/", methods=["GET"])
 def index():
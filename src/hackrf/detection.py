@@ -0,0 +1,113 @@
+"""
+Noise floor estimation and CFAR signal detection on a power spectrum.
+
+`noise_floor` averages the weakest bins of a spectrum using np.partition,
+which is O(n) instead of the O(n log n) of sorting the whole vector.
+
+`cfar_detect` replaces "the strongest bin is the signal" with a constant
+false alarm rate detector: every bin is compared with the noise level of
+the training cells around it (skipping guard cells next to it), plus a
+fixed offset. Two noise estimators are provided:
+
+- "ca" (cell averaging): mean of the training cells, from a cumulative
+  sum, so the whole spectrum costs O(n).
+- "os" (ordered statistic): a rank (e.g. the 75th percentile) of the
+  training cells. More robust when a second signal or a wide signal's
+  skirt falls in the training window, at O(n * training cells).
+
+Adjacent bins above the threshold are grouped into clusters, and each
+cluster is reported as one signal with its peak bin, width and SNR, so
+several simultaneous carriers are found in one pass.
+
+The detector works on linear power (CFAR thresholds are ratios, so any
+scaling of the spectrum is fine); convert dB spectra with 10 ** (dB / 10).
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+CFAR_METHODS = ("ca", "os")
+
+
+def noise_floor(power, fraction=0.1):
+    """Mean of the lowest `fraction` of the values in `power`, without a full sort."""
+    power = np.asarray(power)
+    k = max(1, int(len(power) * fraction))
+    return float(np.mean(np.partition(power, k - 1)[:k]))
+
+
+def cfar_noise(power, train=16, guard=4, method="ca", rank=0.75):
+    """
+    Local noise level for every bin: the mean ("ca") or the `rank` quantile
+    ("os") of `train` cells on each side, outside `guard` cells around it.
+    The spectrum is mirrored at its edges so edge bins have full windows;
+    spectra shorter than the window (e.g. a coarse sweep) get a narrower one.
+    """
+    if method not in CFAR_METHODS:
+        raise ValueError(f"Unknown CFAR method '{method}', expected one of {CFAR_METHODS}")
+    power = np.asarray(power, dtype=np.float64)
+    n = len(power)
+    if n == 0:
+        return power
+    guard = min(guard, (n - 1) // 2)
+    train = max(1, min(train, n - guard))  # The mirrored padding reaches at most n bins
+    reach = train + guard
+    padded = np.concatenate((power[reach - 1::-1], power, power[:-reach - 1:-1]))  # np.pad "symmetric", faster
+    if method == "ca":
+        total = np.concatenate(([0.0], np.cumsum(padded)))
+        outer = total[2 * reach + 1:2 * reach + 1 + n] - total[:n]
+        inner = total[reach + guard + 1:reach + guard + 1 + n] - total[train:train + n]
+        return (outer - inner) / (2 * train)
+    windows = sliding_window_view(padded, 2 * reach + 1)
+    cells = np.concatenate((windows[:, :train], windows[:, -train:]), axis=1)
+    k = min(2 * train - 1, int(rank * 2 * train))
+    return np.partition(cells, k, axis=1)[:, k]
+
+
+def find_clusters(mask, merge_gap=1):
+    """(starts, stops) of runs of True in `mask`; runs separated by <= merge_gap bins are merged."""
+    padded = np.zeros(len(mask) + 2, dtype=np.int8)
+    padded[1:-1] = mask
+    edges = np.flatnonzero(padded[1:] != padded[:-1])  # Alternating run starts and stops
+    starts, stops = edges[::2], edges[1::2]
+    if len(starts) > 1 and merge_gap > 0:
+        keep = starts[1:] - stops[:-1] > merge_gap
+        starts = np.concatenate((starts[:1], starts[1:][keep]))
+        stops = np.concatenate((stops[:-1][keep], stops[-1:]))
+    return starts, stops
+
+
+def cfar_detect(power, freqs=None, train=16, guard=4, offset_db=10.0, method="ca", rank=0.75,
+                merge_gap=1, min_bins=1, max_signals=None):
+    """
+    Signals in a linear power spectrum, strongest SNR first.
+
+    Each signal is a dict with "start"/"stop" (bin range, stop exclusive),
+    "peak" (bin of the maximum), "snr_db" (peak over the local noise) and
+    "bins"; with `freqs` (bin centers, any unit) also "freq" at the peak and
+    "bandwidth" in the same unit.
+    """
+    power = np.asarray(power)
+    noise = cfar_noise(power, train, guard, method, rank)
+    above = power > noise * 10 ** (offset_db / 10)
+    starts, stops = find_clusters(above, merge_gap)
+    if min_bins > 1:
+        wide = stops - starts >= min_bins
+        starts, stops = starts[wide], stops[wide]
+
+    signals = []
+    for start, stop in zip(starts, stops):
+        peak = int(start) + int(np.argmax(power[start:stop]))
+        signal = {
+            "start": int(start),
+            "stop": int(stop),
+            "peak": peak,
+            "bins": int(stop - start),
+            "snr_db": float(10 * np.log10(power[peak] / max(noise[peak], 1e-30))),
+        }
+        if freqs is not None:
+            step = freqs[1] - freqs[0] if len(freqs) > 1 else 0
+            signal["freq"] = float(freqs[peak])
+            signal["bandwidth"] = float((stop - start) * step)
+        signals.append(signal)
+    signals.sort(key=lambda s: s["snr_db"], reverse=True)
+    return signals[:max_signals] if max_signals else signals
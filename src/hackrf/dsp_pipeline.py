@@ -0,0 +1,429 @@
+"""
+Multi-process DSP pipeline: capture -> DSP workers -> detection -> publish.
+
+In the serial monitor loop one thread reads a frame, converts it, runs the
+Welch FFT, updates the displays and sends CoT before it reads the next
+frame, so a slow step (or the GIL) stalls every other one and frames are
+overwritten in the ring while the FFT runs. Here the stages are decoupled:
+
+- capture: HackRFStream fills the slots of an IQRing whose buffer lives in
+  multiprocessing shared memory.
+- DSP: `workers` processes each take a slot index from a task queue,
+  convert the int8 samples and compute the Welch power spectrum straight
+  from shared memory, and write it to the matching slot of a second shared
+  array. Only slot indices and small result dicts cross process boundaries.
+- detection and publish: threads in the main process fed by bounded queues
+  that drop their oldest entry when full, so a slow consumer sheds load
+  instead of building latency.
+
+The worker processes are started with the "spawn" method, which re-imports
+the main script in each worker: the script must keep its startup code under
+`if __name__ == "__main__":`. `stats()` reports queue depths, per-stage
+timings and drop counters.
+
+Each worker publishes the sequence number of the task it is running in a
+shared array. A slot is only handed back to the ring once its result has
+arrived or the worker holding it is gone, so a slow worker can never write
+into a slot that is already carrying a newer frame. A worker stuck on one
+task for TASK_TIMEOUT is terminated and restarted.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from fft_backend import get_backend, get_window
+from iq_convert import FULL_SCALE, int8_to_complex64
+from iq_ring import IQRing
+from psd import welch_power
+
+TASK_TIMEOUT = 10.0  # Seconds before a worker stuck on one task is restarted and its slot reclaimed
+CHECK_INTERVAL = 0.5  # Seconds between worker liveness and task timeout checks
+
+
+def _dsp_worker(index, tasks, results, claims, input_name, output_name, slots, frame_bytes, nfft):
+    """Worker process: Welch PSD of ring slots named on the task queue; claims[index] is the task in hand."""
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    try:
+        frames = np.ndarray((slots, frame_bytes), dtype=np.int8, buffer=input_shm.buf)
+        spectra = np.ndarray((slots, nfft), dtype=np.float64, buffer=output_shm.buf)
+        iq = np.empty(frame_bytes // 2, dtype=np.complex64)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, params = task
+            claims[index] = seq
+            started = time.perf_counter()
+            try:
+                raw = frames[slot]
+                max_amplitude = max(int(raw.max()), -int(raw.min()))
+                samples = int8_to_complex64(raw, out=iq, scale=params["scale"])
+                window = get_window(params["window"], nfft, np.float32)
+                fft = get_backend(params["fft_backend"], 1).fft  # One thread per worker process
+                power, frames_used = welch_power(samples, nfft, window, averages=params["averages"],
+                                                 overlap=params["overlap"], fft=fft)
+                spectra[slot] = power
+                results.put({
+                    "seq": seq,
+                    "worker": index,
+                    "frames_used": frames_used,
+                    "max_amplitude": max_amplitude,
+                    "dsp_ms": (time.perf_counter() - started) * 1000,
+                })
+            except Exception as e:
+                results.put({"seq": seq, "worker": index, "error": str(e)})
+            claims[index] = 0
+        del frames, spectra, iq
+    finally:
+        input_shm.close()
+        output_shm.close()
+
+
+class _Timing:
+    """Last/mean/max of a stage's per-item time in milliseconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.count += 1
+        self.last = ms
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "last_ms": round(self.last, 2),
+            "mean_ms": round(self.total / self.count, 2) if self.count else None,
+            "max_ms": round(self.max, 2),
+        }
+
+
+class _Stage:
+    """Thread running `fn` on items from a bounded queue that drops its oldest item when full."""
+
+    def __init__(self, name, fn, depth, output=None):
+        self.name = name
+        self.fn = fn
+        self.output = output  # Next stage, fed with fn's return value unless it is None
+        self.queue = queue.Queue(maxsize=depth)
+        self.timing = _Timing()
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._thread = None
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"dsp-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            started = time.perf_counter()
+            try:
+                result = self.fn(*item)
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logging.error(f"DSP pipeline {self.name} stage error: {e}")
+                continue
+            self.timing.add((time.perf_counter() - started) * 1000)
+            if self.output is not None and result is not None:
+                self.output.put(result)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            **self.timing.stats(),
+        }
+
+
+class DSPPipeline:
+    """
+    Welch spectra of IQ frames computed by worker processes.
+
+    Frames are written into `ring` (e.g. by HackRFStream(ring=pipeline.ring)).
+    For each spectrum `on_spectrum(power, info)` runs in the detection
+    thread with the unnormalized fftshifted Welch power (see psd.welch_power)
+    and the worker's result info; whatever it returns, unless None, is
+    passed as arguments to `on_publish(*value)` in the publish thread.
+    Frames whose ring tag differs from `tag` (when set) are dropped as stale.
+    """
+
+    def __init__(self, frame_samples, workers=2, nfft=8192, window="hanning", scale=FULL_SCALE,
+                 averages=0, overlap=0.5, fft_backend="auto", buffered_frames=2, queue_depth=2,
+                 on_spectrum=None, on_publish=None):
+        self.frame_samples = int(frame_samples)
+        self.workers = max(1, int(workers))
+        self.nfft = min(int(nfft), self.frame_samples)
+        self.params = {
+            "window": window,
+            "scale": scale,
+            "averages": int(averages),
+            "overlap": float(overlap),
+            "fft_backend": fft_backend,
+        }
+        self.tag = None
+        # A slot per busy worker, frames waiting for a worker, and the one being filled
+        slots = self.workers + buffered_frames + 1
+        self._input_shm = shared_memory.SharedMemory(create=True, size=slots * 2 * self.frame_samples)
+        self._output_shm = shared_memory.SharedMemory(create=True, size=slots * self.nfft * 8)
+        self.ring = IQRing(self.frame_samples, slots=slots, buffer=np.ndarray(
+            (slots, 2 * self.frame_samples), dtype=np.int8, buffer=self._input_shm.buf))
+        self._spectra = np.ndarray((slots, self.nfft), dtype=np.float64, buffer=self._output_shm.buf)
+
+        self.publish_stage = _Stage("publish", on_publish or (lambda *args: None), queue_depth)
+        self.detect_stage = _Stage("detect", on_spectrum or (lambda power, info: None), queue_depth,
+                                   output=self.publish_stage)
+        self.dsp_timing = _Timing()
+        self.latency_timing = _Timing()  # Dispatch to result, including time queued for a worker
+
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._context = context
+        self._processes = [None] * self.workers
+        self._claims = context.Array("q", self.workers, lock=False)  # seq each worker is processing, 0 when idle
+        self._slots_free = threading.Semaphore(self.workers)  # At most one task per worker in flight
+        self._in_flight = {}  # seq -> (slot, tag, dispatch time)
+        self._in_flight_lock = threading.Lock()
+        self._seq = 0
+        self._last_seq = 0
+        self.running = False
+        self.spectra = 0
+        self.stale_frames = 0
+        self.late_results = 0
+        self.lost_tasks = 0
+        self.worker_errors = 0
+        self.worker_restarts = 0
+        self.last_error = None
+        self._threads = []
+
+    def configure(self, **params):
+        """Update window/scale/averages/overlap/fft_backend for the next frames dispatched."""
+        self.params = {**self.params, **{k: v for k, v in params.items() if k in self.params}}
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for index in range(self.workers):
+            self._start_worker(index)
+        self.publish_stage.start()
+        self.detect_stage.start()
+        self._threads = [
+            threading.Thread(target=self._dispatch_loop, name="dsp-dispatch", daemon=True),
+            threading.Thread(target=self._collect_loop, name="dsp-collect", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"DSP pipeline started: {self.workers} workers, {self.ring.slots} shared-memory slots")
+
+    def _start_worker(self, index):
+        process = self._context.Process(
+            target=_dsp_worker, name=f"dsp-worker-{index}", daemon=True,
+            args=(index, self._tasks, self._results, self._claims, self._input_shm.name, self._output_shm.name,
+                  self.ring.slots, self.ring.frame_bytes, self.nfft))
+        process.start()
+        self._processes[index] = process
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=1)
+        self.detect_stage.stop()
+        self.publish_stage.stop()
+        self._tasks.close()
+        self._results.close()
+        self.ring.discard()
+        self.ring = None
+        self._spectra = None
+        for shm in (self._input_shm, self._output_shm):
+            try:
+                shm.close()
+            except BufferError:
+                # A frame view is still referenced somewhere; the mapping goes when it does
+                logging.debug(f"Shared memory {shm.name} still in use, leaving it to be unmapped later")
+            shm.unlink()
+        logging.info("DSP pipeline stopped")
+
+    def _dispatch_loop(self):
+        while self.running:
+            if not self._slots_free.acquire(timeout=0.5):
+                continue
+            slot, tag = self.ring.acquire_slot(timeout=0.5)
+            if slot is None:
+                self._slots_free.release()
+                continue
+            if self.tag is not None and tag != self.tag:
+                self.stale_frames += 1
+                self.ring.release_slot(slot)
+                self._slots_free.release()
+                continue
+            self._seq += 1
+            with self._in_flight_lock:
+                self._in_flight[self._seq] = (slot, tag, time.perf_counter())
+            self._tasks.put((self._seq, slot, self.params))
+
+    def _finish(self, seq):
+        """Return the task's slot to the ring; (slot, tag, dispatched) or None if already reclaimed."""
+        with self._in_flight_lock:
+            task = self._in_flight.pop(seq, None)
+        if task is not None:
+            self.ring.release_slot(task[0])
+            self._slots_free.release()
+        return task
+
+    def _collect_loop(self):
+        next_check = time.monotonic() + CHECK_INTERVAL
+        while self.running:
+            try:
+                result = self._results.get(timeout=CHECK_INTERVAL)
+            except queue.Empty:
+                result = None
+            # On a timer rather than only when idle, so a dead worker is also noticed under load
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + CHECK_INTERVAL
+            if result is None:
+                continue
+            seq = result["seq"]
+            with self._in_flight_lock:
+                task = self._in_flight.get(seq)
+            if task is None:
+                continue  # Reclaimed from a worker that died or was restarted
+            slot, tag, dispatched = task
+            power = None if "error" in result else self._spectra[slot].copy()
+            self._finish(seq)
+
+            if power is None:
+                self.worker_errors += 1
+                self.last_error = result["error"]
+                logging.error(f"DSP worker {result['worker']} failed: {result['error']}")
+                continue
+            self.dsp_timing.add(result["dsp_ms"])
+            self.latency_timing.add((time.perf_counter() - dispatched) * 1000)
+            if seq < self._last_seq:
+                self.late_results += 1  # A newer spectrum is already out
+                continue
+            if self.tag is not None and tag != self.tag:
+                self.stale_frames += 1
+                continue
+            self._last_seq = seq
+            self.spectra += 1
+            result["nfft"] = self.nfft
+            self.detect_stage.put((power, result))
+
+    def _check_workers(self):
+        now = time.perf_counter()
+        with self._in_flight_lock:
+            expired = {seq for seq, (_, _, dispatched) in self._in_flight.items() if now - dispatched > TASK_TIMEOUT}
+        restarted = False
+        for index, process in enumerate(self._processes):
+            if not self.running:
+                return
+            seq = self._claims[index]
+            if process.is_alive():
+                if seq not in expired:
+                    continue
+                # Stuck on one frame; only a dead worker can be trusted not to write its slot any more
+                process.terminate()
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.kill()
+                    process.join(timeout=1)
+                self.last_error = f"DSP worker {index} took over {TASK_TIMEOUT:.0f} s on one frame"
+            else:
+                self.last_error = f"DSP worker {index} exited with code {process.exitcode}"
+            logging.error(f"{self.last_error}, restarting it")
+            self._claims[index] = 0
+            if seq and self._finish(seq) is not None:
+                self.lost_tasks += 1
+            expired.discard(seq)
+            self.worker_restarts += 1
+            self._start_worker(index)
+            restarted = True
+        if expired and not restarted and not any(self._claims):
+            # Every worker is alive and idle, so these are not waiting in the queue: they were
+            # taken by a worker that died before claiming them
+            for seq in expired:
+                if self._finish(seq) is not None:
+                    self.lost_tasks += 1
+
+    def stats(self):
+        with self._in_flight_lock:
+            in_flight = len(self._in_flight)
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "workers_alive": sum(1 for p in self._processes if p is not None and p.is_alive()),
+            "nfft": self.nfft,
+            "spectra": self.spectra,
+            "queues": {
+                "ring_ready": self.ring.stats()["ready"] if self.ring is not None else 0,
+                "in_flight": in_flight,
+                "detect": self.detect_stage.queue.qsize(),
+                "publish": self.publish_stage.queue.qsize(),
+            },
+            "timings": {
+                "dsp": self.dsp_timing.stats(),
+                "latency": self.latency_timing.stats(),
+                "detect": self.detect_stage.timing.stats(),
+                "publish": self.publish_stage.timing.stats(),
+            },
+            "drops": {
+                "ring_overruns": self.ring.overruns if self.ring is not None else 0,
+                "stale_frames": self.stale_frames,
+                "late_results": self.late_results,
+                "lost_tasks": self.lost_tasks,
+                "detect_queue": self.detect_stage.dropped,
+                "publish_queue": self.publish_stage.dropped,
+            },
+            "worker_errors": self.worker_errors,
+            "worker_restarts": self.worker_restarts,
+            "last_error": self.last_error,
+        }
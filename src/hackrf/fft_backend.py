@@ -0,0 +1,236 @@
+"""
+Pluggable FFT backend with cached windows.
+
+The DSP code asks this module for its FFT function and window arrays instead
+of calling np.fft and np.hanning every frame:
+
+- Windows and their normalization constants (sum of w, sum of w^2) are
+  computed once per (name, size, dtype) and cached.
+- The FFT comes from pyFFTW (a bounded set of FFTW plans, batches padded to
+  a fixed row count, wisdom saved to disk), scipy.fft (multi-threaded with `workers`) or numpy, whichever is
+  selected and installed. "auto" picks the first available in that order.
+
+Select the backend with "fft_backend" ("auto", "pyfftw", "scipy", "numpy")
+and the thread count with "fft_workers" (-1 = all cores) in config.json.
+Run `python3 fft_backend.py` to benchmark the installed backends.
+"""
+import atexit
+import functools
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from psd import BATCH_FRAMES
+
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+try:
+    import pyfftw
+    import pyfftw.builders
+except ImportError:
+    pyfftw = None
+
+WISDOM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fftw_wisdom.pickle")
+MAX_PLANS = 8  # FFTW plans kept per backend; the least recently used is dropped
+WINDOWS = {
+    "hanning": np.hanning,
+    "hann": np.hanning,
+    "blackman": np.blackman,
+    "hamming": np.hamming,
+    "rect": np.ones,
+}
+
+
+@functools.lru_cache(maxsize=32)
+def _window(name, size, dtype):
+    window = WINDOWS[name](size).astype(dtype)
+    window.flags.writeable = False  # Shared between callers
+    return window, float(np.sum(window)), float(np.sum(window.astype(np.float64) ** 2))
+
+
+def get_window(name, size, dtype=np.float64):
+    """Cached read-only window array of `size` points."""
+    return _window(name, int(size), np.dtype(dtype))[0]
+
+
+def window_gain(name, size):
+    """(sum(w), sum(w**2)) for amplitude and power normalization."""
+    _, coherent, power = _window(name, int(size), np.dtype(np.float64))
+    return coherent, power
+
+
+class NumpyBackend:
+    name = "numpy"
+
+    def __init__(self, workers=1):
+        self.workers = 1
+
+    def fft(self, x, axis=-1):
+        return np.fft.fft(x, axis=axis)
+
+
+class ScipyBackend:
+    name = "scipy"
+
+    def __init__(self, workers=-1):
+        self.workers = workers
+
+    def fft(self, x, axis=-1):
+        # overwrite_x lets scipy reuse the input buffer; callers pass scratch arrays
+        return scipy_fft.fft(x, axis=axis, workers=self.workers, overwrite_x=True)
+
+
+class PyFFTWBackend:
+    """
+    FFTW plans built once and reused. Row batches transformed along the last
+    axis share one plan per (FFT size, dtype) of at least BATCH_FRAMES rows:
+    shorter batches (the last Welch batch, small frame counts) are
+    zero-padded into it, so they never plan again. Other inputs get a plan
+    per (shape, dtype, axis). At most MAX_PLANS plans are kept. Wisdom is
+    saved after the first plan and again at exit. The array returned by
+    fft() is the plan's output buffer: it is overwritten by the next
+    transform with the same plan.
+    """
+
+    name = "pyfftw"
+
+    def __init__(self, workers=-1, wisdom_path=WISDOM_PATH):
+        self.workers = os.cpu_count() if workers in (None, -1, 0) else workers
+        self.wisdom_path = wisdom_path
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self._wisdom_saved = False
+        self._load_wisdom()
+        atexit.register(self.save_wisdom)
+
+    def _load_wisdom(self):
+        try:
+            with open(self.wisdom_path, "rb") as f:
+                pyfftw.import_wisdom(pickle.load(f))
+            logging.info(f"Loaded FFTW wisdom from {self.wisdom_path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable FFTW wisdom {self.wisdom_path}: {e}")
+
+    def save_wisdom(self):
+        if not self._plans:
+            return
+        # Worker processes share the file: write a private copy and swap it in
+        temp_path = f"{self.wisdom_path}.{os.getpid()}"
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump(pyfftw.export_wisdom(), f)
+            os.replace(temp_path, self.wisdom_path)
+        except OSError as e:
+            logging.warning(f"Could not save FFTW wisdom: {e}")
+
+    def _plan(self, shape, dtype, axis):
+        key = (shape, dtype.str, axis)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+            started = time.perf_counter()
+            plan = pyfftw.builders.fft(
+                pyfftw.empty_aligned(shape, dtype=dtype), axis=axis,
+                threads=self.workers, planner_effort="FFTW_MEASURE")
+            self._plans[key] = plan
+            if len(self._plans) > MAX_PLANS:
+                self._plans.popitem(last=False)
+            logging.info(f"Planned FFTW {shape} {dtype} in {time.perf_counter() - started:.2f}s")
+            save = not self._wisdom_saved
+            self._wisdom_saved = True
+        if save:
+            self.save_wisdom()
+        return plan
+
+    def fft(self, x, axis=-1):
+        if x.ndim == 2 and axis in (-1, 1):
+            rows, size = x.shape
+            plan = self._plan((max(rows, BATCH_FRAMES), size), x.dtype, -1)
+            if rows == plan.input_array.shape[0]:
+                return plan(x)
+            plan.input_array[:rows] = x
+            plan.input_array[rows:] = 0
+            return plan()[:rows]
+        return self._plan(x.shape, x.dtype, axis)(x)
+
+
+BACKENDS = {"pyfftw": PyFFTWBackend, "scipy": ScipyBackend, "numpy": NumpyBackend}
+_AVAILABLE = {"pyfftw": pyfftw is not None, "scipy": scipy_fft is not None, "numpy": True}
+
+_backend = None
+_backend_key = None
+_backend_lock = threading.Lock()
+
+
+def available_backends():
+    return [name for name in ("pyfftw", "scipy", "numpy") if _AVAILABLE[name]]
+
+
+def create_backend(name="auto", workers=-1):
+    if name == "auto":
+        name = available_backends()[0]
+    elif not _AVAILABLE.get(name):
+        logging.warning(f"FFT backend '{name}' is not available, falling back to numpy")
+        name = "numpy"
+    return BACKENDS[name](workers)
+
+
+def get_backend(name="auto", workers=-1):
+    """Shared backend for the given selection; recreated only when the selection changes."""
+    global _backend, _backend_key
+    key = (name, workers)
+    if _backend_key != key:
+        with _backend_lock:
+            if _backend_key != key:
+                _backend = create_backend(name, workers)
+                _backend_key = key
+                logging.info(f"FFT backend: {_backend.name} (workers={_backend.workers})")
+    return _backend
+
+
+def benchmark(sizes=(8192, 65536, 262144, 1048576), repeat=10):
+    rng = np.random.default_rng(0)
+    print(f"Complex64 FFT, best of {repeat} (machine: {os.uname().machine}, {os.cpu_count()} cores)")
+    for size in sizes:
+        x = (rng.standard_normal(size) + 1j * rng.standard_normal(size)).astype(np.complex64)
+        baseline = None
+        for name in available_backends()[::-1]:
+            backend = create_backend(name)
+            backend.fft(x.copy())  # Plan / warm up
+            best = float("inf")
+            for _ in range(repeat):
+                scratch = x.copy()
+                started = time.perf_counter()
+                backend.fft(scratch)
+                best = min(best, time.perf_counter() - started)
+            baseline = baseline or best
+            print(f"  {size:>8} points  {name:<7} {best * 1000:8.3f} ms  x{baseline / best:.1f}")
+
+        # Window construction per frame vs cached
+        started = time.perf_counter()
+        for _ in range(repeat):
+            np.hanning(size)
+        fresh = (time.perf_counter() - started) / repeat
+        get_window("hanning", size)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            get_window("hanning", size)
+        cached = (time.perf_counter() - started) / repeat
+        print(f"  {size:>8} points  window  np.hanning {fresh * 1000:.3f} ms, cached {cached * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    benchmark(tuple(int(size) for size in sys.argv[1:]) or (8192, 65536, 262144, 1048576))
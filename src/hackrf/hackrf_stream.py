@@ -0,0 +1,231 @@
+"""
+Persistent HackRF capture engine.
+
+Instead of spawning `hackrf_transfer -r buffer.iq -n N` for every capture, one
+`hackrf_transfer -r -` process streams interleaved int8 IQ to a pipe for as
+long as monitoring runs. A reader thread reads the pipe straight into the
+slots of a preallocated IQRing, and the DSP stage gets views of those frames
+without copies. If the DSP stage falls behind, the oldest unread frame is
+overwritten (and counted) so the consumer always sees recent samples. When the process dies it is restarted with a backoff;
+changing frequency, sample rate or gains restarts it with the new settings.
+
+HackRFProcess holds the process handling (restart, backoff, retune, stderr)
+and is shared with the hackrf_sweep engine in sweep_engine.py.
+"""
+import logging
+import subprocess
+import threading
+import time
+from collections import deque
+
+from iq_ring import IQRing
+
+RESTART_BACKOFF_MIN = 0.5  # Seconds before restarting a failed hackrf_transfer
+RESTART_BACKOFF_MAX = 10.0
+STDERR_LINES = 20  # hackrf_transfer stderr lines kept for error reports
+
+
+class HackRFProcess:
+    """
+    A long-running HackRF command, restarted with a backoff when it exits.
+
+    Subclasses provide build_command() and consume(process, generation),
+    which reads the process output until EOF, and may override discard().
+    """
+
+    name = "HackRF process"
+
+    def __init__(self, settings, command):
+        self.settings = settings
+        self.command = command
+        self.running = False
+        self.restarts = 0
+        self.last_error = None
+        self._stderr = deque(maxlen=STDERR_LINES)
+        self._generation = 0  # Bumped on retune so output from old settings is discarded
+        self._process = None
+        self._lock = threading.Lock()
+        self._reader = None
+
+    def build_command(self):
+        raise NotImplementedError
+
+    def consume(self, process, generation):
+        raise NotImplementedError
+
+    def discard(self):
+        """Drop output buffered under the previous settings (on retune and stop)."""
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._reader = threading.Thread(target=self._read_loop, name=self.command, daemon=True)
+        self._reader.start()
+
+    def stop(self):
+        self.running = False
+        self._kill()
+        if self._reader is not None:
+            self._reader.join(timeout=5)
+            self._reader = None
+        self.discard()
+
+    def retune(self, **settings):
+        """Apply new settings; restarts the process only if something changed."""
+        changed = {k: v for k, v in settings.items() if k in self.settings and self.settings[k] != v}
+        if not changed:
+            return False
+        with self._lock:
+            self.settings.update(changed)
+            self._generation += 1
+        logging.info(f"{self.name} retuning: {changed}")
+        self._kill()
+        self.discard()
+        return True
+
+    @property
+    def generation(self):
+        """Tag of output produced with the current settings (older output has a lower one)."""
+        return self._generation
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "pid": self._process.pid if self._process is not None else None,
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+        }
+
+    def _read_loop(self):
+        backoff = RESTART_BACKOFF_MIN
+        while self.running:
+            with self._lock:
+                cmd = self.build_command()
+                generation = self._generation
+            try:
+                # Unbuffered stdout; consume() does its own buffering
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+            except OSError as e:
+                self.last_error = f"Could not start {cmd[0]}: {e}"
+                logging.error(self.last_error)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+                continue
+            self._process = process
+            self._stderr.clear()
+            threading.Thread(target=self._drain_stderr, args=(process,), daemon=True).start()
+            logging.info(f"{self.name} started (pid {process.pid}): {' '.join(cmd)}")
+
+            started = time.monotonic()
+            self.consume(process, generation)  # Returns at EOF: the process exited or was killed
+
+            self._kill()
+            returncode = process.wait()
+            self._process = None
+            if not self.running:
+                break
+            if generation != self._generation:
+                backoff = RESTART_BACKOFF_MIN  # Deliberate restart for new settings
+                continue
+
+            self.restarts += 1
+            self.last_error = f"{cmd[0]} exited with code {returncode}: {' | '.join(self._stderr) or 'no output'}"
+            logging.error(f"{self.name} stopped, restarting in {backoff:.1f}s. {self.last_error}")
+            if time.monotonic() - started > RESTART_BACKOFF_MAX:
+                backoff = RESTART_BACKOFF_MIN  # It ran fine for a while; this is a fresh failure
+            time.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+
+    def _drain_stderr(self, process):
+        # hackrf_transfer reports throughput on stderr every second; keep reading so the pipe never fills
+        for line in process.stderr:
+            line = line.decode("utf-8", "ignore").strip()
+            if line:
+                self._stderr.append(line)
+
+    def _kill(self):
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class HackRFStream(HackRFProcess):
+    """Long-running hackrf_transfer process delivering fixed-size frames of int8 IQ."""
+
+    name = "HackRF stream"
+
+    def __init__(self, frequency, sample_rate, lna_gain=None, vga_gain=None, amp=True,
+                 frame_samples=2**20, max_frames=4, command="hackrf_transfer", ring=None):
+        super().__init__({
+            "frequency": int(frequency),
+            "sample_rate": int(sample_rate),
+            "lna_gain": lna_gain,
+            "vga_gain": vga_gain,
+            "amp": amp,
+        }, command)
+        # One extra slot for the frame being processed; a caller-supplied ring (e.g. in shared memory) is used as is
+        self.ring = ring if ring is not None else IQRing(frame_samples, slots=max_frames + 1)
+        self.frame_bytes = self.ring.frame_bytes
+
+    def build_command(self):
+        s = self.settings
+        cmd = [self.command, "-r", "-", "-f", str(s["frequency"]), "-s", str(s["sample_rate"])]
+        if s["amp"]:
+            cmd += ["-a", "1"]
+        if s["lna_gain"] is not None:
+            cmd += ["-l", str(s["lna_gain"])]
+        if s["vga_gain"] is not None:
+            cmd += ["-g", str(s["vga_gain"])]
+        return cmd
+
+    def consume(self, process, generation):
+        # readinto goes straight from the pipe into the ring; a partial frame at EOF is discarded
+        while self.running:
+            if not self.ring.fill_from(process.stdout, tag=generation):
+                break
+
+    def discard(self):
+        self.ring.discard()
+
+    def read_frame(self, timeout=5.0):
+        """
+        Next frame as a read-only int8 array of interleaved I/Q, or None if
+        nothing arrived within `timeout`.
+
+        The array is a view into the ring: it is valid until the next
+        read_frame() call, so copy anything that must outlive the iteration.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            generation, frame = self.ring.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            if frame is None:
+                return None
+            if generation == self._generation:
+                return frame
+
+    @property
+    def frames(self):
+        return self.ring.frames_written
+
+    @property
+    def dropped_frames(self):
+        return self.ring.overruns
+
+    @property
+    def dropped_samples(self):
+        return self.ring.overruns * self.ring.frame_samples
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "frames": self.frames,
+            "bytes_read": self.frames * self.frame_bytes,
+            "dropped_frames": self.dropped_frames,
+            "dropped_samples": self.dropped_samples,
+            "ring": self.ring.stats(),
+        }
@@ -0,0 +1,106 @@
+"""
+int8 interleaved IQ -> scaled complex64, written into a preallocated array.
+
+`raw[::2] + 1j * raw[1::2]` builds a complex128 array (16 bytes/sample)
+plus strided temporaries, and the monitor then casts and scales it in more
+passes. Two single-pass kernels are provided here:
+
+- "lut": the int8 pairs are viewed as uint16 and mapped through a
+  65536-entry complex64 table (one gather per sample).
+- "direct": complex64 is laid out as interleaved float32 (re, im), exactly
+  like the int8 input, so one scaled multiply into the float32 view of the
+  output converts I and Q together.
+
+Which one wins depends on the CPU's cache and SIMD support; run this module
+(`python3 iq_convert.py`) to benchmark both against the old expression.
+`int8_to_complex64` uses the kernel named by KERNEL.
+"""
+import sys
+import time
+
+import numpy as np
+
+FULL_SCALE = 1.0 / 128.0
+KERNEL = "direct"
+
+_luts = {}
+
+
+def iq_lut(scale=FULL_SCALE):
+    """65536-entry complex64 table indexed by an I/Q int8 pair viewed as uint16."""
+    lut = _luts.get(scale)
+    if lut is None:
+        # Build from the actual byte layout so the table is right on either endianness
+        pairs = np.arange(65536, dtype=np.uint16).view(np.int8).reshape(-1, 2).astype(np.float32)
+        lut = np.empty(65536, dtype=np.complex64)
+        lut.real = pairs[:, 0] * scale
+        lut.imag = pairs[:, 1] * scale
+        _luts[scale] = lut
+    return lut
+
+
+def _output(raw, out):
+    samples = raw.size // 2
+    if out is None:
+        return np.empty(samples, dtype=np.complex64)
+    if out.dtype != np.complex64 or out.size < samples:
+        raise ValueError(f"out must be complex64 with at least {samples} elements")
+    return out[:samples]
+
+
+def convert_lut(raw, out=None, scale=FULL_SCALE):
+    out = _output(raw, out)
+    pairs = np.ascontiguousarray(raw[:2 * out.size]).view(np.uint16)
+    np.take(iq_lut(scale), pairs, out=out)
+    return out
+
+
+def convert_direct(raw, out=None, scale=FULL_SCALE):
+    out = _output(raw, out)
+    np.multiply(raw[:2 * out.size], np.float32(scale), out=out.view(np.float32), casting="unsafe")
+    return out
+
+
+KERNELS = {"lut": convert_lut, "direct": convert_direct}
+
+
+def int8_to_complex64(raw, out=None, scale=FULL_SCALE):
+    """
+    Convert interleaved int8 I/Q to complex64 multiplied by `scale`
+    (default 1/128, i.e. full scale = 1.0). Writes into `out` when given and
+    returns the filled part of it.
+    """
+    return KERNELS[KERNEL](raw, out, scale)
+
+
+def _old_expression(raw):
+    iq = raw[::2] + 1j * raw[1::2]
+    return (iq / 128.0).astype(np.complex64)
+
+
+def benchmark(samples=2**22, repeat=20):
+    raw = np.random.randint(-128, 128, 2 * samples, dtype=np.int8)
+    out = np.empty(samples, dtype=np.complex64)
+    expected = _old_expression(raw)
+    iq_lut()  # Table build is a one-off cost
+
+    cases = [("raw[::2] + 1j*raw[1::2], /128, complex64", lambda: _old_expression(raw))]
+    for name, kernel in KERNELS.items():
+        if not np.array_equal(kernel(raw, out), expected):
+            raise AssertionError(f"{name} kernel output differs from the reference expression")
+        cases.append((f"{name} kernel into preallocated out", lambda kernel=kernel: kernel(raw, out)))
+
+    print(f"int8 IQ -> complex64, {samples} samples, best of {repeat}")
+    baseline = None
+    for name, fn in cases:
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - started)
+        baseline = baseline or best
+        print(f"  {name:<45} {best * 1000:8.2f} ms  {samples / best / 1e6:8.1f} MS/s  x{baseline / best:.1f}")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2**22)
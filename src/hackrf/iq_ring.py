@@ -0,0 +1,171 @@
+"""
+Preallocated ring buffer of int8 IQ frames.
+
+All frames live in one (slots, 2 * frame_samples) int8 array allocated up
+front. The producer fills a free slot in place with `readinto` on a
+memoryview of it, so samples go from the pipe into their final memory with
+no intermediate bytes objects. The consumer gets a read-only numpy view of a
+filled slot and hands it back with `release`; nothing is copied or
+allocated per frame.
+
+The buffer can also be supplied by the caller, e.g. an array over
+multiprocessing shared memory, and slots can be handed out individually
+(`acquire_slot`/`release_slot`) to several workers at once.
+
+When the consumer falls behind, the producer either overwrites the oldest
+unread frame (`overwrite=True`, counted as an overrun; right for a live
+receiver that cannot pause) or waits for a slot to be released (counted as
+backpressure).
+"""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class IQRing:
+    """Fixed-size slots of interleaved int8 IQ, one producer and one consumer."""
+
+    def __init__(self, frame_samples, slots=4, overwrite=True, buffer=None):
+        if slots < 2:
+            raise ValueError("IQRing needs at least 2 slots")
+        self.frame_samples = int(frame_samples)
+        self.frame_bytes = 2 * self.frame_samples
+        self.slots = slots
+        self.overwrite = overwrite
+        if buffer is None:
+            buffer = np.zeros((slots, self.frame_bytes), dtype=np.int8)
+        elif buffer.shape != (slots, self.frame_bytes) or buffer.dtype != np.int8:
+            raise ValueError(f"buffer must be int8 with shape {(slots, self.frame_bytes)}")
+        self.buffer = buffer
+        self._views = [memoryview(self.buffer[i]).cast("B") for i in range(slots)]
+        self.tags = [None] * slots  # Caller-supplied tag per frame, e.g. the tuning generation
+        self._free = deque(range(slots))
+        self._ready = deque()  # Filled slots, oldest first
+        self._held = None  # Slot the consumer is looking at
+        self._cond = threading.Condition()
+        self.frames_written = 0
+        self.frames_read = 0
+        self.overruns = 0
+        self.backpressure_waits = 0
+        self.backpressure_seconds = 0.0
+
+    def _claim(self):
+        with self._cond:
+            waited_since = None
+            while True:
+                if self._free:
+                    slot = self._free.popleft()
+                    break
+                if self.overwrite and self._ready:
+                    slot = self._ready.popleft()  # Oldest unread frame is lost
+                    self.overruns += 1
+                    break
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self.backpressure_waits += 1
+                self._cond.wait()
+            if waited_since is not None:
+                self.backpressure_seconds += time.monotonic() - waited_since
+            return slot
+
+    def fill_from(self, source, tag=None):
+        """
+        Fill the next slot from a binary file object with `readinto`.
+
+        Returns False at EOF; a partially filled slot is discarded.
+        """
+        slot = self._claim()
+        view = self._views[slot]
+        filled = 0
+        while filled < self.frame_bytes:
+            n = source.readinto(view[filled:])
+            if not n:
+                with self._cond:
+                    self._free.append(slot)
+                return False
+            filled += n
+        self.publish(slot, tag)
+        return True
+
+    def publish(self, slot, tag=None):
+        with self._cond:
+            self.tags[slot] = tag
+            self._ready.append(slot)
+            self.frames_written += 1
+            self._cond.notify_all()
+
+    def acquire(self, timeout=None):
+        """
+        (tag, frame) for the oldest unread frame, or (None, None) on timeout.
+
+        `frame` is a read-only int8 view into the ring; it stays valid until
+        `release()` or the next `acquire()`, which releases it implicitly.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._release_locked()
+            while not self._ready:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None, None
+                self._cond.wait(remaining)
+            slot = self._ready.popleft()
+            self._held = slot
+            self.frames_read += 1
+        frame = self.buffer[slot]
+        frame.flags.writeable = False
+        return self.tags[slot], frame
+
+    def release(self):
+        with self._cond:
+            self._release_locked()
+
+    def acquire_slot(self, timeout=None):
+        """
+        (slot, tag) of the oldest unread frame, or (None, None) on timeout.
+        Unlike acquire(), several slots may be out at once; each must be
+        returned with release_slot().
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._ready:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None, None
+                self._cond.wait(remaining)
+            slot = self._ready.popleft()
+            self.frames_read += 1
+            return slot, self.tags[slot]
+
+    def release_slot(self, slot):
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def _release_locked(self):
+        if self._held is not None:
+            self._free.append(self._held)
+            self._held = None
+            self._cond.notify_all()
+
+    def discard(self):
+        """Drop every unread frame (e.g. after a retune)."""
+        with self._cond:
+            self._free.extend(self._ready)
+            self._ready.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "frame_samples": self.frame_samples,
+                "ready": len(self._ready),
+                "frames_written": self.frames_written,
+                "frames_read": self.frames_read,
+                "overruns": self.overruns,
+                "backpressure_waits": self.backpressure_waits,
+                "backpressure_seconds": round(self.backpressure_seconds, 3),
+            }
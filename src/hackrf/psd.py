@@ -0,0 +1,60 @@
+"""
+Welch-averaged power spectrum of an IQ capture.
+
+A single periodogram of the first FFT-size samples uses a tiny fraction of
+a multi-megasample capture and has the full variance of one estimate. Here
+the capture is viewed (without copying) as overlapping frames, the frames
+are windowed and transformed in batches with one `np.fft.fft(..., axis=1)`
+call each, and their power is averaged. Averaging K frames cuts the noise
+variance by roughly K, so weak carriers stand out of a much smoother floor.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+BATCH_FRAMES = 64  # Frames per batched FFT; bounds the temporary arrays to BATCH_FRAMES * nfft
+
+
+def frame_step(nfft, overlap):
+    return max(1, int(round(nfft * (1.0 - overlap))))
+
+
+def available_frames(samples, nfft, overlap=0.5):
+    if samples < nfft:
+        return 0
+    return 1 + (samples - nfft) // frame_step(nfft, overlap)
+
+
+def welch_power(iq, nfft, window, averages=0, overlap=0.5, fft=None):
+    """
+    Mean |FFT|^2 of overlapping windowed frames of `iq`, fftshifted.
+
+    `averages` caps the number of frames (0 = every frame in the capture,
+    1 = a single periodogram of the first `nfft` samples). The mean of the
+    samples used is removed first. Returns (power, frames_used); power is
+    not normalized, so callers keep their own scaling. `fft(x, axis=)` is
+    the transform to use (np.fft.fft by default); it may overwrite its input.
+    """
+    fft = fft or np.fft.fft
+    iq = np.asarray(iq)
+    nfft = min(nfft, len(iq))
+    step = frame_step(nfft, overlap)
+    count = available_frames(len(iq), nfft, overlap)
+    if averages > 0:
+        count = min(count, averages)
+    used = iq[:(count - 1) * step + nfft]
+    mean = used.mean()
+    frames = sliding_window_view(used, nfft)[::step]
+
+    single = iq.dtype == np.complex64
+    dtype = np.complex64 if single else np.complex128
+    window = window.astype(np.float32 if single else np.float64, copy=False)
+    power = np.zeros(nfft, dtype=np.float64)
+    batch = np.empty((min(BATCH_FRAMES, count), nfft), dtype=dtype)
+    for start in range(0, count, BATCH_FRAMES):
+        chunk = frames[start:start + BATCH_FRAMES]
+        block = batch[:len(chunk)]
+        np.subtract(chunk, mean, out=block)
+        block *= window
+        spectrum = fft(block, axis=1)
+        power += (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=0)
+    return np.fft.fftshift(power / count), count
@@ -0,0 +1,200 @@
+"""
+Wideband spectrum from `hackrf_sweep`.
+
+The capture modes see one `sample_rate`-wide window around the center
+frequency. `hackrf_sweep` retunes the HackRF across a whole range (up to
+1 MHz - 6 GHz) several times per second and prints one CSV line per 5 MHz
+chunk:
+
+    date, time, hz_low, hz_high, hz_bin_width, num_samples, dB, dB, ...
+
+SweepEngine runs it as a streaming subprocess (restarted like
+HackRFStream), parses the lines as they arrive into a preallocated power
+array spanning the range at a fixed bin width, and hands each complete
+sweep to a callback. The mapping from a line's bins to array bins is
+computed once per chunk and reused on every sweep; when the array is
+coarser than hackrf_sweep's bins, each array bin keeps the maximum.
+"""
+import io
+import logging
+import math
+import time
+
+import numpy as np
+
+from hackrf_stream import HackRFProcess
+
+HACKRF_SWEEP_MAX_MHZ = 7250
+
+
+class SweepEngine(HackRFProcess):
+    """
+    hackrf_sweep over [start, stop) Hz; `on_sweep(power_db, info)` gets each
+    complete sweep as a read-only float32 array aligned with `frequencies`.
+    The array is refilled after the next sweep completes, so copy it to keep it.
+    """
+
+    name = "HackRF sweep"
+
+    def __init__(self, start=1e6, stop=6e9, bin_width=1e6, lna_gain=None, vga_gain=None, amp=True,
+                 on_sweep=None, command="hackrf_sweep"):
+        super().__init__({
+            "start": int(start),
+            "stop": int(stop),
+            "bin_width": int(bin_width),
+            "lna_gain": lna_gain,
+            "vga_gain": vga_gain,
+            "amp": amp,
+        }, command)
+        self.on_sweep = on_sweep
+        self._allocate()
+        self.sweeps = 0
+        self.lines = 0
+        self.bad_lines = 0
+        self.last_sweep_seconds = 0.0
+        self.last_coverage = 0.0
+        self.last_parse_seconds = 0.0
+        self.callback_errors = 0
+
+    def _allocate(self):
+        s = self.settings
+        self._layout = (s["start"], s["stop"], s["bin_width"])
+        self.bins = max(1, math.ceil((s["stop"] - s["start"]) / s["bin_width"]))
+        self.frequencies = s["start"] + (np.arange(self.bins) + 0.5) * s["bin_width"]  # Bin centers, Hz
+        self._buffers = [np.full(self.bins, np.nan, dtype=np.float32) for _ in range(2)]
+        self._current = 0
+        self._maps = {}  # (hz_low, count, hz_bin_width) -> (dest, src, reduce_end)
+        self._sweep_low = None  # hz_low of the first chunk of a sweep; seeing it again starts a new sweep
+
+    def build_command(self):
+        s = self.settings
+        low = int(s["start"] // 1_000_000)
+        high = min(HACKRF_SWEEP_MAX_MHZ, max(low + 1, math.ceil(s["stop"] / 1_000_000)))
+        cmd = [self.command, "-f", f"{low}:{high}", "-w", str(s["bin_width"])]
+        if s["amp"]:
+            cmd += ["-a", "1"]
+        if s["lna_gain"] is not None:
+            cmd += ["-l", str(s["lna_gain"])]
+        if s["vga_gain"] is not None:
+            cmd += ["-g", str(s["vga_gain"])]
+        return cmd
+
+    def retune(self, **settings):
+        """Apply new range/bin width/gains; the power array is resized when the sweep restarts."""
+        return super().retune(**{k: int(v) if k in ("start", "stop", "bin_width") else v
+                                 for k, v in settings.items()})
+
+    def discard(self):
+        self._buffers[self._current].fill(np.nan)
+        self._sweep_low = None
+
+    def _line_map(self, hz_low, count, width):
+        """Array bins covered by a chunk and how to fill them from its `count` values."""
+        key = (hz_low, count, width)
+        mapping = self._maps.get(key)
+        if mapping is None:
+            start = self.settings["start"]
+            bin_width = self.settings["bin_width"]
+            if width >= bin_width:
+                # Array is finer: every array bin centered in the chunk takes the chunk bin under it
+                first = max(0, math.ceil((hz_low - start) / bin_width - 0.5))
+                last = min(self.bins, math.ceil((hz_low + count * width - start) / bin_width - 0.5))
+                dest = np.arange(first, max(first, last))
+                src = ((self.frequencies[dest] - hz_low) // width).astype(np.intp).clip(0, count - 1)
+                mapping = (dest, src, None)
+            else:
+                # Array is coarser: each array bin takes the max of the chunk bins centered in it.
+                # Bin indices increase along the chunk, so the bins inside the array are contiguous
+                index = ((hz_low + (np.arange(count) + 0.5) * width - start) // bin_width).astype(np.intp)
+                inside = np.flatnonzero((index >= 0) & (index < self.bins))
+                if len(inside):
+                    dest, src = np.unique(index[inside], return_index=True)
+                    mapping = (dest, src + inside[0], inside[-1] + 1)
+                else:
+                    mapping = (inside, inside, None)
+            self._maps[key] = mapping
+        return mapping
+
+    def consume(self, process, generation):
+        if self._layout != (self.settings["start"], self.settings["stop"], self.settings["bin_width"]):
+            self._allocate()  # Range or bin width changed; only this thread touches the arrays
+        reader = io.BufferedReader(process.stdout, buffer_size=1 << 16)
+        sweep_started = time.monotonic()
+        parse_seconds = 0.0
+        for line in reader:
+            if not self.running or generation != self._generation:
+                break
+            started = time.perf_counter()
+            fields = line.split(b",", 6)
+            try:
+                hz_low = int(fields[2])
+                width = float(fields[4])
+                values = np.array(fields[6].split(b","), dtype=np.float32)
+            except (IndexError, ValueError):
+                self.bad_lines += 1
+                continue
+            self.lines += 1
+
+            if self._sweep_low is None:
+                self._sweep_low = hz_low
+            elif hz_low == self._sweep_low:
+                # Back at the first chunk: the previous sweep is complete
+                now = time.monotonic()
+                self.last_sweep_seconds = now - sweep_started
+                self.last_parse_seconds = parse_seconds
+                sweep_started = now
+                parse_seconds = 0.0
+                self._publish()
+            elif hz_low < self._sweep_low:
+                self._sweep_low = hz_low  # Sweeps do not start with the lowest chunk; track the lowest
+
+            dest, src, reduce_end = self._line_map(hz_low, len(values), width)
+            if reduce_end is None:
+                self._buffers[self._current][dest] = values[src]
+            else:
+                self._buffers[self._current][dest] = np.maximum.reduceat(values[:reduce_end], src)
+            parse_seconds += time.perf_counter() - started
+
+    def _publish(self):
+        sweep = self._buffers[self._current]
+        self._current ^= 1
+        self._buffers[self._current].fill(np.nan)
+        self.sweeps += 1
+        covered = np.isfinite(sweep)
+        self.last_coverage = float(np.count_nonzero(covered)) / self.bins
+        if not covered.all():
+            sweep[~covered] = np.min(sweep[covered]) if covered.any() else -100.0  # Fill gaps with the floor
+        sweep.flags.writeable = False
+        try:
+            if self.on_sweep is not None:
+                self.on_sweep(sweep, {
+                    "sweep": self.sweeps,
+                    "sweep_ms": self.last_sweep_seconds * 1000,
+                    "coverage": self.last_coverage,
+                })
+        except Exception as e:
+            self.callback_errors += 1
+            logging.error(f"Sweep callback error: {e}")
+        finally:
+            sweep.flags.writeable = True
+
+    @property
+    def frequencies_mhz(self):
+        return self.frequencies / 1e6
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "start": self.settings["start"],
+            "stop": self.settings["stop"],
+            "bin_width": self.settings["bin_width"],
+            "bins": self.bins,
+            "sweeps": self.sweeps,
+            "lines": self.lines,
+            "bad_lines": self.bad_lines,
+            "last_sweep_ms": round(self.last_sweep_seconds * 1000, 1),
+            "sweeps_per_second": round(1.0 / self.last_sweep_seconds, 2) if self.last_sweep_seconds else None,
+            "last_parse_ms": round(self.last_parse_seconds * 1000, 2),
+            "coverage": round(self.last_coverage, 3),
+            "callback_errors": self.callback_errors,
+        }
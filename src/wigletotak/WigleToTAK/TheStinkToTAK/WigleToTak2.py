@@ -3,12 +3,31 @@ import datetime
 import struct
 import logging
 import time
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 import os
 import threading
 from itertools import islice
 import random
 import argparse
+import tempfile
+from collections import deque
+from xml.sax.saxutils import escape
+from emitter_estimator import EmitterEstimator, estimate_changed
+from session_export import EXPORT_FORMATS, generate_export
+from data_package import MIMETYPE as DATA_PACKAGE_MIMETYPE, generate_data_package
+from device_store import DeviceStore
+from device_search import get_search_index
+from live_events import LiveFeed
+from refresh_scheduler import RefreshScheduler
+from heatmap_tiles import HeatmapRenderer
+from follow_detector import FollowDetector
+from sensor_net import AggregatorServer, SightingForwarder
+from peer_listener import PeerListener
+from session_stats import SessionStats
+from parallel_ingest import MIN_PARALLEL_BYTES, collect_devices
+from row_index import get_index
+from session_diff import contains_mac, diff_sessions, format_macs, union_macs
+from wiglecsv import Sighting, is_header, mac_to_int, parse_line, parse_timestamp
 
 app = Flask(__name__)
 
@@ -21,6 +40,17 @@ parser = argparse.ArgumentParser(description='WigleToTAK2')
 parser.add_argument('--directory', type=str, help='Directory containing Wigle CSV files')
 parser.add_argument('--port', type=int, default=6969, help='Port for TAK broadcasting')
 parser.add_argument('--flask-port', type=int, default=8000, help='Port for Flask web interface')
+parser.add_argument('--tile-cache', type=str, default=os.path.join(tempfile.gettempdir(), 'wigletotak-tiles'),
+                    help='Directory for cached heatmap tiles')
+parser.add_argument('--workers', type=int, default=1,
+                    help='Worker processes for post-collection parsing of large files (1 disables)')
+parser.add_argument('--history-db', type=str, help='SQLite file for persistent device history (disabled if omitted)')
+parser.add_argument('--node-id', type=str, default=socket.gethostname(), help='Name of this collector in aggregated feeds')
+parser.add_argument('--forward-to', type=str, help='Collector mode: forward sightings to an aggregator at HOST:PORT instead of sending CoT')
+parser.add_argument('--forward-transport', choices=['udp', 'tcp'], default='udp', help='Transport for --forward-to')
+parser.add_argument('--aggregate-port', type=int, help='Aggregator mode: accept collector sightings on this UDP/TCP port')
+parser.add_argument('--peer-suppression', action='store_true',
+                    help='Listen on the TAK multicast group and skip devices peers announced recently')
 args = parser.parse_args()
 
 # Initialize wigle_csv_directory with a sensible default
@@ -52,6 +82,49 @@ sensitivity_factors = {
     'custom': 1.0      # Custom value that can be set
 }
 custom_sensitivity_factor = 1.0  # For custom sensitivity factor
+device_store = DeviceStore(args.history_db) if args.history_db else None
+live_feed = LiveFeed()
+refresh_enabled = False  # Periodically re-send active devices with short stale times
+refresh_interval = 60  # Seconds between refreshes of one device
+refresh_expire_minutes = 10  # Stop refreshing devices unseen for this long
+refresh_rate_limit = 100  # Maximum refresh packets per second
+refresh_stale_factor = 3  # Refreshed CoT goes stale after this many intervals
+refresh_scheduler = RefreshScheduler(refresh_interval, refresh_expire_minutes * 60, refresh_rate_limit)
+refresh_thread = None
+refresh_target = ('239.2.3.1', 6969)  # Multicast group and port of the current broadcast
+heatmap_renderer = HeatmapRenderer(args.tile_cache)
+diff_baseline_macs = None  # Sorted MAC integers of the baseline sessions, when broadcasting a diff
+diff_only_new = False  # Skip devices that were already in the baseline
+diff_highlight_color = '-65536'  # ARGB for new devices unless a blacklist color applies (red)
+follow_enabled = False  # Watch for devices that keep turning up at our different stops
+follow_min_places = 3  # Separated places a device must be seen at
+follow_min_minutes = 30  # ...spread over at least this many minutes
+follow_separation_m = 500  # Sightings closer than this count as the same place
+follow_detector = FollowDetector(follow_min_places, follow_min_minutes, follow_separation_m)
+follow_alerts = deque(maxlen=100)  # Most recent alerts for the web UI
+session_stats = {}  # Session name -> SessionStats, rebuilt each time the session is broadcast
+stats_session = None  # Session broadcast most recently, the /stats default
+AGGREGATE_SESSION = 'aggregate'  # session_stats key of the sightings an aggregator receives from collectors
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Upload bodies are streamed to disk in pieces of this size
+sighting_forwarder = None  # Collector mode: sightings go to the aggregator, which alone sends CoT
+if args.forward_to:
+    forward_host, _, forward_port = args.forward_to.rpartition(':')
+    sighting_forwarder = SightingForwarder(args.node_id, forward_host, int(forward_port), args.forward_transport)
+    logger.info(f'Collector {args.node_id} forwarding sightings to {args.forward_to} over {args.forward_transport}')
+aggregate_lock = threading.Lock()
+aggregate_nodes = {}  # MAC -> node ids that reported it
+aggregate_sent = {}  # MAC -> estimate last broadcast for it
+aggregate_estimator = EmitterEstimator()  # Sightings from all nodes refine one estimate per device
+aggregate_socket = None
+aggregator = None
+peer_suppression_window = 60  # Seconds a peer's announcement suppresses our own CoT for that UID
+peer_listener = None
+if args.peer_suppression:
+    peer_listener = PeerListener(window=peer_suppression_window)
+    peer_listener.start()
+if args.aggregate_port:
+    aggregator = AggregatorServer('0.0.0.0', args.aggregate_port, lambda node_id, fields: ingest_remote_sighting(node_id, fields))
+    aggregator.start()
 
 @app.route('/')
 def index():
@@ -131,6 +204,146 @@ def update_antenna_sensitivity():
         logger.error("Missing antenna sensitivity in the request")
         return jsonify({'error': 'Missing antenna sensitivity in the request'}), 400
 
+def parse_flag(value):
+    # JSON booleans, or the strings/numbers forms post as ("false" must not count as true)
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('true', '1', 'yes', 'on'):
+        return True
+    if text in ('false', '0', 'no', 'off', ''):
+        return False
+    raise ValueError(f'Not a boolean: {value!r}')
+
+@app.route('/update_refresh_settings', methods=['POST'])
+def update_refresh_settings():
+    data = request.json
+    global refresh_enabled, refresh_interval, refresh_expire_minutes, refresh_rate_limit
+    try:
+        enabled = parse_flag(data.get('enabled', refresh_enabled))
+        interval = float(data.get('interval', refresh_interval))
+        expire_minutes = float(data.get('expire_minutes', refresh_expire_minutes))
+        rate_limit = int(data.get('rate_limit', refresh_rate_limit))
+    except (ValueError, TypeError):
+        logger.error("Invalid refresh settings in the request")
+        return jsonify({'error': 'Invalid refresh settings in the request'}), 400
+    if interval <= 0 or expire_minutes <= 0 or rate_limit <= 0:
+        logger.error("Refresh settings must be positive")
+        return jsonify({'error': 'Refresh settings must be positive'}), 400
+
+    refresh_enabled, refresh_interval = enabled, interval
+    refresh_expire_minutes, refresh_rate_limit = expire_minutes, rate_limit
+    refresh_scheduler.interval = refresh_interval
+    refresh_scheduler.expire_after = refresh_expire_minutes * 60
+    refresh_scheduler.max_per_second = refresh_rate_limit
+    if refresh_enabled and broadcasting:
+        start_refresh_loop(*refresh_target)
+    logger.info(f"Refresh settings updated: enabled={refresh_enabled}, interval={refresh_interval}s, "
+                f"expire={refresh_expire_minutes}min, rate={refresh_rate_limit}/s")
+    return jsonify({'message': 'Refresh settings updated successfully!'}), 200
+
+@app.route('/get_refresh_settings', methods=['GET'])
+def get_refresh_settings():
+    return jsonify({
+        'enabled': refresh_enabled,
+        'interval': refresh_interval,
+        'expire_minutes': refresh_expire_minutes,
+        'rate_limit': refresh_rate_limit,
+        'scheduled_devices': len(refresh_scheduler)
+    }), 200
+
+@app.route('/update_follow_settings', methods=['POST'])
+def update_follow_settings():
+    data = request.json
+    global follow_enabled, follow_min_places, follow_min_minutes, follow_separation_m, follow_detector
+    try:
+        enabled = parse_flag(data.get('enabled', follow_enabled))
+        min_places = int(data.get('min_places', follow_min_places))
+        min_minutes = float(data.get('min_minutes', follow_min_minutes))
+        separation_m = float(data.get('separation_m', follow_separation_m))
+    except (ValueError, TypeError):
+        logger.error("Invalid follow detection settings in the request")
+        return jsonify({'error': 'Invalid follow detection settings in the request'}), 400
+    if min_places < 2 or min_minutes < 0 or separation_m <= 0:
+        logger.error("Follow detection needs at least 2 places and a positive separation")
+        return jsonify({'error': 'Follow detection needs at least 2 places and a positive separation'}), 400
+
+    rule_changed = (min_places, min_minutes, separation_m) != (follow_min_places, follow_min_minutes, follow_separation_m)
+    follow_enabled = enabled
+    follow_min_places, follow_min_minutes, follow_separation_m = min_places, min_minutes, separation_m
+    if rule_changed:
+        # Visit history is kept across broadcasts; only a new rule starts it over
+        follow_detector = FollowDetector(follow_min_places, follow_min_minutes, follow_separation_m)
+    logger.info(f"Follow detection settings updated: enabled={follow_enabled}, places={follow_min_places}, "
+                f"minutes={follow_min_minutes}, separation={follow_separation_m}m")
+    return jsonify({'message': 'Follow detection settings updated successfully!'}), 200
+
+@app.route('/get_follow_settings', methods=['GET'])
+def get_follow_settings():
+    return jsonify({
+        'enabled': follow_enabled,
+        'min_places': follow_min_places,
+        'min_minutes': follow_min_minutes,
+        'separation_m': follow_separation_m,
+        'tracked_devices': len(follow_detector)
+    }), 200
+
+@app.route('/follow_alerts', methods=['GET'])
+def get_follow_alerts():
+    suspects = [{'mac': mac, 'ssid': ssid, 'places': places}
+                for mac, ssid, places in follow_detector.suspects()[:50]]
+    return jsonify({'alerts': list(follow_alerts), 'suspects': suspects}), 200
+
+@app.route('/update_peer_settings', methods=['POST'])
+def update_peer_settings():
+    data = request.json
+    global peer_listener, peer_suppression_window
+    try:
+        enabled = bool(data.get('enabled', peer_listener is not None))
+        window = float(data.get('window', peer_suppression_window))
+    except (ValueError, TypeError):
+        logger.error("Invalid peer suppression settings in the request")
+        return jsonify({'error': 'Invalid peer suppression settings in the request'}), 400
+    if window <= 0:
+        return jsonify({'error': 'Window must be positive'}), 400
+
+    peer_suppression_window = window
+    if enabled and peer_listener is None:
+        listener = PeerListener(window=peer_suppression_window)
+        try:
+            listener.start()
+        except OSError as e:
+            logger.error(f"Could not join the TAK multicast group: {e}")
+            return jsonify({'error': f'Could not join the TAK multicast group: {e}'}), 500
+        peer_listener = listener
+    elif not enabled and peer_listener is not None:
+        peer_listener.stop()
+        peer_listener = None
+    if peer_listener is not None:
+        peer_listener.window = peer_suppression_window
+    logger.info(f"Peer suppression settings updated: enabled={enabled}, window={peer_suppression_window}s")
+    return jsonify({'message': 'Peer suppression settings updated successfully!'}), 200
+
+@app.route('/get_peer_settings', methods=['GET'])
+def get_peer_settings():
+    settings = {'enabled': peer_listener is not None, 'window': peer_suppression_window}
+    if peer_listener is not None:
+        settings.update(peer_listener.stats())
+    return jsonify(settings), 200
+
+@app.route('/aggregator_status', methods=['GET'])
+def aggregator_status():
+    status = {'node_id': args.node_id,
+              'mode': 'collector' if sighting_forwarder else 'aggregator' if aggregator else 'standalone'}
+    if sighting_forwarder is not None:
+        status['forwarder'] = sighting_forwarder.stats()
+    if aggregator is not None:
+        status['aggregator'] = aggregator.stats()
+        with aggregate_lock:
+            status['devices'] = len(aggregate_nodes)
+            status['multi_node_devices'] = sum(1 for nodes in aggregate_nodes.values() if len(nodes) > 1)
+    return jsonify(status), 200
+
 @app.route('/get_antenna_settings', methods=['GET'])
 def get_antenna_settings():
     global antenna_sensitivity, custom_sensitivity_factor, sensitivity_factors
@@ -167,7 +380,7 @@ def stop_broadcast():
 
 @app.route('/start_broadcast', methods=['POST'])
 def start_broadcast():
-    global broadcasting, broadcast_thread
+    global broadcasting, broadcast_thread, diff_baseline_macs, diff_only_new, diff_highlight_color
     data = request.json
     directory = data.get('directory', wigle_csv_directory)  # Use default directory if none provided
     filename = data.get('filename')
@@ -177,8 +390,33 @@ def start_broadcast():
         full_path = os.path.join(directory, filename)
         if os.path.exists(full_path):
             logger.info(f'File path: {full_path}')
+            # Optional replay start, by row number or by FirstSeen timestamp
+            try:
+                start_row, start_position = replay_start(full_path, data.get('start_row'), data.get('start_time'))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            # Optional diff against baseline sessions: highlight (or only send) new devices
+            diff_against = data.get('diff_against') or []
+            if isinstance(diff_against, str):
+                diff_against = [name for name in diff_against.split(',') if name]
+            baseline_paths = [os.path.join(directory, os.path.basename(name)) for name in diff_against]
+            missing = [path for path in baseline_paths if not os.path.exists(path)]
+            if missing:
+                return jsonify({'error': f'Baseline file does not exist: {os.path.basename(missing[0])}'}), 404
+            if baseline_paths:
+                # Devices are checked against the baseline as they are sent, so devices that only
+                # show up later in a realtime session are still recognised as new
+                diff_baseline_macs = union_macs(baseline_paths)
+                diff_only_new = bool(data.get('diff_only_new', False))
+                diff_highlight_color = str(data.get('diff_color', diff_highlight_color))
+                logger.info(f'Diff against {len(baseline_paths)} baseline sessions '
+                            f'with {len(diff_baseline_macs)} devices')
+            else:
+                diff_baseline_macs = None
             broadcasting = True  
-            broadcast_thread = threading.Thread(target=broadcast_file, args=(full_path,))
+            live_feed.reset()
+            broadcast_thread = threading.Thread(target=broadcast_file, args=(full_path,),
+                                                kwargs={'start_position': start_position, 'start_row': start_row})
             broadcast_thread.start()  # Start broadcasting in a separate thread
             return jsonify({'message': 'Broadcast started for file: ' + filename})
         else:
@@ -186,6 +424,59 @@ def start_broadcast():
     else:
         return jsonify({'error': 'Filename parameter is missing'}), 400
 
+@app.route('/upload', methods=['POST', 'PUT'])
+def upload_file():
+    # Stream a raw wiglecsv request body to disk, optionally analysing it while it arrives
+    global broadcasting, broadcast_thread
+    # Uploads only ever create new files in the logs directory
+    filename = os.path.basename(request.args.get('filename') or request.headers.get('X-Filename', ''))
+    if not filename.endswith('.wiglecsv'):
+        return jsonify({'error': 'Filename must end with .wiglecsv'}), 400
+    directory = os.path.realpath(wigle_csv_directory)
+    full_path = os.path.join(directory, filename)
+    if os.path.dirname(os.path.realpath(full_path)) != directory:
+        return jsonify({'error': 'Invalid filename'}), 400
+    if os.path.lexists(full_path):
+        return jsonify({'error': 'File already exists'}), 409
+    ingest = request.args.get('ingest') == 'true'
+    if ingest and broadcasting:
+        return jsonify({'error': 'Stop the running broadcast before ingesting an upload'}), 409
+
+    upload_done = threading.Event()
+    received = 0
+    started = time.time()
+    try:
+        file = open(full_path, 'xb')
+    except FileExistsError:
+        return jsonify({'error': 'File already exists'}), 409
+    try:
+        with file:
+            if ingest:
+                broadcasting = True
+                live_feed.reset()
+                broadcast_thread = threading.Thread(target=broadcast_file, args=(full_path,),
+                                                    kwargs={'upload_done': upload_done})
+                broadcast_thread.start()
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file.write(chunk)
+                received += len(chunk)
+                if ingest:
+                    file.flush()  # Make the rows visible to the ingest thread right away
+    except Exception as e:
+        upload_done.set()
+        logger.error(f"Upload of {filename} failed after {received} bytes: {e}")
+        try:
+            os.remove(full_path)
+        except OSError:
+            pass
+        return jsonify({'error': 'Upload failed'}), 500
+    upload_done.set()
+    logger.info(f"Uploaded {filename}: {received} bytes in {time.time() - started:.1f}s")
+    return jsonify({'message': 'Upload complete: ' + filename, 'bytes': received, 'ingesting': ingest})
+
 @app.route('/add_to_whitelist', methods=['POST'])
 def add_to_whitelist():
     data = request.json
@@ -255,19 +546,286 @@ def remove_from_blacklist():
     else:
         return jsonify({'error': 'Missing SSID or MAC address in request'}), 400
 
+@app.route('/export/<fmt>', methods=['GET'])
+def export_session(fmt):
+    directory = request.args.get('directory', wigle_csv_directory)
+    filename = request.args.get('filename')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported export format: {fmt}'}), 400
+    if not filename:
+        return jsonify({'error': 'Filename parameter is missing'}), 400
+
+    full_path = os.path.join(directory, os.path.basename(filename))
+    if not os.path.exists(full_path):
+        return jsonify({'error': 'File does not exist'}), 404
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    export_name = os.path.splitext(os.path.basename(filename))[0] + extension
+    logger.info(f'Exporting {full_path} as {fmt}')
+    chunks = generate_export(full_path, fmt, device_colors, is_excluded, title=filename)
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{export_name}"'})
+
+@app.route('/datapackage', methods=['GET'])
+def export_data_package():
+    # One zip ATAK can import, instead of replaying thousands of UDP CoT
+    directory = request.args.get('directory', wigle_csv_directory)
+    filename = request.args.get('filename')
+    if not filename:
+        return jsonify({'error': 'Filename parameter is missing'}), 400
+    full_path = os.path.join(directory, os.path.basename(filename))
+    if not os.path.exists(full_path):
+        return jsonify({'error': 'File does not exist'}), 404
+    try:
+        stale_seconds = float(request.args.get('stale_hours', 24)) * 3600
+    except ValueError:
+        return jsonify({'error': 'stale_hours must be a number'}), 400
+
+    # Optional device filters: SSID substring, MAC prefix, only devices new since baseline sessions
+    ssid_filter = (request.args.get('ssid') or '').lower()
+    mac_filter = (request.args.get('mac') or '').upper()
+    baseline_macs = None
+    baseline = [name for name in request.args.get('diff_against', '').split(',') if name]
+    if baseline:
+        baseline_paths = [os.path.join(directory, os.path.basename(name)) for name in baseline]
+        if not all(os.path.exists(path) for path in baseline_paths):
+            return jsonify({'error': 'Baseline file does not exist'}), 404
+        baseline_macs = union_macs(baseline_paths)
+
+    def excluded(ssid, mac):
+        return is_excluded(ssid, mac) or \
+            (ssid_filter and ssid_filter not in ssid.lower()) or \
+            (mac_filter and not mac.upper().startswith(mac_filter)) or \
+            (baseline_macs is not None and not is_new_device(mac, baseline_macs))
+
+    estimator = EmitterEstimator()
+    refit_estimator(estimator, full_path)
+    sensitivity_factor = current_sensitivity_factor()
+
+    def cot_for(sighting):
+        estimate = estimator.estimate(sighting.mac, sensitivity_factor)
+        uid = sighting.ssid if sighting.ssid.strip() else sighting.mac
+        return uid, create_cot_xml_payload_ellipse(
+            sighting.mac, sighting.ssid, sighting.firstseen, sighting.channel, sighting.rssi,
+            sighting.currentlatitude, sighting.currentlongitude, sighting.altitudemeters,
+            sighting.accuracymeters, sighting.authmode, sighting.device_type, estimate, stale_seconds,
+            baseline_macs=baseline_macs)
+
+    def colors(ssid, mac):
+        return device_colors(ssid, mac, baseline_macs)
+
+    package_name = os.path.splitext(os.path.basename(filename))[0]
+    logger.info(f'Exporting {full_path} as a TAK data package')
+    chunks = generate_data_package(full_path, cot_for, colors, excluded, name=package_name)
+    return Response(stream_with_context(chunks), mimetype=DATA_PACKAGE_MIMETYPE,
+                    headers={'Content-Disposition': f'attachment; filename="{package_name}.zip"'})
+
+@app.route('/device_history', methods=['GET'])
+def device_history():
+    mac = request.args.get('mac')
+    if device_store is None:
+        return jsonify({'error': 'Device history is disabled, start with --history-db'}), 404
+    if not mac:
+        return jsonify({'error': 'MAC parameter is missing'}), 400
+
+    history = device_store.lookup(mac)
+    if history is None:
+        return jsonify({'mac': mac, 'seen_before': False})
+    result = {
+        'mac': mac,
+        'seen_before': True,
+        'first_seen': history.first_seen,
+        'last_seen': history.last_seen,
+        'sightings': history.sightings
+    }
+    if request.args.get('details') == 'true':
+        try:
+            limit = int(request.args.get('limit', 100))
+        except ValueError:
+            return jsonify({'error': 'Limit must be an integer'}), 400
+        result['recent_sightings'] = device_store.recent_sightings(mac, limit)
+    return jsonify(result)
+
+@app.route('/heatmap/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def heatmap_tile(z, x, y):
+    # XYZ RSSI heatmap tile for a session, optionally filtered to one SSID or MAC
+    directory = request.args.get('directory', wigle_csv_directory)
+    filename = request.args.get('filename')
+    if not filename:
+        return jsonify({'error': 'Filename parameter is missing'}), 400
+    full_path = os.path.join(directory, os.path.basename(filename))
+    if not os.path.exists(full_path):
+        return jsonify({'error': 'File does not exist'}), 404
+
+    try:
+        png = heatmap_renderer.tile(full_path, z, x, y,
+                                    reducer=request.args.get('reducer', 'max'),
+                                    ssid=request.args.get('ssid'),
+                                    mac=request.args.get('mac'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(png, mimetype='image/png', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/events', methods=['GET'])
+def events():
+    # Server-Sent Events stream of coalesced device deltas and throughput counters
+    stream = live_feed.stream(request.headers.get('Last-Event-ID'))
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/search', methods=['GET'])
+def search_devices():
+    # Indexed SSID / MAC prefix search across every session in the directory
+    directory = request.args.get('directory', wigle_csv_directory)
+    if not os.path.isdir(directory):
+        return jsonify({'error': 'Directory does not exist'}), 404
+    index = get_search_index(directory)
+    started = time.perf_counter()
+    try:
+        total, devices = index.search(ssid=request.args.get('ssid'),
+                                      mac=request.args.get('mac'),
+                                      match=request.args.get('match', 'substring'),
+                                      limit=request.args.get('limit', 100))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # Until the first pass over the directory finishes, totals only cover what is indexed so far
+    stats = index.stats()
+    return jsonify({'total': total, 'devices': devices, 'index': stats, 'indexing': stats['indexing'],
+                    'progress': stats['progress'], 'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)})
+
+@app.route('/diff', methods=['GET'])
+def diff_session_files():
+    # New / gone / common devices of the current session(s) against baseline session(s)
+    directory = request.args.get('directory', wigle_csv_directory)
+    baseline = [name for name in request.args.get('baseline', '').split(',') if name]
+    current = [name for name in request.args.get('current', '').split(',') if name]
+    files = [name for name in request.args.get('files', '').split(',') if name]
+    if not baseline and not current and len(files) > 1:
+        # files=a,b,c style: the last file is the current session
+        baseline, current = files[:-1], files[-1:]
+    if not baseline or not current:
+        return jsonify({'error': 'Need baseline and current sessions'}), 400
+    paths = {}
+    for name in baseline + current:
+        path = os.path.join(directory, os.path.basename(name))
+        if not os.path.exists(path):
+            return jsonify({'error': f'File does not exist: {name}'}), 404
+        paths[name] = path
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 0), 100000)
+    except ValueError:
+        return jsonify({'error': 'Limit must be an integer'}), 400
+
+    started = time.perf_counter()
+    diff = diff_sessions([paths[name] for name in baseline], [paths[name] for name in current])
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    result = {'baseline': baseline, 'current': current, 'elapsed_ms': elapsed_ms}
+    for name in diff._fields:
+        macs = getattr(diff, name)
+        result[name] = {'count': len(macs), 'macs': format_macs(macs, limit)}
+    return jsonify(result)
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    # Running channel / band / encryption / type / vendor counts, no file rescan
+    filename = request.args.get('file') or request.args.get('filename')
+    if request.args.get('session') == AGGREGATE_SESSION:
+        session = AGGREGATE_SESSION
+    elif filename:
+        directory = request.args.get('directory', wigle_csv_directory)
+        session = session_key(os.path.join(directory, os.path.basename(filename)))
+    else:
+        # An aggregator that has not broadcast a file itself reports what its collectors sent
+        session = stats_session if stats_session is not None else AGGREGATE_SESSION
+    stats = session_stats.get(session)
+    if stats is None:
+        return jsonify({'error': 'No statistics for this session, start a broadcast first'}), 404
+    try:
+        top = int(request.args.get('top', 20))
+    except ValueError:
+        return jsonify({'error': 'Top must be an integer'}), 400
+    return jsonify(stats.snapshot(top))
+
+@app.route('/rows', methods=['GET'])
+def list_rows():
+    # Random-access paging through a session using the sidecar row index
+    directory = request.args.get('directory', wigle_csv_directory)
+    filename = request.args.get('file') or request.args.get('filename')
+    if not filename:
+        return jsonify({'error': 'File parameter is missing'}), 400
+    full_path = os.path.join(directory, os.path.basename(filename))
+    if not os.path.exists(full_path):
+        return jsonify({'error': 'File does not exist'}), 404
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 100)), 0), 1000)
+    except ValueError:
+        return jsonify({'error': 'Offset and limit must be integers'}), 400
+
+    index = get_index(full_path)
+    rows = []
+    for row, line in enumerate(index.read_rows(offset, limit), offset):
+        sighting = parse_line(line)
+        if sighting is None:
+            rows.append({'row': row, 'raw': line.rstrip('\r')})
+        else:
+            rows.append({'row': row, 'fields': sighting._asdict()})
+    return jsonify({'file': os.path.basename(filename), 'total_rows': len(index),
+                    'offset': offset, 'limit': limit, 'rows': rows})
+
+def replay_start(full_path, start_row=None, start_time=None):
+    # Resolve a replay start to (row, byte offset) with the row index
+    if start_row is None and start_time is None:
+        return 0, 0
+    index = get_index(full_path)
+    if start_time is not None:
+        try:
+            timestamp = float(start_time)
+        except (ValueError, TypeError):
+            timestamp = parse_timestamp(str(start_time), default=float('nan'))
+            if timestamp != timestamp:
+                raise ValueError(f'Invalid start_time: {start_time}')
+        start_row = index.find_time(timestamp)
+    try:
+        start_row = int(start_row)
+    except (ValueError, TypeError):
+        raise ValueError(f'Invalid start_row: {start_row}')
+    if start_row <= 0:
+        return 0, 0
+    if start_row >= len(index):
+        return len(index), index.covered
+    logger.info(f'Replay starts at row {start_row} of {full_path}')
+    return start_row, index.row_span(start_row)[0]
+
+def session_key(full_path):
+    # Sessions (history high-water marks, statistics) are keyed by the resolved file path,
+    # so same-named CSVs in different directories stay separate
+    return os.path.realpath(full_path)
+
 def read_file(filename, start_position):
     with open(filename, 'r') as file:
         file.seek(start_position)
         for line in file:
             yield line.strip().split(',')
 
-def broadcast_file(full_path, multicast_group='239.2.3.1', port=6969):
-    if analysis_mode == 'realtime':
-        broadcast_file_realtime(full_path, multicast_group, port)
+def broadcast_file(full_path, multicast_group='239.2.3.1', port=6969, start_position=0, start_row=0, upload_done=None):
+    global stats_session, refresh_target
+    stats_session = session_key(full_path)
+    session_stats[stats_session] = SessionStats(stats_session)
+    refresh_scheduler.clear()
+    refresh_target = (multicast_group, port)
+    if refresh_enabled:
+        start_refresh_loop(multicast_group, port)
+    if upload_done is not None:
+        # Uploads are analysed with the post-collection rules while they arrive
+        logger.info(f'Ingesting upload in post-collection mode: {full_path}')
+        setup_socket_and_broadcast(full_path, multicast_group, port, 100, upload_done=upload_done)
+    elif analysis_mode == 'realtime':
+        broadcast_file_realtime(full_path, multicast_group, port, start_position, start_row)
     else:
-        broadcast_file_postcollection(full_path, multicast_group, port)
+        broadcast_file_postcollection(full_path, multicast_group, port, start_position=start_position, start_row=start_row)
 
-def broadcast_file_realtime(full_path, multicast_group='239.2.3.1', port=6969):
+def broadcast_file_realtime(full_path, multicast_group='239.2.3.1', port=6969, start_position=0, start_row=0):
     logger.info(f'Broadcasting in real-time mode for file: {full_path}')
     
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -275,68 +833,382 @@ def broadcast_file_realtime(full_path, multicast_group='239.2.3.1', port=6969):
     ttl = struct.pack('b', 1)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
 
-    last_position = 0
+    last_position = start_position
+    row_number = start_row
+    session = session_key(full_path)
     processed_macs = set()
+    estimator = EmitterEstimator()
+    sent_estimates = {}  # Last estimate broadcast per MAC
     while broadcasting:
         logger.debug(f"Broadcasting CoT XML packets from file: {full_path}, last position: {last_position}")
         for fields in read_file(full_path, last_position):
+            row_number += 1
             if len(fields) >= 10:
                 mac, ssid, authmode, firstseen, channel, rssi, currentlatitude, currentlongitude, altitudemeters, accuracymeters, device_type = fields[:11]
-                if mac not in processed_macs and (not whitelisted_macs or mac not in whitelisted_macs):
-                    cot_xml_payload = create_cot_xml_payload_ellipse(mac, ssid, firstseen, channel, rssi, currentlatitude, currentlongitude, altitudemeters, accuracymeters, authmode, device_type)
-                    logger.debug(f"Sending CoT XML packet: {cot_xml_payload}")
-                    # Send the CoT XML packet
-                    if tak_multicast_state:
-                        # Send to multicast if multicast is enabled
-                        sock.sendto(cot_xml_payload.encode(), (multicast_group, port))
-                    
-                    if tak_server_ip and tak_server_port:
-                        # Send to user-defined IP and Port if available
-                        sock.sendto(cot_xml_payload.encode(), (tak_server_ip, int(tak_server_port)))
+                record_history(session, row_number, fields)
+                if whitelisted_macs and mac in whitelisted_macs:
+                    continue
+                check_follow(sock, multicast_group, port, fields)
+                # Every sighting refines the emitter estimate; resend only when it moved noticeably
+                estimate = estimator.update(mac, currentlatitude, currentlongitude, rssi, current_sensitivity_factor())
+                if mac in processed_macs and not estimate_changed(estimate, sent_estimates.get(mac)):
+                    if refresh_enabled:
+                        # Not resent, but still seen; emit_device touches the devices it sends
+                        refresh_scheduler.touch(mac, (fields, estimate))
+                    continue
+                emit_device(sock, multicast_group, port, fields, estimate)
 
-                    processed_macs.add(mac)  # Add MAC address to processed set
+                processed_macs.add(mac)  # Add MAC address to processed set
+                sent_estimates[mac] = estimate
         # Update the last position
         last_position = os.path.getsize(full_path)
         time.sleep(0.1)
         
     sock.close()
 
-def broadcast_file_postcollection(full_path, multicast_group='239.2.3.1', port=6969, chunk_size=100):
+def record_history(session, row_number, fields):
+    if is_header(fields):
+        return
+    # Every row also feeds the running session statistics
+    stats = session_stats.get(session)
+    if stats is not None:
+        stats.observe(fields)
+    if device_store is not None:
+        device_store.record(session, row_number, Sighting(*fields[:11]))
+    if sighting_forwarder is not None and not is_excluded(fields[1], fields[0]):
+        # The forwarder passes on first sightings and material changes; the aggregator merges them
+        sighting_forwarder.submit(fields)
+
+def emit_device(sock, multicast_group, port, fields, estimate=None, refresh=False, nodes=None):
+    mac, ssid, authmode, firstseen, channel, rssi, currentlatitude, currentlongitude, altitudemeters, accuracymeters, device_type = fields[:11]
+    baseline_macs = diff_baseline_macs
+    if diff_only_new and baseline_macs is not None and not is_new_device(mac, baseline_macs):
+        return
+    if peer_listener is not None and peer_listener.announced(ssid if ssid and ssid.strip() else mac):
+        # A peer on the multicast segment already put this device on the map
+        return
+    if sighting_forwarder is not None:
+        # Collectors leave CoT to the aggregator; record_history already submitted the sighting
+        if refresh:
+            return
+    else:
+        # With refreshing enabled devices get short stale times and age out once they stop being refreshed
+        stale_seconds = refresh_interval * refresh_stale_factor if refresh_enabled else None
+        cot_xml_payload = create_cot_xml_payload_ellipse(mac, ssid, firstseen, channel, rssi, currentlatitude, currentlongitude, altitudemeters, accuracymeters, authmode, device_type, estimate, stale_seconds, nodes, baseline_macs)
+        logger.debug(f"Sending CoT XML packet: {cot_xml_payload}")
+        send_cot(sock, cot_xml_payload, multicast_group, port)
+        if refresh:
+            return
+        if refresh_enabled:
+            refresh_scheduler.touch(mac, (fields, estimate, nodes))
+
+    # Report the device to the live feed at the position we actually sent
+    if estimate is not None and estimate.sightings > 1:
+        currentlatitude, currentlongitude = estimate.lat, estimate.lon
+    live_feed.publish_device(mac, ssid, currentlatitude, currentlongitude, rssi, channel, authmode, device_type,
+                             device_colors(ssid, mac, baseline_macs)[0])
+
+def start_refresh_loop(multicast_group, port):
+    # Refresh can be switched on before or during a broadcast; run at most one loop
+    global refresh_thread
+    if refresh_thread is None or not refresh_thread.is_alive():
+        refresh_thread = threading.Thread(target=refresh_loop, args=(multicast_group, port), daemon=True)
+        refresh_thread.start()
+
+def refresh_loop(multicast_group, port):
+    logger.info(f'Refreshing active devices every {refresh_interval}s until unseen for {refresh_expire_minutes} minutes')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.2)
+    ttl = struct.pack('b', 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+
+    def send(mac, state):
+        fields, estimate, *nodes = state
+        emit_device(sock, multicast_group, port, fields, estimate, refresh=True, nodes=nodes[0] if nodes else None)
+
+    refresh_scheduler.run(send, lambda: broadcasting and refresh_enabled)
+    sock.close()
+
+def ingest_remote_sighting(node_id, fields, multicast_group='239.2.3.1', port=6969):
+    # Aggregator: merge one collector sighting and send CoT only for new or moved devices
+    global aggregate_socket
+    mac, ssid = fields[0], fields[1]
+    stats = session_stats.get(AGGREGATE_SESSION)
+    if stats is None:
+        with aggregate_lock:
+            stats = session_stats.get(AGGREGATE_SESSION)
+            if stats is None:
+                stats = session_stats[AGGREGATE_SESSION] = SessionStats(AGGREGATE_SESSION)
+    stats.observe(fields)
+    if is_excluded(ssid, mac):
+        return
+    with aggregate_lock:
+        if aggregate_socket is None:
+            aggregate_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            aggregate_socket.settimeout(0.2)
+            aggregate_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack('b', 1))
+        nodes = aggregate_nodes.setdefault(mac, set())
+        nodes.add(node_id)
+        # A device heard by several nodes is one device: resend only when the merged estimate moves
+        estimate = aggregate_estimator.update(mac, fields[6], fields[7], fields[5], current_sensitivity_factor())
+        changed = mac not in aggregate_sent or estimate_changed(estimate, aggregate_sent[mac])
+        if changed:
+            aggregate_sent[mac] = estimate
+        node_list = sorted(nodes)
+    check_follow(aggregate_socket, multicast_group, port, fields)
+    if changed:
+        emit_device(aggregate_socket, multicast_group, port, fields, estimate, nodes=node_list)
+
+def check_follow(sock, multicast_group, port, fields):
+    # Feed one sighting to the follow detector and alert TAK when a device keeps turning up
+    # (collectors leave this to the aggregator, which sees every node's sightings)
+    if not follow_enabled or sighting_forwarder is not None or is_header(fields):
+        return
+    try:
+        lat, lon = float(fields[6]), float(fields[7])
+    except ValueError:
+        return
+    if lat == 0.0 and lon == 0.0:
+        return
+    alert = follow_detector.observe(fields[0], fields[1], lat, lon, parse_timestamp(fields[3]))
+    if alert is None:
+        return
+    minutes = (alert.last_seen - alert.first_seen) / 60
+    logger.warning(f"Possible surveillance: {alert.mac} ({alert.ssid}) seen at {alert.places} places over {minutes:.0f} minutes")
+    follow_alerts.append({
+        'mac': alert.mac, 'ssid': alert.ssid, 'lat': alert.lat, 'lon': alert.lon, 'places': alert.places,
+        'first_seen': alert.first_seen, 'last_seen': alert.last_seen,
+        'visits': [{'lat': v[0], 'lon': v[1], 'first_seen': v[2], 'last_seen': v[3]} for v in alert.visits],
+    })
+    send_cot(sock, create_follow_alert_payload(alert), multicast_group, port)
+
+def create_follow_alert_payload(alert):
+    # Hostile marker at the latest sighting; ATAK shows it in red and lists it in alerts
+    now = datetime.datetime.utcnow()
+    time_str = now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    stale_time = (now + datetime.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    minutes = (alert.last_seen - alert.first_seen) / 60
+    places = '; '.join(f"{lat:.5f},{lon:.5f} "
+                       f"{datetime.datetime.utcfromtimestamp(first).strftime('%H:%M')}-"
+                       f"{datetime.datetime.utcfromtimestamp(last).strftime('%H:%M')}"
+                       for lat, lon, first, last in alert.visits)
+    callsign = escape(f"FOLLOW {alert.ssid or alert.mac}")
+    remarks = escape(f"Possible surveillance: MAC {alert.mac}, SSID {alert.ssid}, seen at {alert.places} "
+                     f"places over {minutes:.0f} minutes. Visits: {places}")
+    return f'''<?xml version="1.0" encoding="UTF-8"?><event version="2.0" uid="follow-{escape(alert.mac)}" type="a-h-G" how="m-g" time="{time_str}" start="{time_str}" stale="{stale_time}">
+    <point lat="{alert.lat}" lon="{alert.lon}" hae="0" ce="50" le="9999999"/>
+    <detail>
+        <contact callsign="{callsign}"/>
+        <remarks>{remarks}</remarks>
+        <color argb="-65536"/>
+        <precisionlocation altsrc="???" geopointsrc="???"/>
+    </detail>
+</event>'''
+
+def send_cot(sock, cot_xml_payload, multicast_group, port):
+    data = cot_xml_payload.encode()
+    if peer_listener is not None:
+        peer_listener.note_sent(data)
+    if tak_multicast_state:
+        # Send to multicast if multicast is enabled
+        sock.sendto(data, (multicast_group, port))
+        live_feed.count_packet(len(data))
+    if tak_server_ip and tak_server_port:
+        # Send to user-defined IP and Port if available
+        sock.sendto(data, (tak_server_ip, int(tak_server_port)))
+        live_feed.count_packet(len(data))
+
+def current_sensitivity_factor():
+    if antenna_sensitivity == 'custom':
+        return custom_sensitivity_factor
+    return sensitivity_factors.get(antenna_sensitivity, 1.0)
+
+def refit_estimator(estimator, full_path, batch_size=100000, start_position=0):
+    # Fold every sighting in the file into the estimator with vectorized batch updates
+    estimator.clear()
+    with open(full_path, 'r') as file:
+        file.seek(start_position)
+        while True:
+            lines = list(islice(file, batch_size))
+            if not lines:
+                break
+            macs, lats, lons, rssis = [], [], [], []
+            for line in lines:
+                fields = line.strip().split(',')
+                if len(fields) < 10:
+                    continue
+                try:
+                    lat, lon, rssi = float(fields[6]), float(fields[7]), float(fields[5])
+                except ValueError:
+                    continue
+                if lat == 0.0 and lon == 0.0:
+                    continue
+                macs.append(fields[0])
+                lats.append(lat)
+                lons.append(lon)
+                rssis.append(rssi)
+            if macs:
+                estimator.update_batch(macs, lats, lons, rssis)
+    logger.info(f'Emitter estimator fitted {len(estimator)} devices from {full_path}')
+
+def broadcast_file_postcollection(full_path, multicast_group='239.2.3.1', port=6969, chunk_size=100, start_position=0, start_row=0):
     logger.info(f'Broadcasting in post-collection mode for file: {full_path}')
-    setup_socket_and_broadcast(full_path, multicast_group, port, chunk_size)
+    # Follow detection needs every sighting in order, which only the single-process loop provides
+    if args.workers > 1 and not follow_enabled and os.path.getsize(full_path) - start_position >= MIN_PARALLEL_BYTES:
+        setup_socket_and_broadcast_parallel(full_path, multicast_group, port, chunk_size, start_position, start_row)
+    else:
+        setup_socket_and_broadcast(full_path, multicast_group, port, chunk_size, start_position, start_row)
 
-def setup_socket_and_broadcast(full_path, multicast_group, port, chunk_size):
+def setup_socket_and_broadcast(full_path, multicast_group, port, chunk_size, start_position=0, start_row=0, upload_done=None):
+    # With upload_done set the file is still being uploaded: read it as it grows
+    # until the event is set, and fit estimates incrementally instead of up front
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.settimeout(0.2)
     ttl = struct.pack('b', 1)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
 
+    # The whole session is available, so fit all sightings before sending anything
+    estimator = EmitterEstimator()
+    if upload_done is None:
+        refit_estimator(estimator, full_path, start_position=start_position)
+    sensitivity_factor = current_sensitivity_factor()
+
+    session = session_key(full_path)
+    row_number = start_row
     with open(full_path, 'r') as file:
+        file.seek(start_position)
         processed_entries = set()
+        sent_estimates = {}  # Upload mode: last estimate broadcast per MAC
+        partial_line = ''
         while broadcasting:
+            uploaded = upload_done is None or upload_done.is_set()
             lines = list(islice(file, chunk_size))
+            if partial_line and (lines or uploaded):
+                # Complete the held-back row, or flush it as the last row once the upload is done
+                lines = [partial_line + lines[0]] + lines[1:] if lines else [partial_line]
+                partial_line = ''
+            if lines and not uploaded and not lines[-1].endswith('\n'):
+                # The rest of this row has not arrived yet
+                partial_line = lines.pop()
             if not lines:
-                break
+                if uploaded:
+                    break
+                time.sleep(0.1)
+                continue
 
             for line in lines:
+                row_number += 1
                 fields = line.strip().split(',')
                 if len(fields) >= 10:
                     mac, ssid, authmode, firstseen, channel, rssi, currentlatitude, currentlongitude, altitudemeters, accuracymeters, device_type = fields[:11]
-                    if (mac not in processed_entries and ssid not in processed_entries) and \
-                       (not whitelisted_ssids or ssid not in whitelisted_ssids) and \
-                       (not whitelisted_macs or mac not in whitelisted_macs):
-                        cot_xml_payload = create_cot_xml_payload_ellipse(mac, ssid, firstseen, channel, rssi, currentlatitude, currentlongitude, altitudemeters, accuracymeters, authmode, device_type)
-                        if tak_multicast_state:
-                            sock.sendto(cot_xml_payload.encode(), (multicast_group, port))
-                        if tak_server_ip and tak_server_port:
-                            sock.sendto(cot_xml_payload.encode(), (tak_server_ip, int(tak_server_port)))
-
-                        processed_entries.add(mac)
-                        processed_entries.add(ssid)
+                    record_history(session, row_number, fields)
+                    if is_excluded(ssid, mac):
+                        continue
+                    check_follow(sock, multicast_group, port, fields)
+                    if upload_done is None:
+                        if mac in processed_entries or ssid in processed_entries:
+                            continue
+                        estimate = estimator.estimate(mac, sensitivity_factor)
+                    else:
+                        # Uploads are fitted as rows arrive, so every row refines the estimate
+                        # and a device already sent is resent when its estimate moves
+                        estimate = estimator.update(mac, currentlatitude, currentlongitude, rssi, sensitivity_factor)
+                        if mac in sent_estimates:
+                            if not estimate_changed(estimate, sent_estimates[mac]):
+                                continue
+                        elif mac in processed_entries or ssid in processed_entries:
+                            continue
+                        sent_estimates[mac] = estimate
+                    emit_device(sock, multicast_group, port, fields, estimate)
+
+                    processed_entries.add(mac)
+                    processed_entries.add(ssid)
             time.sleep(0.1)
     sock.close()
 
-def create_cot_xml_payload_ellipse(mac, ssid, firstseen, channel, rssi, currentlatitude, currentlongitude, altitudemeters, accuracymeters, authmode, device_type):
+def device_colors(ssid, mac, baseline_macs=None):
+    # Get color from blacklist or use default
+    color_argb = blacklisted_ssids.get(ssid, blacklisted_macs.get(mac))
+    if color_argb is None:
+        # Devices new since the caller's diff baseline stand out in the highlight color
+        color_argb = diff_highlight_color if is_new_device(mac, baseline_macs) else "-65281"
+    
+    # Convert color from argb string to individual style values for LineStyle and PolyStyle
+    # Default cyan colors if conversion fails
+    try:
+        # If color is a negative number as string (e.g., "-65281"), convert to positive hex
+        if color_argb.startswith('-'):
+            # Convert negative decimal to positive hex without '0x' prefix and ensure it's 8 digits
+            color_hex = format(int(color_argb) & 0xFFFFFFFF, '08x')
+        else:
+            # If it's already a positive number or hex string
+            color_hex = format(int(color_argb) & 0xFFFFFFFF, '08x')
+        
+        # Extract alpha, red, green, blue components
+        alpha = color_hex[0:2]
+        red = color_hex[2:4]
+        green = color_hex[4:6]
+        blue = color_hex[6:8]
+        
+        # Format for KML style (AABBGGRR format)
+        line_color = f"{alpha}{blue}{green}{red}"
+        poly_color = f"4c{blue}{green}{red}"  # 4c = ~30% opacity
+    except (ValueError, IndexError):
+        # Default cyan colors
+        line_color = "ff99ffff"
+        poly_color = "4c99ffff"
+    return color_argb, line_color, poly_color
+
+def is_new_device(mac, baseline_macs):
+    # New relative to a sorted baseline MAC array; False without a baseline
+    if baseline_macs is None:
+        return False
+    value = mac_to_int(mac)
+    return value is not None and not contains_mac(baseline_macs, value)
+
+def is_excluded(ssid, mac):
+    # Whitelisted devices are never broadcast or exported
+    return (bool(whitelisted_ssids) and ssid in whitelisted_ssids) or \
+           (bool(whitelisted_macs) and mac in whitelisted_macs)
+
+def setup_socket_and_broadcast_parallel(full_path, multicast_group, port, chunk_size, start_position=0, start_row=0):
+    # Parse, filter, dedup and fit estimates on all cores, then send in file order
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.2)
+    ttl = struct.pack('b', 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+
+    # Workers count statistics and convert history rows for every row, not just the
+    # deduplicated ones; shards are merged here in file order
+    session = session_key(full_path)
+    stats = session_stats.get(session)
+    history_session = session if device_store is not None else None
+    recorded_lines = device_store.recorded_rows(session) - start_row if device_store is not None else 0
+
+    def merge_shard(line_offset, counts, history):
+        if stats is not None:
+            stats.merge(counts)
+        if history is not None:
+            sightings, shard_devices, last_line = history
+            device_store.record_many(session, start_row + line_offset + last_line, sightings, shard_devices)
+
+    started = time.time()
+    devices, estimator = collect_devices(full_path, args.workers, whitelisted_ssids, whitelisted_macs, start_position,
+                                         history_session, recorded_lines, merge_shard)
+    logger.info(f'Parallel post-collection processing took {time.time() - started:.2f}s on {args.workers} workers')
+
+    sensitivity_factor = current_sensitivity_factor()
+    for start in range(0, len(devices), chunk_size):
+        if not broadcasting:
+            break
+        for row_number, fields in devices[start:start + chunk_size]:
+            emit_device(sock, multicast_group, port, fields, estimator.estimate(fields[0], sensitivity_factor))
+            if sighting_forwarder is not None:
+                sighting_forwarder.submit(fields)
+        time.sleep(0.1)
+    sock.close()
+
+def rssi_ellipse_axes(rssi, accuracymeters):
     # Convert RSSI to a reasonable ellipse size
     # RSSI typically ranges from -30 (very strong) to -90 (very weak)
     # Use the absolute RSSI value to calculate the size of the ellipse
@@ -344,10 +1216,7 @@ def create_cot_xml_payload_ellipse(mac, ssid, firstseen, channel, rssi, currentl
         rssi_value = abs(float(rssi))
         
         # Apply antenna sensitivity adjustment
-        global antenna_sensitivity, custom_sensitivity_factor
-        sensitivity_factor = sensitivity_factors.get(antenna_sensitivity, 1.0)
-        if antenna_sensitivity == 'custom':
-            sensitivity_factor = custom_sensitivity_factor
+        sensitivity_factor = current_sensitivity_factor()
             
         # Adjust RSSI based on antenna sensitivity
         # Higher sensitivity means we detect signals from farther away,
@@ -367,51 +1236,46 @@ def create_cot_xml_payload_ellipse(mac, ssid, firstseen, channel, rssi, currentl
         # Default values if RSSI or accuracy can't be parsed
         major_axis = 100
         minor_axis = 80
+    return major_axis, minor_axis
+
+def create_cot_xml_payload_ellipse(mac, ssid, firstseen, channel, rssi, currentlatitude, currentlongitude, altitudemeters, accuracymeters, authmode, device_type, estimate=None, stale_seconds=None, nodes=None, baseline_macs=None):
+    # With several sightings, place the ellipse on the estimated emitter
+    # position instead of where we happened to be when we heard it
+    if estimate is not None and estimate.sightings > 1:
+        currentlatitude = f"{estimate.lat:.7f}"
+        currentlongitude = f"{estimate.lon:.7f}"
+        major_axis = round(estimate.major, 1)
+        minor_axis = round(estimate.minor, 1)
+        angle = round(estimate.angle, 1)
+    else:
+        major_axis, minor_axis = rssi_ellipse_axes(rssi, accuracymeters)
+        # Generate random angle for more realistic visualization
+        angle = random.uniform(0, 180)
     
     # Include antenna sensitivity in remarks
     remarks = f"Channel: {channel}, RSSI: {rssi}, AltitudeMeters: {altitudemeters}, AccuracyMeters: {accuracymeters}, " \
               f"Authentication: {authmode}, Device: {device_type}, MAC: {mac}, " \
               f"Antenna: {antenna_sensitivity}"
+    if estimate is not None and estimate.sightings > 1:
+        remarks += f", Sightings: {estimate.sightings}, Estimated: true"
+    history = device_store.lookup(mac) if device_store is not None else None
+    if history is not None:
+        first_seen_ever = datetime.datetime.utcfromtimestamp(history.first_seen).strftime('%Y-%m-%d %H:%M:%S')
+        remarks += f", FirstSeenEver: {first_seen_ever}, TotalSightings: {history.sightings}"
+    if nodes:
+        remarks += f", Nodes: {' '.join(nodes)}"
     
     # Use SSID as UID if available, otherwise use MAC
     uid = ssid if ssid and ssid.strip() else mac
     
-    # Generate random angle for more realistic visualization
-    angle = random.uniform(0, 180)
-    
     # Format current time for CoT message
     current_time = datetime.datetime.utcnow()
     time_str = current_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
     start_time = time_str
-    stale_time = (current_time + datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-    
-    # Get color from blacklist or use default
-    color_argb = blacklisted_ssids.get(ssid, blacklisted_macs.get(mac, "-65281"))
+    stale_delta = datetime.timedelta(seconds=stale_seconds) if stale_seconds else datetime.timedelta(days=1)
+    stale_time = (current_time + stale_delta).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
     
-    # Convert color from argb string to individual style values for LineStyle and PolyStyle
-    # Default cyan colors if conversion fails
-    try:
-        # If color is a negative number as string (e.g., "-65281"), convert to positive hex
-        if color_argb.startswith('-'):
-            # Convert negative decimal to positive hex without '0x' prefix and ensure it's 8 digits
-            color_hex = format(int(color_argb) & 0xFFFFFFFF, '08x')
-        else:
-            # If it's already a positive number or hex string
-            color_hex = format(int(color_argb) & 0xFFFFFFFF, '08x')
-        
-        # Extract alpha, red, green, blue components
-        alpha = color_hex[0:2]
-        red = color_hex[2:4]
-        green = color_hex[4:6]
-        blue = color_hex[6:8]
-        
-        # Format for KML style (AABBGGRR format)
-        line_color = f"{alpha}{blue}{green}{red}"
-        poly_color = f"4c{blue}{green}{red}"  # 4c = ~30% opacity
-    except (ValueError, IndexError):
-        # Default cyan colors
-        line_color = "ff99ffff"
-        poly_color = "4c99ffff"
+    color_argb, line_color, poly_color = device_colors(ssid, mac, baseline_macs)
     
     # Create a unique style UID
     style_uid = f"{uid}.Style"
@@ -0,0 +1,92 @@
+"""
+Streaming TAK data package (mission package) export of a session.
+
+The package is a zip with one .cot file per device, a KML overview of the
+whole survey and MANIFEST/manifest.xml listing the contents, which ATAK and
+WinTAK import in one step. The zip is written to an in-memory sink that is
+drained after every ~64 KB of devices, so the response streams out while the
+session is still being read and memory stays flat.
+"""
+import tempfile
+import uuid
+import zipfile
+from xml.sax.saxutils import quoteattr
+
+from session_export import _chunked, _kml_pieces, iter_session_devices
+
+SPOOL_BLOCK = 1024 * 1024
+MIMETYPE = 'application/zip'
+
+
+class _ZipSink:
+    """Write-only file object; zipfile treats it as unseekable and uses data descriptors."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _manifest(package_uid, name, entries):
+    contents = ''.join(
+        f'<Content ignore="false" zipEntry={quoteattr(entry)}>'
+        + (f'<Parameter name="uid" value={quoteattr(uid)}/>' if uid else '')
+        + '</Content>\n'
+        for entry, uid in entries)
+    return ('<MissionPackageManifest version="2">\n'
+            '<Configuration>\n'
+            f'<Parameter name="uid" value={quoteattr(package_uid)}/>\n'
+            f'<Parameter name="name" value={quoteattr(name)}/>\n'
+            '</Configuration>\n'
+            f'<Contents>\n{contents}</Contents>\n'
+            '</MissionPackageManifest>\n')
+
+
+def generate_data_package(path, cot_for, device_colors, is_excluded, name='WigleToTAK'):
+    """
+    Chunked bytes generator for a data package of the session's devices.
+
+    `cot_for(sighting)` returns (uid, cot_xml) for one device;
+    `device_colors` and `is_excluded` are the callables used by the other
+    exports. The session is read once: the KML overview is spooled to a
+    temporary file while the CoT entries are written, then appended.
+    """
+    sink = _ZipSink()
+    entries = []
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as package, \
+            tempfile.TemporaryFile() as kml_spool:
+
+        def devices():
+            for count, (sighting, position) in enumerate(iter_session_devices(path, is_excluded), 1):
+                uid, cot_xml = cot_for(sighting)
+                entry = f'cot/{count:06d}.cot'
+                package.writestr(entry, cot_xml)
+                entries.append((entry, uid))
+                yield sighting, position
+
+        for chunk in _chunked(_kml_pieces(devices(), device_colors, name)):
+            kml_spool.write(chunk.encode('utf-8'))
+            yield sink.drain()
+
+        kml_spool.seek(0)
+        with package.open('survey.kml', 'w') as kml:
+            while True:
+                block = kml_spool.read(SPOOL_BLOCK)
+                if not block:
+                    break
+                kml.write(block)
+                yield sink.drain()
+        entries.append(('survey.kml', None))
+
+        package.writestr('MANIFEST/manifest.xml', _manifest(str(uuid.uuid4()), name, entries))
+    yield sink.drain()
@@ -0,0 +1,340 @@
+"""
+Indexed device search across all wiglecsv sessions in a directory.
+
+Sightings are folded into one record per MAC as the session files grow, so
+the index size follows the number of devices rather than the number of
+sightings. Distinct SSIDs are indexed twice: by word token for whole-word
+queries and by character trigram for substring queries. MACs are kept as
+48-bit integers in a sorted numpy array (plus a small unsorted tail), so a
+prefix such as 60:60:1F is one binary search.
+"""
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from wiglecsv import is_header, mac_to_int
+
+logger = logging.getLogger(__name__)
+
+READ_BLOCK = 1024 * 1024  # Bytes parsed per batch; the lock is only held to fold one batch in
+REFRESH_INTERVAL = 5.0
+MERGE_TAIL_MACS = 50000
+MATCH_MODES = ('substring', 'word')
+MAX_RESULTS = 1000
+
+_TOKEN_SPLIT = re.compile(r'[^0-9a-z]+')
+_HEX_DIGITS = re.compile(r'^[0-9a-f]{1,12}$')
+
+
+def ssid_tokens(ssid):
+    return {token for token in _TOKEN_SPLIT.split(ssid.lower()) if token}
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def mac_prefix_range(prefix):
+    """[lo, hi) range of 48-bit MAC integers starting with `prefix`, or None if it is not hex."""
+    digits = prefix.strip().lower().replace(':', '').replace('-', '').replace('.', '')
+    if not _HEX_DIGITS.match(digits):
+        return None
+    shift = 4 * (12 - len(digits))
+    lo = int(digits, 16) << shift
+    return lo, lo + (1 << shift)
+
+
+class _Device:
+    __slots__ = ('mac', 'ssids', 'sessions', 'sightings', 'first_seen', 'last_seen',
+                 'best_rssi', 'lat', 'lon')
+
+    def __init__(self, mac):
+        self.mac = mac
+        self.ssids = set()
+        self.sessions = set()
+        self.sightings = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.best_rssi = None
+        self.lat = None
+        self.lon = None
+
+
+class DeviceSearchIndex:
+    """Incrementally built search index over every .wiglecsv file in `directory`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.rows = 0
+        self.built = False  # Set once the first pass over the directory has finished
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._offsets = {}  # session name -> bytes ingested
+        self._overlong = set()  # sessions whose next bytes belong to a line too long to be a row
+        self._sessions = []
+        self._session_ids = {}
+        self._devices = []
+        self._device_ids = {}  # MAC string -> device id
+        self._ssids = []  # lower-cased SSID per ssid id
+        self._ssid_ids = {}
+        self._ssid_devices = []  # ssid id -> set of device ids
+        self._tokens = {}  # token -> set of ssid ids
+        self._trigrams = {}  # trigram -> set of ssid ids
+        self._mac_sorted = np.empty(0, dtype=np.uint64)
+        self._mac_sorted_ids = np.empty(0, dtype=np.int64)
+        self._mac_tail = []  # (mac int, device id) not yet merged
+        self.rows = 0
+
+    # --- Building -------------------------------------------------------------
+
+    def start(self, interval=REFRESH_INTERVAL):
+        """Keep the index current from a background thread."""
+        thread = threading.Thread(target=self._refresh_loop, args=(interval,), name='device-search', daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh_loop(self, interval):
+        while True:
+            try:
+                self.refresh()
+            except OSError as e:
+                logger.error(f'Error refreshing device search index for {self.directory}: {e}')
+            time.sleep(interval)
+
+    def refresh(self):
+        """Ingest rows appended to any session since the last call. Returns the number of new rows."""
+        try:
+            names = sorted(f for f in os.listdir(self.directory) if f.endswith('.wiglecsv'))
+        except OSError:
+            return 0
+        sizes = {}
+        for name in names:
+            try:
+                sizes[name] = os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                continue
+        self._total_bytes = sum(sizes.values())
+        added = 0
+        for name, size in sizes.items():
+            path = os.path.join(self.directory, name)
+            if size < self._offsets.get(name, 0):
+                # A session was truncated or replaced; per-device aggregates cannot be unwound
+                logger.info(f'{name} shrank, rebuilding device search index')
+                with self._lock:
+                    self._reset()
+                return self.refresh()
+            added += self._ingest_file(name, path, size)
+        if added:
+            logger.debug(f'Indexed {added} sightings ({self.rows} total, {len(self._devices)} devices)')
+        self.built = True
+        return added
+
+    def _ingest_file(self, name, path, size):
+        added = 0
+        offset = self._offsets.get(name, 0)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while offset < size:
+                block = f.read(min(READ_BLOCK, size - offset))
+                # Only complete lines; a partially written row is picked up next time
+                end = block.rfind(b'\n') + 1
+                if end == 0:
+                    if name not in self._overlong:
+                        if len(block) < READ_BLOCK:
+                            break
+                        # A line longer than a whole block is not a sighting row; skip it instead of stalling
+                        logger.warning(f'Skipping a line of more than {READ_BLOCK} bytes in {name} at byte {offset}')
+                        self._overlong.add(name)
+                    start = end = len(block)
+                elif name in self._overlong:
+                    # The rest of an over-long line, up to and including its newline
+                    start = block.find(b'\n') + 1
+                    self._overlong.discard(name)
+                else:
+                    start = 0
+                # Split and convert without the lock; only folding the rows in blocks searches
+                rows = self._parse_lines(block[start:end].decode('utf-8', errors='replace').split('\n'))
+                with self._lock:
+                    added += self._ingest_rows(name, rows)
+                    offset += end
+                    self._offsets[name] = offset
+                f.seek(offset)
+        return added
+
+    @staticmethod
+    def _parse_lines(lines):
+        """(MAC, SSID, FirstSeen, RSSI, lat, lon) per sighting row; RSSI is None without a usable position."""
+        rows = []
+        for line in lines:
+            fields = line.rstrip('\r').split(',')
+            if len(fields) < 10 or is_header(fields):
+                continue
+            try:
+                rssi = int(fields[5])
+                lat, lon = float(fields[6]), float(fields[7])
+            except ValueError:
+                rssi = lat = lon = None
+            if lat == 0.0 and lon == 0.0:
+                rssi = None
+            rows.append((fields[0].upper(), fields[1], fields[3], rssi, lat, lon))
+        return rows
+
+    def _ingest_rows(self, session, rows):
+        session_id = self._session_ids.get(session)
+        if session_id is None:
+            session_id = self._session_ids[session] = len(self._sessions)
+            self._sessions.append(session)
+        devices = self._devices
+        device_ids = self._device_ids
+        added = 0
+        for mac, ssid, firstseen, rssi, lat, lon in rows:
+            device_id = device_ids.get(mac)
+            if device_id is None:
+                mac_int = mac_to_int(mac)
+                if mac_int is None:
+                    continue
+                device_id = device_ids[mac] = len(devices)
+                devices.append(_Device(mac))
+                self._mac_tail.append((mac_int, device_id))
+            device = devices[device_id]
+            added += 1
+            device.sightings += 1
+            device.sessions.add(session_id)
+
+            if ssid not in device.ssids:
+                device.ssids.add(ssid)
+                self._ssid_devices[self._ssid_id(ssid)].add(device_id)
+
+            # FirstSeen is "YYYY-MM-DD HH:MM:SS", so string order is time order
+            if device.first_seen is None or firstseen < device.first_seen:
+                device.first_seen = firstseen
+            if device.last_seen is None or firstseen > device.last_seen:
+                device.last_seen = firstseen
+            if rssi is not None and (device.best_rssi is None or rssi > device.best_rssi):
+                device.best_rssi, device.lat, device.lon = rssi, lat, lon
+
+        self.rows += added
+        if len(self._mac_tail) > max(MERGE_TAIL_MACS, len(self._mac_sorted) // 10):
+            self._merge_mac_tail()
+        return added
+
+    def _ssid_id(self, ssid):
+        ssid_id = self._ssid_ids.get(ssid)
+        if ssid_id is None:
+            ssid_id = self._ssid_ids[ssid] = len(self._ssids)
+            lowered = ssid.lower()
+            self._ssids.append(lowered)
+            self._ssid_devices.append(set())
+            for token in ssid_tokens(lowered):
+                self._tokens.setdefault(token, set()).add(ssid_id)
+            for gram in trigrams(lowered):
+                self._trigrams.setdefault(gram, set()).add(ssid_id)
+        return ssid_id
+
+    def _merge_mac_tail(self):
+        if not self._mac_tail:
+            return
+        tail = np.array(self._mac_tail, dtype=np.uint64)
+        macs = np.concatenate([self._mac_sorted, tail[:, 0]])
+        ids = np.concatenate([self._mac_sorted_ids, tail[:, 1].astype(np.int64)])
+        order = np.argsort(macs, kind='stable')
+        self._mac_sorted = macs[order]
+        self._mac_sorted_ids = ids[order]
+        self._mac_tail = []
+
+    # --- Querying ---------------------------------------------------------------
+
+    def _match_ssid(self, query, match):
+        query = query.lower()
+        if match == 'word':
+            tokens = ssid_tokens(query)
+            if not tokens:
+                return set()
+            postings = sorted((self._tokens.get(token, set()) for token in tokens), key=len)
+            return set.intersection(*postings)
+        if len(query) < 3:
+            # Too short for trigrams; distinct SSIDs are few compared to sightings
+            return {ssid_id for ssid_id, ssid in enumerate(self._ssids) if query in ssid}
+        postings = sorted((self._trigrams.get(gram, set()) for gram in trigrams(query)), key=len)
+        candidates = set.intersection(*postings)
+        return {ssid_id for ssid_id in candidates if query in self._ssids[ssid_id]}
+
+    def _match_mac(self, lo, hi):
+        start, end = np.searchsorted(self._mac_sorted, [lo, hi])
+        matched = set(self._mac_sorted_ids[start:end].tolist())
+        matched.update(device_id for mac_int, device_id in self._mac_tail if lo <= mac_int < hi)
+        return matched
+
+    def search(self, ssid=None, mac=None, match='substring', limit=100):
+        """
+        Devices whose SSID matches `ssid` and whose MAC starts with `mac`.
+
+        Returns (total, devices) where devices holds up to `limit` result
+        dicts, most recently seen first. Raises ValueError on bad input.
+        """
+        if match not in MATCH_MODES:
+            raise ValueError(f'Unknown match mode: {match}')
+        if not ssid and not mac:
+            raise ValueError('Provide an ssid and/or mac query')
+        mac_range = None
+        if mac:
+            mac_range = mac_prefix_range(mac)
+            if mac_range is None:
+                raise ValueError(f'Invalid MAC prefix: {mac}')
+        limit = min(max(int(limit), 1), MAX_RESULTS)
+
+        with self._lock:
+            matched = None
+            if ssid:
+                matched = set()
+                for ssid_id in self._match_ssid(ssid, match):
+                    matched |= self._ssid_devices[ssid_id]
+            if mac_range is not None:
+                by_mac = self._match_mac(*mac_range)
+                matched = by_mac if matched is None else matched & by_mac
+
+            devices = [self._devices[device_id] for device_id in matched]
+            top = heapq.nlargest(limit, devices, key=lambda d: d.last_seen or '')
+            results = [{
+                'mac': device.mac,
+                'ssids': sorted(device.ssids),
+                'sessions': sorted(self._sessions[s] for s in device.sessions),
+                'sightings': device.sightings,
+                'first_seen': device.first_seen,
+                'last_seen': device.last_seen,
+                'best_rssi': device.best_rssi,
+                'lat': device.lat,
+                'lon': device.lon,
+            } for device in top]
+        return len(devices), results
+
+    def stats(self):
+        """Index size, plus `indexing` and the fraction of bytes read until the first pass is done."""
+        with self._lock:
+            indexed = sum(self._offsets.values())
+            return {'sessions': len(self._sessions), 'sightings': self.rows, 'devices': len(self._devices),
+                    'ssids': len(self._ssids), 'indexing': not self.built,
+                    'progress': 1.0 if self.built else round(indexed / max(self._total_bytes, 1), 3)}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(directory):
+    """Shared DeviceSearchIndex for `directory`, built and kept current in the background."""
+    key = os.path.abspath(directory)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DeviceSearchIndex(directory)
+            index.start()
+    return index
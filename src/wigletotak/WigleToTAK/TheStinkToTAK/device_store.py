@@ -0,0 +1,270 @@
+"""
+Optional persistent device history for WigleToTAK, backed by SQLite in WAL mode.
+
+Sightings are queued by the broadcast loops and written by a single background
+thread in batched transactions, so recording never blocks on disk I/O.
+Parallel post-collection workers convert their rows themselves and hand
+them over in bulk with `record_many`. A
+per-device summary (first/last seen, sighting count) is mirrored in memory,
+which makes "seen before?" lookups plain dict reads.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import geohash
+from wiglecsv import parse_position, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+FLUSH_INTERVAL = 0.5  # Seconds a partial batch may wait before it is committed
+GEOHASH_PRECISION = 7
+
+DeviceHistory = namedtuple('DeviceHistory', ['first_seen', 'last_seen', 'sightings'])
+# Rows prepared elsewhere (e.g. by parallel workers): sightings table rows, device upsert rows
+# and the session's new row high-water mark
+_Bulk = namedtuple('_Bulk', ['sightings', 'devices', 'session', 'rows'])
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS devices (
+    mac TEXT PRIMARY KEY,
+    ssid TEXT,
+    authmode TEXT,
+    channel TEXT,
+    device_type TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    sightings INTEGER NOT NULL,
+    last_lat REAL,
+    last_lon REAL
+);
+CREATE TABLE IF NOT EXISTS sightings (
+    id INTEGER PRIMARY KEY,
+    mac TEXT NOT NULL,
+    ts REAL NOT NULL,
+    lat REAL,
+    lon REAL,
+    rssi REAL,
+    geohash TEXT,
+    session TEXT
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    name TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sightings_mac ON sightings (mac);
+CREATE INDEX IF NOT EXISTS idx_sightings_ts ON sightings (ts);
+CREATE INDEX IF NOT EXISTS idx_sightings_geohash ON sightings (geohash);
+'''
+
+UPSERT_DEVICE = '''
+INSERT INTO devices (mac, ssid, authmode, channel, device_type, first_seen, last_seen, sightings, last_lat, last_lon)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (mac) DO UPDATE SET
+    ssid = excluded.ssid,
+    authmode = excluded.authmode,
+    channel = excluded.channel,
+    device_type = excluded.device_type,
+    first_seen = min(first_seen, excluded.first_seen),
+    last_seen = max(last_seen, excluded.last_seen),
+    sightings = sightings + excluded.sightings,
+    last_lat = coalesce(excluded.last_lat, last_lat),
+    last_lon = coalesce(excluded.last_lon, last_lon)
+'''
+
+
+def sighting_row(session, ts, sighting):
+    """Row of the sightings table for one Sighting: (mac, ts, lat, lon, rssi, geohash, session)."""
+    position = parse_position(sighting)
+    if position is not None:
+        lat, lon, rssi = position
+        cell = geohash.encode(lat, lon, GEOHASH_PRECISION)
+    else:
+        lat = lon = cell = None
+        try:
+            rssi = float(sighting.rssi)
+        except ValueError:
+            rssi = None
+    return sighting.mac, ts, lat, lon, rssi, cell, session
+
+
+def fold_device(devices, sighting, ts, lat, lon):
+    """Aggregate a sighting into `devices` (MAC -> devices upsert row) so each device is upserted once."""
+    device = devices.get(sighting.mac)
+    if device is None:
+        devices[sighting.mac] = [sighting.mac, sighting.ssid, sighting.authmode, sighting.channel,
+                                 sighting.device_type, ts, ts, 1, lat, lon]
+    else:
+        device[1:5] = [sighting.ssid, sighting.authmode, sighting.channel, sighting.device_type]
+        device[5] = min(device[5], ts)
+        device[6] = max(device[6], ts)
+        device[7] += 1
+        if lat is not None:
+            device[8], device[9] = lat, lon
+
+
+class DeviceStore:
+    """Device and sighting history shared by the web UI and the CoT pipeline."""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._summary = {}
+        self._session_rows = {}
+        self._lock = threading.Lock()
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        for mac, first_seen, last_seen, sightings in conn.execute(
+                'SELECT mac, first_seen, last_seen, sightings FROM devices'):
+            self._summary[mac] = DeviceHistory(first_seen, last_seen, sightings)
+        self._session_rows = dict(conn.execute('SELECT name, rows FROM sessions'))
+        conn.close()
+        logger.info(f'Device history store {path} opened with {len(self._summary)} known devices')
+
+        self._writer = threading.Thread(target=self._writer_loop, name='device-store-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # --- Recording -------------------------------------------------------
+
+    def record(self, session, row_number, sighting):
+        """
+        Queue one wiglecsv row for storage.
+
+        `row_number` is the line number of the row in `session`; rows at or
+        below the highest number already recorded for that session are
+        ignored, so replaying a file does not double count its sightings.
+        """
+        with self._lock:
+            if row_number <= self._session_rows.get(session, 0):
+                return
+            self._session_rows[session] = row_number
+            ts = parse_timestamp(sighting.firstseen)
+            previous = self._summary.get(sighting.mac)
+            if previous is None:
+                self._summary[sighting.mac] = DeviceHistory(ts, ts, 1)
+            else:
+                self._summary[sighting.mac] = DeviceHistory(
+                    min(previous.first_seen, ts), max(previous.last_seen, ts), previous.sightings + 1)
+        self._queue.put((session, row_number, ts, sighting))
+
+    def record_many(self, session, last_row, sightings, devices):
+        """
+        Queue rows already converted by sighting_row/fold_device, e.g. by
+        parallel workers. `devices` are the upsert rows of the devices seen in
+        `sightings` and `last_row` is the highest row number among them; the
+        caller is responsible for leaving out rows already recorded.
+        """
+        if not sightings:
+            return
+        with self._lock:
+            self._session_rows[session] = max(self._session_rows.get(session, 0), last_row)
+            for device in devices:
+                mac, first_seen, last_seen, count = device[0], device[5], device[6], device[7]
+                previous = self._summary.get(mac)
+                if previous is None:
+                    self._summary[mac] = DeviceHistory(first_seen, last_seen, count)
+                else:
+                    self._summary[mac] = DeviceHistory(min(previous.first_seen, first_seen),
+                                                       max(previous.last_seen, last_seen),
+                                                       previous.sightings + count)
+        self._queue.put(_Bulk(sightings, devices, session, last_row))
+
+    def recorded_rows(self, session):
+        """Highest row number of `session` recorded so far (0 if none)."""
+        with self._lock:
+            return self._session_rows.get(session, 0)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False  # Flush timer expired
+            if isinstance(item, _Bulk):
+                # Written after the single rows queued before it, in one transaction of its own
+                try:
+                    if batch:
+                        self._write_batch(conn, batch)
+                    self._write_rows(conn, item.sightings, item.devices, {item.session: item.rows})
+                except sqlite3.Error as e:
+                    logger.error(f'Failed to write {len(batch) + len(item.sightings)} sightings to device history: {e}')
+                batch = []
+                deadline = None
+                continue
+            if item:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + FLUSH_INTERVAL
+            if batch and (item is None or item is False or len(batch) >= BATCH_SIZE):
+                try:
+                    self._write_batch(conn, batch)
+                except sqlite3.Error as e:
+                    logger.error(f'Failed to write {len(batch)} sightings to device history: {e}')
+                batch = []
+                deadline = None
+            if item is None:
+                break
+        conn.close()
+
+    @classmethod
+    def _write_batch(cls, conn, batch):
+        sighting_rows = []
+        devices = {}
+        sessions = {}
+        for session, row_number, ts, sighting in batch:
+            row = sighting_row(session, ts, sighting)
+            sighting_rows.append(row)
+            sessions[session] = max(sessions.get(session, 0), row_number)
+            fold_device(devices, sighting, ts, row[2], row[3])
+        cls._write_rows(conn, sighting_rows, devices.values(), sessions)
+
+    @staticmethod
+    def _write_rows(conn, sighting_rows, devices, sessions):
+        with conn:
+            conn.executemany('INSERT INTO sightings (mac, ts, lat, lon, rssi, geohash, session) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', sighting_rows)
+            conn.executemany(UPSERT_DEVICE, devices)
+            conn.executemany('INSERT INTO sessions (name, rows) VALUES (?, ?) '
+                             'ON CONFLICT (name) DO UPDATE SET rows = max(rows, excluded.rows)',
+                             sessions.items())
+
+    # --- Queries ---------------------------------------------------------
+
+    def lookup(self, mac):
+        """DeviceHistory for `mac` or None if it has never been seen. Served from memory."""
+        return self._summary.get(mac)
+
+    def seen_before(self, mac):
+        return mac in self._summary
+
+    def device_count(self):
+        return len(self._summary)
+
+    def recent_sightings(self, mac, limit=100):
+        """Most recent stored sightings of `mac`, newest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT ts, lat, lon, rssi, geohash, session FROM sightings '
+                                'WHERE mac = ? ORDER BY ts DESC LIMIT ?', (mac, limit)).fetchall()
+        finally:
+            conn.close()
+        return [dict(zip(('ts', 'lat', 'lon', 'rssi', 'geohash', 'session'), row)) for row in rows]
@@ -0,0 +1,245 @@
+"""
+Multi-sighting emitter position estimator for WigleToTAK.
+
+Every wiglecsv row records where *we* were when a device was heard, not where
+the device is. This module folds all sightings of a MAC into an RSSI-weighted
+centroid and a weighted covariance, which gives an estimated emitter position
+and an uncertainty ellipse for the CoT payload.
+
+Each MAC keeps a handful of running sums, so a single sighting is an O(1)
+update and batches of rows can be folded in with vectorized numpy reductions.
+"""
+import math
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+
+# Log-distance path-loss model used for weights and the minimum range
+REFERENCE_RSSI_DBM = -40.0  # Expected RSSI at 1 meter
+PATH_LOSS_EXPONENT = 2.7
+
+# Ellipse sizing (full axis lengths in meters, same limits as the RSSI-only ellipse)
+CONFIDENCE_SCALE = 2.0  # ~2 sigma of the weighted sighting spread
+MIN_AXIS_M = 20.0
+MAX_AXIS_M = 500.0
+
+# An estimate is re-broadcast once it moves or shrinks by this fraction of its major axis
+CHANGE_FRACTION = 0.25
+
+EmitterEstimate = namedtuple('EmitterEstimate', ['lat', 'lon', 'major', 'minor', 'angle', 'sightings'])
+
+
+def rssi_to_distance(rssi, sensitivity_factor=1.0):
+    """Range in meters implied by an RSSI reading under the path-loss model."""
+    return sensitivity_factor * 10 ** ((REFERENCE_RSSI_DBM - rssi) / (10 * PATH_LOSS_EXPONENT))
+
+
+def rssi_weight(rssi):
+    """Sighting weight proportional to 1/d^2, works on scalars and numpy arrays."""
+    return np.power(10.0, (rssi - REFERENCE_RSSI_DBM) / (5 * PATH_LOSS_EXPONENT))
+
+
+def estimate_changed(new, old, fraction=CHANGE_FRACTION):
+    """
+    True when `new` differs enough from the last broadcast estimate `old` to
+    resend. A missing new estimate (no GPS fix yet) is never a change, so a
+    MAC already sent is not resent for every fixless row.
+    """
+    if new is None:
+        return False
+    if old is None:
+        return True
+    dy = (new.lat - old.lat) * METERS_PER_DEGREE
+    dx = (new.lon - old.lon) * METERS_PER_DEGREE * math.cos(math.radians(old.lat))
+    limit = fraction * old.major
+    return math.hypot(dx, dy) > limit or abs(new.major - old.major) > limit
+
+
+class _Track:
+    """Running weighted sums for one MAC, in meters relative to its first sighting."""
+    __slots__ = ('ref_lat', 'ref_lon', 'lon_scale', 'sw', 'swx', 'swy',
+                 'swxx', 'swyy', 'swxy', 'count', 'max_rssi')
+
+    def __init__(self, ref_lat, ref_lon):
+        self.ref_lat = ref_lat
+        self.ref_lon = ref_lon
+        self.lon_scale = METERS_PER_DEGREE * math.cos(math.radians(ref_lat))
+        self.sw = self.swx = self.swy = 0.0
+        self.swxx = self.swyy = self.swxy = 0.0
+        self.count = 0
+        self.max_rssi = -math.inf
+
+
+class EmitterEstimator:
+    """Per-MAC emitter position estimates built from any number of sightings."""
+
+    def __init__(self):
+        self._tracks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def __contains__(self, mac):
+        return mac in self._tracks
+
+    def clear(self):
+        with self._lock:
+            self._tracks.clear()
+
+    def update(self, mac, lat, lon, rssi, sensitivity_factor=1.0):
+        """
+        Fold a single sighting into the estimate for `mac`.
+
+        Accepts the raw string fields from a wiglecsv row. Returns the updated
+        EmitterEstimate, or None if the row has no usable position or RSSI.
+        """
+        try:
+            lat, lon, rssi = float(lat), float(lon), float(rssi)
+        except (ValueError, TypeError):
+            return None
+        if lat == 0.0 and lon == 0.0:
+            return None
+
+        w = float(rssi_weight(rssi))
+        with self._lock:
+            track = self._tracks.get(mac)
+            if track is None:
+                track = self._tracks[mac] = _Track(lat, lon)
+            x = (lon - track.ref_lon) * track.lon_scale
+            y = (lat - track.ref_lat) * METERS_PER_DEGREE
+            track.sw += w
+            track.swx += w * x
+            track.swy += w * y
+            track.swxx += w * x * x
+            track.swyy += w * y * y
+            track.swxy += w * x * y
+            track.count += 1
+            if rssi > track.max_rssi:
+                track.max_rssi = rssi
+            return self._estimate(track, sensitivity_factor)
+
+    def update_batch(self, macs, lats, lons, rssis):
+        """
+        Fold a batch of sightings in with vectorized reductions.
+
+        `macs` is a sequence of MAC strings and `lats`/`lons`/`rssis` are
+        float arrays of the same length. Rows without a position should be
+        filtered out by the caller. Batches are additive, so a large file
+        can be refit chunk by chunk with bounded memory.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        rssis = np.asarray(rssis, dtype=np.float64)
+        if len(lats) == 0:
+            return
+
+        unique_macs, first_index, inverse = np.unique(np.asarray(macs), return_index=True, return_inverse=True)
+        n = len(unique_macs)
+
+        with self._lock:
+            # Reference point per MAC: existing track origin or first sighting in this batch
+            tracks = []
+            for mac, idx in zip(unique_macs.tolist(), first_index.tolist()):
+                track = self._tracks.get(mac)
+                if track is None:
+                    track = self._tracks[mac] = _Track(float(lats[idx]), float(lons[idx]))
+                tracks.append(track)
+            ref_lat = np.fromiter((t.ref_lat for t in tracks), dtype=np.float64, count=n)
+            ref_lon = np.fromiter((t.ref_lon for t in tracks), dtype=np.float64, count=n)
+            lon_scale = np.fromiter((t.lon_scale for t in tracks), dtype=np.float64, count=n)
+
+            x = (lons - ref_lon[inverse]) * lon_scale[inverse]
+            y = (lats - ref_lat[inverse]) * METERS_PER_DEGREE
+            w = rssi_weight(rssis)
+
+            sums = [np.bincount(inverse, weights=v, minlength=n).tolist()
+                    for v in (w, w * x, w * y, w * x * x, w * y * y, w * x * y)]
+            counts = np.bincount(inverse, minlength=n).tolist()
+            max_rssi = np.full(n, -np.inf)
+            np.maximum.at(max_rssi, inverse, rssis)
+            max_rssi = max_rssi.tolist()
+
+            for i, track in enumerate(tracks):
+                track.sw += sums[0][i]
+                track.swx += sums[1][i]
+                track.swy += sums[2][i]
+                track.swxx += sums[3][i]
+                track.swyy += sums[4][i]
+                track.swxy += sums[5][i]
+                track.count += counts[i]
+                track.max_rssi = max(track.max_rssi, max_rssi[i])
+
+    def export_tracks(self):
+        """Picklable snapshot of all running sums, e.g. to ship from a worker process."""
+        with self._lock:
+            return {mac: tuple(getattr(t, name) for name in _Track.__slots__)
+                    for mac, t in self._tracks.items()}
+
+    def merge_tracks(self, exported):
+        """
+        Add sums produced by another estimator's export_tracks().
+
+        Moments are shifted from the source track's local frame into this
+        estimator's frame, so merging is exact regardless of which sighting
+        each side used as its reference point.
+        """
+        with self._lock:
+            for mac, values in exported.items():
+                src = _Track.__new__(_Track)
+                for name, value in zip(_Track.__slots__, values):
+                    setattr(src, name, value)
+                dst = self._tracks.get(mac)
+                if dst is None:
+                    self._tracks[mac] = src
+                    continue
+                # x_dst = r * x_src + a, y_dst = y_src + b
+                r = dst.lon_scale / src.lon_scale
+                a = (src.ref_lon - dst.ref_lon) * dst.lon_scale
+                b = (src.ref_lat - dst.ref_lat) * METERS_PER_DEGREE
+                dst.swxx += r * r * src.swxx + 2 * r * a * src.swx + a * a * src.sw
+                dst.swyy += src.swyy + 2 * b * src.swy + b * b * src.sw
+                dst.swxy += r * src.swxy + r * b * src.swx + a * src.swy + a * b * src.sw
+                dst.swx += r * src.swx + a * src.sw
+                dst.swy += src.swy + b * src.sw
+                dst.sw += src.sw
+                dst.count += src.count
+                dst.max_rssi = max(dst.max_rssi, src.max_rssi)
+
+    def estimate(self, mac, sensitivity_factor=1.0):
+        """Current EmitterEstimate for `mac`, or None if it has never been sighted."""
+        with self._lock:
+            track = self._tracks.get(mac)
+            if track is None:
+                return None
+            return self._estimate(track, sensitivity_factor)
+
+    @staticmethod
+    def _estimate(track, sensitivity_factor):
+        mx = track.swx / track.sw
+        my = track.swy / track.sw
+        cxx = max(track.swxx / track.sw - mx * mx, 0.0)
+        cyy = max(track.swyy / track.sw - my * my, 0.0)
+        cxy = track.swxy / track.sw - mx * my
+
+        # Eigen-decomposition of the 2x2 weighted covariance
+        half_trace = (cxx + cyy) / 2
+        spread = math.sqrt(((cxx - cyy) / 2) ** 2 + cxy * cxy)
+        sigma_major = math.sqrt(max(half_trace + spread, 0.0))
+        sigma_minor = math.sqrt(max(half_trace - spread, 0.0))
+        # Orientation of the major axis, converted from math angle to a compass bearing
+        theta = math.degrees(0.5 * math.atan2(2 * cxy, cxx - cyy))
+        angle = (90.0 - theta) % 180.0
+
+        # The emitter is at least as far away as the strongest sighting implies
+        min_range = rssi_to_distance(track.max_rssi, sensitivity_factor)
+        major = min(max(MIN_AXIS_M, 2 * (CONFIDENCE_SCALE * sigma_major + min_range)), MAX_AXIS_M)
+        minor = min(max(MIN_AXIS_M * 0.8, 2 * (CONFIDENCE_SCALE * sigma_minor + min_range)), major)
+
+        lat = track.ref_lat + my / METERS_PER_DEGREE
+        lon = track.ref_lon + mx / track.lon_scale
+        return EmitterEstimate(lat, lon, major, minor, angle, track.count)
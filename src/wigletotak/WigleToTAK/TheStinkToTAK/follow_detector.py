@@ -0,0 +1,116 @@
+"""
+Streaming detection of devices that follow the operator.
+
+For every MAC a short list of visits is kept: one per distinct place, where
+a sighting closer than `min_separation_m` to an earlier visit belongs to
+that visit. Each visit only records the time span and a representative
+position. A device seen at `min_places` separated places spread over at
+least `min_minutes` raises one alert.
+
+Visits per device and tracked devices are both bounded, so each sighting
+costs O(1) work and memory stays flat on long drives.
+"""
+import math
+import threading
+from collections import OrderedDict, namedtuple
+
+FollowAlert = namedtuple('FollowAlert', ['mac', 'ssid', 'lat', 'lon', 'places', 'first_seen', 'last_seen', 'visits'])
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Equirectangular distance, accurate enough at stop-to-stop scales."""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+class _Visit:
+    __slots__ = ('lat', 'lon', 'first_seen', 'last_seen')
+
+    def __init__(self, lat, lon, timestamp):
+        self.lat = lat
+        self.lon = lon
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+
+
+class _Track:
+    __slots__ = ('visits', 'ssid', 'alerted')
+
+    def __init__(self):
+        self.visits = []
+        self.ssid = ''
+        self.alerted = False
+
+
+class FollowDetector:
+    """Per-MAC visit history with the "N separated places over T minutes" rule."""
+
+    def __init__(self, min_places=3, min_minutes=30.0, min_separation_m=500.0, max_visits=8,
+                 max_devices=200000):
+        self.min_places = min_places
+        self.min_minutes = min_minutes
+        self.min_separation_m = min_separation_m
+        self.max_visits = max(max_visits, min_places)
+        self.max_devices = max_devices
+        self._tracks = OrderedDict()  # Least recently seen first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def clear(self):
+        with self._lock:
+            self._tracks.clear()
+
+    def observe(self, mac, ssid, lat, lon, timestamp):
+        """Add one sighting. Returns a FollowAlert the first time `mac` meets the rule, else None."""
+        with self._lock:
+            track = self._tracks.get(mac)
+            if track is None:
+                track = self._tracks[mac] = _Track()
+                if len(self._tracks) > self.max_devices:
+                    self._tracks.popitem(last=False)
+            else:
+                self._tracks.move_to_end(mac)
+            if ssid:
+                track.ssid = ssid
+
+            visits = track.visits
+            visit = self._find_visit(visits, lat, lon)
+            if visit is not None:
+                # Staying at a place can stretch the visits past min_minutes too
+                visit.first_seen = min(visit.first_seen, timestamp)
+                visit.last_seen = max(visit.last_seen, timestamp)
+            else:
+                if len(visits) >= self.max_visits:
+                    # Forget the visit that ended longest ago
+                    visits.remove(min(visits, key=lambda v: v.last_seen))
+                visits.append(_Visit(lat, lon, timestamp))
+            if track.alerted or len(visits) < self.min_places:
+                return None
+
+            first_seen = min(v.first_seen for v in visits)
+            last_seen = max(v.last_seen for v in visits)
+            if last_seen - first_seen < self.min_minutes * 60:
+                return None
+            track.alerted = True
+            return FollowAlert(mac, track.ssid, lat, lon, len(visits), first_seen, last_seen,
+                               [(v.lat, v.lon, v.first_seen, v.last_seen) for v in visits])
+
+    def _find_visit(self, visits, lat, lon):
+        # By distance only: cells of any fixed size would either be larger than the
+        # separation or split one stop in two. The latest visit is by far the most common match
+        for visit in reversed(visits):
+            if distance_m(lat, lon, visit.lat, visit.lon) < self.min_separation_m:
+                return visit
+        return None
+
+    def suspects(self):
+        """(mac, ssid, places) for devices already seen at two or more places, most places first."""
+        with self._lock:
+            found = [(mac, track.ssid, len(track.visits)) for mac, track in self._tracks.items()
+                     if len(track.visits) > 1]
+        return sorted(found, key=lambda item: -item[2])
@@ -0,0 +1,334 @@
+"""
+RSSI heatmap XYZ tiles rendered from wiglecsv sightings.
+
+A layer is one session filtered by SSID or MAC. Its sightings are kept as
+Web Mercator coordinates in numpy arrays, sorted by x so a tile only scans
+the points in its column. Tiles are rendered on demand by binning points
+into a grid with max or mean RSSI reducers, encoded as PNG with zlib, and
+kept in an on-disk LRU cache. When the session grows, only the new rows are
+read and only the cached tiles they fall in are invalidated.
+"""
+import hashlib
+import logging
+import math
+import os
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from wiglecsv import parse_line, parse_position
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+CELL_PIXELS = 4  # Heatmap cells are 4x4 pixels so single sightings stay visible
+GRID = TILE_SIZE // CELL_PIXELS
+REDUCERS = ('max', 'mean')
+MAX_ZOOM = 22
+
+RSSI_MIN = -95.0
+RSSI_MAX = -30.0
+# Blue (weak) -> green -> yellow -> red (strong), same ramp as the HackRF waterfall
+_RAMP = [0.0, 1 / 3, 2 / 3, 1.0]
+_RED = [0, 0, 255, 255]
+_GREEN = [0, 255, 255, 0]
+_BLUE = [255, 255, 0, 0]
+CELL_ALPHA = 180
+
+READ_BLOCK = 4 * 1024 * 1024  # Bytes of new rows parsed at a time
+MERGE_TAIL_ROWS = 100000  # Unsorted rows allowed before the tail is merged into the sorted arrays
+MAX_LAYERS = 8
+CACHE_SUBDIR = 'heatmap_tiles'  # Created inside the configured cache directory; the only thing ever deleted
+
+
+def lonlat_to_world(lon, lat):
+    """Web Mercator world coordinates in [0, 1) for numpy arrays of degrees."""
+    lat = np.clip(lat, -85.05112878, 85.05112878)
+    x = (lon + 180.0) / 360.0
+    sin_lat = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def encode_png(rgba):
+    """Encode an (h, w, 4) uint8 array as an RGBA PNG."""
+    height, width, _ = rgba.shape
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)  # Leading zero byte = no filter
+    raw[:, 1:] = rgba.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6))
+            + chunk(b'IEND', b''))
+
+
+def colorize(grid, mask):
+    """RGBA tile from a GRID x GRID array of RSSI values, transparent where `mask` is false."""
+    t = np.clip((grid - RSSI_MIN) / (RSSI_MAX - RSSI_MIN), 0.0, 1.0)
+    rgba = np.zeros((GRID, GRID, 4), dtype=np.uint8)
+    rgba[..., 0] = np.interp(t, _RAMP, _RED)
+    rgba[..., 1] = np.interp(t, _RAMP, _GREEN)
+    rgba[..., 2] = np.interp(t, _RAMP, _BLUE)
+    rgba[..., 3] = np.where(mask, CELL_ALPHA, 0)
+    return np.repeat(np.repeat(rgba, CELL_PIXELS, axis=0), CELL_PIXELS, axis=1)
+
+
+class TileCache:
+    """LRU cache of rendered PNG tiles on disk, bounded by tile count."""
+
+    def __init__(self, directory, max_tiles=5000):
+        self.directory = os.path.join(directory, CACHE_SUBDIR)
+        self.max_tiles = max_tiles
+        self._index = OrderedDict()
+        self._lock = threading.Lock()
+        # Layers are rebuilt from scratch on start, so tiles from a previous run may be stale.
+        # Only our own subdirectory is cleared, never the directory we were given
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, *key[:-1], f'{key[-1]}.png')
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                self._index.pop(key, None)
+            return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self._index[key] = None
+            self._index.move_to_end(key)
+            evicted = []
+            while len(self._index) > self.max_tiles:
+                evicted.append(self._index.popitem(last=False)[0])
+        for old in evicted:
+            self._remove_file(old)
+
+    def invalidate(self, keys):
+        removed = []
+        with self._lock:
+            for key in keys:
+                if key in self._index:
+                    del self._index[key]
+                    removed.append(key)
+        for key in removed:
+            self._remove_file(key)
+        return len(removed)
+
+    def invalidate_layer(self, layer_id):
+        """Drop every cached tile of a layer, e.g. when the layer is evicted."""
+        with self._lock:
+            keys = [key for key in self._index if key[0] == layer_id]
+            for key in keys:
+                del self._index[key]
+        shutil.rmtree(os.path.join(self.directory, layer_id), ignore_errors=True)
+        return len(keys)
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class HeatmapLayer:
+    """Sightings of one session/filter, incrementally extended as the file grows."""
+
+    def __init__(self, layer_id, path, ssid=None, mac=None):
+        self.layer_id = layer_id
+        self.path = path
+        self.ssid = ssid
+        self.mac = mac
+        self.offset = 0
+        # Sorted by world x; new rows go to an unsorted tail until it is merged
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.rssi = np.empty(0, dtype=np.float32)
+        self.tail_x = np.empty(0)
+        self.tail_y = np.empty(0)
+        self.tail_rssi = np.empty(0, dtype=np.float32)
+        self.rendered_zooms = set()
+        self.lock = threading.Lock()
+
+    def _matches(self, sighting):
+        if self.mac and sighting.mac.lower() != self.mac.lower():
+            return False
+        if self.ssid and sighting.ssid != self.ssid:
+            return False
+        return True
+
+    def refresh(self):
+        """Read rows appended since the last call. Returns world (x, y) of the new points."""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return None
+        if size <= self.offset:
+            return None
+
+        xs, ys, rssis = [], [], []
+        carry = b''
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            remaining = size - self.offset
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                # Only consume complete lines; a partially written row is picked up next time
+                block = carry + block
+                end = block.rfind(b'\n') + 1
+                carry = block[end:]
+                if end == 0:
+                    continue
+                self.offset += end
+                points = self._parse_block(block[:end])
+                if points is not None:
+                    xs.append(points[0])
+                    ys.append(points[1])
+                    rssis.append(points[2])
+        if not xs:
+            return None
+
+        x, y = np.concatenate(xs), np.concatenate(ys)
+        self.tail_x = np.concatenate([self.tail_x, x])
+        self.tail_y = np.concatenate([self.tail_y, y])
+        self.tail_rssi = np.concatenate([self.tail_rssi] + rssis)
+        if len(self.tail_x) > max(MERGE_TAIL_ROWS, len(self.x) // 10):
+            self._merge_tail()
+        return x, y
+
+    def _parse_block(self, data):
+        """World (x, y) and RSSI arrays of the matching sightings in `data`, or None."""
+        lats, lons, rssis = [], [], []
+        for line in data.decode('utf-8', errors='replace').splitlines():
+            sighting = parse_line(line)
+            if sighting is None or not self._matches(sighting):
+                continue
+            position = parse_position(sighting)
+            if position is not None:
+                lats.append(position[0])
+                lons.append(position[1])
+                rssis.append(position[2])
+        if not lats:
+            return None
+        x, y = lonlat_to_world(np.array(lons), np.array(lats))
+        return x, y, np.array(rssis, dtype=np.float32)
+
+    def _merge_tail(self):
+        x = np.concatenate([self.x, self.tail_x])
+        order = np.argsort(x, kind='stable')
+        self.x = x[order]
+        self.y = np.concatenate([self.y, self.tail_y])[order]
+        self.rssi = np.concatenate([self.rssi, self.tail_rssi])[order]
+        self.tail_x = np.empty(0)
+        self.tail_y = np.empty(0)
+        self.tail_rssi = np.empty(0, dtype=np.float32)
+
+    def points_in_tile(self, z, tx, ty):
+        """Tile pixel coordinates and RSSI of every point inside tile z/tx/ty."""
+        scale = float(1 << z)
+        x0, x1 = tx / scale, (tx + 1) / scale
+        lo, hi = np.searchsorted(self.x, [x0, x1])
+        xs = np.concatenate([self.x[lo:hi], self.tail_x])
+        ys = np.concatenate([self.y[lo:hi], self.tail_y])
+        rs = np.concatenate([self.rssi[lo:hi], self.tail_rssi])
+        px = (xs * scale - tx) * TILE_SIZE
+        py = (ys * scale - ty) * TILE_SIZE
+        inside = (px >= 0) & (px < TILE_SIZE) & (py >= 0) & (py < TILE_SIZE)
+        return px[inside], py[inside], rs[inside]
+
+
+def render_tile(layer, z, tx, ty, reducer):
+    """Bin the layer's points for one tile and return PNG bytes."""
+    px, py, rssi = layer.points_in_tile(z, tx, ty)
+    cell = (py.astype(np.int64) // CELL_PIXELS) * GRID + (px.astype(np.int64) // CELL_PIXELS)
+    counts = np.bincount(cell, minlength=GRID * GRID)
+    if reducer == 'max':
+        values = np.full(GRID * GRID, -np.inf)
+        np.maximum.at(values, cell, rssi.astype(np.float64))
+    else:
+        sums = np.bincount(cell, weights=rssi, minlength=GRID * GRID)
+        values = sums / np.maximum(counts, 1)
+    mask = counts > 0
+    values = np.where(mask, values, RSSI_MIN)
+    return encode_png(colorize(values.reshape(GRID, GRID), mask.reshape(GRID, GRID)))
+
+
+class HeatmapRenderer:
+    """Layers, cache and invalidation for the /heatmap tile endpoint."""
+
+    def __init__(self, cache_directory, max_tiles=5000):
+        self.cache = TileCache(cache_directory, max_tiles)
+        self._layers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _layer(self, path, ssid, mac):
+        layer_id = hashlib.sha1(f'{os.path.abspath(path)}|{ssid or ""}|{mac or ""}'.encode()).hexdigest()[:16]
+        evicted = []
+        with self._lock:
+            layer = self._layers.get(layer_id)
+            if layer is None:
+                layer = self._layers[layer_id] = HeatmapLayer(layer_id, path, ssid, mac)
+                while len(self._layers) > MAX_LAYERS:
+                    evicted.append(self._layers.popitem(last=False)[1])
+            self._layers.move_to_end(layer_id)
+        for old in evicted:
+            # A re-created layer starts with no rendered zooms and could never invalidate these tiles
+            with old.lock:
+                removed = self.cache.invalidate_layer(old.layer_id)
+            logger.debug(f'Evicted heatmap layer {old.layer_id} and {removed} cached tiles')
+        return layer
+
+    def tile(self, path, z, tx, ty, reducer='max', ssid=None, mac=None):
+        """PNG bytes for tile z/tx/ty of the layer selected by path/ssid/mac."""
+        if reducer not in REDUCERS:
+            raise ValueError(f'Unknown reducer: {reducer}')
+        if not 0 <= z <= MAX_ZOOM or not (0 <= tx < (1 << z) and 0 <= ty < (1 << z)):
+            raise ValueError(f'Invalid tile {z}/{tx}/{ty}')
+
+        layer = self._layer(path, ssid, mac)
+        with layer.lock:
+            new_points = layer.refresh()
+            if new_points is not None:
+                self._invalidate(layer, *new_points)
+            key = (layer.layer_id, reducer, str(z), str(tx), str(ty))
+            data = self.cache.get(key)
+            if data is None:
+                data = render_tile(layer, z, tx, ty, reducer)
+                self.cache.put(key, data)
+                layer.rendered_zooms.add(z)
+        return data
+
+    def _invalidate(self, layer, x, y):
+        # Only tiles that received new points are dropped from the cache
+        keys = []
+        for z in layer.rendered_zooms:
+            scale = 1 << z
+            tiles = np.unique(np.stack([(x * scale).astype(np.int64), (y * scale).astype(np.int64)], axis=1), axis=0)
+            for tx, ty in tiles.tolist():
+                for reducer in REDUCERS:
+                    keys.append((layer.layer_id, reducer, str(z), str(tx), str(ty)))
+        removed = self.cache.invalidate(keys)
+        if removed:
+            logger.debug(f'Invalidated {removed} heatmap tiles for layer {layer.layer_id}')
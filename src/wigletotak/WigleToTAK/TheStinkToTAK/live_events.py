@@ -0,0 +1,134 @@
+"""
+Live device feed for the WigleToTAK web UI via Server-Sent Events.
+
+The broadcast loops report every CoT they send. Reports are coalesced per
+250 ms window into one delta message (new devices, updated devices and
+throughput counters), encoded once and appended to a single bounded fan-out
+buffer. Every connected browser reads from that buffer with its own cursor,
+so adding clients costs no extra encoding work and nothing ever polls.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+COALESCE_INTERVAL = 0.25
+BUFFER_MESSAGES = 256  # Messages kept for slow or reconnecting clients
+KEEPALIVE_INTERVAL = 15.0
+
+
+class LiveFeed:
+    """Coalescing SSE publisher shared by all /events clients."""
+
+    def __init__(self, interval=COALESCE_INTERVAL, buffer_size=BUFFER_MESSAGES):
+        self.interval = interval
+        self._pending = {}
+        self._known = set()
+        self._packets = 0
+        self._bytes = 0
+        self._total_packets = 0
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self._buffer = deque(maxlen=buffer_size)  # (sequence, encoded message)
+        self._sequence = 0
+        self._cond = threading.Condition()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name='live-feed', daemon=True)
+        self._flusher.start()
+
+    # --- Producer side (broadcast thread) -------------------------------
+
+    def publish_device(self, mac, ssid, lat, lon, rssi, channel, authmode, device_type, color_argb=None):
+        """Record that a CoT for `mac` was just sent. Later reports in the same window win."""
+        with self._lock:
+            entry = self._pending.get(mac)
+            is_new = mac not in self._known if entry is None else entry['new']
+            self._pending[mac] = {
+                'mac': mac, 'ssid': ssid, 'lat': lat, 'lon': lon, 'rssi': rssi,
+                'channel': channel, 'authmode': authmode, 'type': device_type,
+                'color': color_argb, 'new': is_new,
+            }
+
+    def count_packet(self, nbytes):
+        with self._lock:
+            self._packets += 1
+            self._bytes += nbytes
+
+    def reset(self):
+        """Forget known devices, e.g. when a new broadcast starts."""
+        with self._lock:
+            self._known.clear()
+            self._pending.clear()
+
+    # --- Coalescing -------------------------------------------------------
+
+    def _flush_loop(self):
+        while True:
+            started = time.monotonic()
+            self._flush(self.interval)
+            time.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def _flush(self, window):
+        with self._lock:
+            if not self._pending and not self._packets:
+                return
+            pending, self._pending = self._pending, {}
+            packets, nbytes = self._packets, self._bytes
+            self._packets = self._bytes = 0
+            self._total_packets += packets
+            self._total_bytes += nbytes
+            self._known.update(pending)
+            totals = (self._total_packets, self._total_bytes, len(self._known))
+
+        new, updated = [], []
+        for device in pending.values():
+            (new if device.pop('new') else updated).append(device)
+        message = {
+            'new': new,
+            'updated': updated,
+            'counters': {
+                'packets': packets,
+                'bytes': nbytes,
+                'packets_per_sec': round(packets / window, 1),
+                'total_packets': totals[0],
+                'total_bytes': totals[1],
+                'devices': totals[2],
+            },
+        }
+        self._append(json.dumps(message, separators=(',', ':')))
+
+    def _append(self, data):
+        with self._cond:
+            self._sequence += 1
+            self._buffer.append((self._sequence, f'id: {self._sequence}\nevent: devices\ndata: {data}\n\n'))
+            self._cond.notify_all()
+
+    # --- Consumer side (one generator per browser) -----------------------
+
+    def stream(self, last_event_id=None):
+        """Generator of SSE frames for one client, resuming after `last_event_id` if possible."""
+        with self._cond:
+            cursor = self._sequence
+        if last_event_id is not None:
+            try:
+                cursor = min(int(last_event_id), cursor)
+            except ValueError:
+                pass
+
+        yield 'retry: 2000\n\n'
+        while True:
+            with self._cond:
+                if self._sequence <= cursor:
+                    self._cond.wait(KEEPALIVE_INTERVAL)
+                buffered = [item for item in self._buffer if item[0] > cursor]
+                oldest = self._buffer[0][0] if self._buffer else cursor + 1
+            if not buffered:
+                yield ': keepalive\n\n'
+                continue
+            if oldest > cursor + 1:
+                # Client fell behind the fan-out buffer; tell it so it can refresh its view
+                yield 'event: resync\ndata: {}\n\n'
+            for sequence, frame in buffered:
+                yield frame
+            cursor = buffered[-1][0]
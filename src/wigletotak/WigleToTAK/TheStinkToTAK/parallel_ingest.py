@@ -0,0 +1,201 @@
+"""
+Multi-core post-collection processing of large wiglecsv files.
+
+The file is split into byte ranges on line boundaries and each range is
+parsed, filtered and reduced in a worker process:
+
+* rows are deduplicated by their (MAC, SSID) pair. The broadcaster's
+  first-seen rule (skip a row if its MAC or SSID was already sent) only ever
+  rejects a repeated pair, so keeping the first row of each pair is exact;
+* emitter estimator sums are accumulated per MAC;
+* session statistics are counted per shard (ShardCounts) and, with a
+  history session, every row is converted to device store rows.
+
+The parent merges shard results in file order and replays the first-seen
+rule over the small candidate lists, which gives exactly the same devices
+as the single-threaded loop. Statistics and history go to an `on_shard`
+callback in the same order, so only per-device work is left to the parent.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from device_store import fold_device, sighting_row
+from emitter_estimator import EmitterEstimator
+from session_stats import ShardCounts
+from wiglecsv import Sighting, is_header, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+READ_BLOCK = 16 * 1024 * 1024
+MIN_PARALLEL_BYTES = 8 * 1024 * 1024  # Smaller files are not worth the process start-up
+
+
+def split_ranges(path, shards, start=0):
+    """Split `path` from byte `start` into up to `shards` (start, end) ranges that begin at line starts."""
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, 'rb') as f:
+        for i in range(1, shards):
+            f.seek(start + (size - start) * i // shards)
+            f.readline()  # Move to the start of the next line
+            position = f.tell()
+            if bounds[-1] < position < size:
+                bounds.append(position)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def count_lines(path, start, end):
+    """Number of lines in [start, end), counting a final line without a newline."""
+    count = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            count += block.count(b'\n')
+            last = block[-1:]
+    return count + (last != b'\n')
+
+
+def _iter_range_lines(path, start, end):
+    # Yield the lines in [start, end) without loading the whole range into memory
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        carry = b''
+        while remaining > 0:
+            block = f.read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            block = carry + block
+            cut = len(block) if remaining <= 0 else block.rfind(b'\n') + 1
+            carry = block[cut:]
+            if cut:
+                yield from _split_lines(block[:cut])
+        if carry:
+            yield from _split_lines(carry)
+
+
+def _split_lines(data):
+    text = data.decode('utf-8', errors='replace')
+    if text.endswith('\n'):
+        text = text[:-1]
+    return text.split('\n')
+
+
+def process_range(path, start, end, whitelisted_ssids, whitelisted_macs, session=None, skip_lines=0):
+    """
+    Worker: parse and reduce one byte range.
+
+    Returns (line_count, candidates, estimator_tracks, counts, history) where
+    candidates is a list of (line_index, fields) for the first row of every
+    (MAC, SSID) pair that passes the whitelist, in file order, and counts is
+    the range's ShardCounts. With a `session`, history is (sighting rows,
+    device rows, last line index) for DeviceStore.record_many, leaving out
+    the first `skip_lines` lines (already recorded); otherwise it is None.
+    """
+    counts = ShardCounts()
+    sighting_rows = []
+    devices = {}
+    last_recorded = 0
+    candidates = []
+    seen_pairs = set()
+    estimator = EmitterEstimator()
+    macs, lats, lons, rssis = [], [], [], []
+    line_count = 0
+    for line_count, line in enumerate(_iter_range_lines(path, start, end), 1):
+        fields = line.strip().split(',')
+        if len(fields) < 10:
+            continue
+        mac, ssid = fields[0], fields[1]
+        if not is_header(fields):
+            counts.observe(fields)
+            if session is not None and line_count > skip_lines:
+                sighting = Sighting(*fields[:11]) if len(fields) > 10 else Sighting(*fields, '')
+                ts = parse_timestamp(sighting.firstseen)
+                row = sighting_row(session, ts, sighting)
+                sighting_rows.append(row)
+                fold_device(devices, sighting, ts, row[2], row[3])
+                last_recorded = line_count
+
+        # Same sighting filter as refit_estimator()
+        try:
+            lat, lon, rssi = float(fields[6]), float(fields[7]), float(fields[5])
+        except ValueError:
+            lat = lon = 0.0
+        if lat != 0.0 or lon != 0.0:
+            macs.append(mac)
+            lats.append(lat)
+            lons.append(lon)
+            rssis.append(rssi)
+
+        if (whitelisted_ssids and ssid in whitelisted_ssids) or (whitelisted_macs and mac in whitelisted_macs):
+            continue
+        pair = (mac, ssid)
+        if pair not in seen_pairs:
+            seen_pairs.add(pair)
+            candidates.append((line_count, fields))
+
+    if macs:
+        estimator.update_batch(macs, lats, lons, rssis)
+    history = (sighting_rows, list(devices.values()), last_recorded) if session is not None else None
+    return line_count, candidates, estimator.export_tracks(), counts, history
+
+
+def collect_devices(path, workers, whitelisted_ssids=(), whitelisted_macs=(), start_position=0,
+                    session=None, recorded_lines=0, on_shard=None):
+    """
+    Process `path` on `workers` processes.
+
+    Returns (devices, estimator) where devices is a list of
+    (line_number, fields) chosen by the first-seen MAC/SSID rule, in file
+    order, and estimator holds the merged emitter estimates. Line numbers
+    count from `start_position`, which must be the start of a line.
+
+    `on_shard(line_offset, counts, history)` is called for every range in
+    file order (see process_range); history rows are built when `session`
+    is given, except for the first `recorded_lines` lines.
+    """
+    ranges = split_ranges(path, workers, start_position)
+    whitelisted_ssids = frozenset(whitelisted_ssids)
+    whitelisted_macs = frozenset(whitelisted_macs)
+    skips = [0] * len(ranges)
+    if session is not None and recorded_lines > 0:
+        # Replaying rows that are already in the history: each range needs its first line number
+        first_line = 0
+        for i, (start, end) in enumerate(ranges):
+            skips[i] = max(0, recorded_lines - first_line)
+            first_line += count_lines(path, start, end)
+    estimator = EmitterEstimator()
+    devices = []
+    processed_entries = set()
+    line_offset = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_range, path, start, end, whitelisted_ssids, whitelisted_macs, session, skip)
+                   for (start, end), skip in zip(ranges, skips)]
+        # Merge strictly in file order so results are deterministic
+        for future in futures:
+            line_count, candidates, tracks, counts, history = future.result()
+            estimator.merge_tracks(tracks)
+            if on_shard is not None:
+                on_shard(line_offset, counts, history)
+            for line_index, fields in candidates:
+                mac, ssid = fields[0], fields[1]
+                if mac in processed_entries or ssid in processed_entries:
+                    continue
+                processed_entries.add(mac)
+                processed_entries.add(ssid)
+                devices.append((line_offset + line_index, fields))
+            line_offset += line_count
+
+    logger.info(f'Processed {line_offset} rows of {path} on {len(ranges)} shards: '
+                f'{len(devices)} devices, {len(estimator)} estimates')
+    return devices, estimator
@@ -0,0 +1,169 @@
+"""
+Listen on the TAK multicast group for CoT sent by peer sensors.
+
+Every datagram is scanned for the uid attribute of its <event> element with
+plain byte searches (no XML parsing), and the UID is kept in a TTL cache.
+The local sender asks `announced(uid)` before sending and skips devices a
+peer reported within the window. Our own multicast packets loop back to us,
+so the digests of recently sent payloads are remembered and ignored.
+"""
+import hashlib
+import logging
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from xml.sax.saxutils import unescape
+
+logger = logging.getLogger(__name__)
+
+OWN_PACKET_TTL = 10.0  # Seconds to recognise our own looped-back packets
+MAX_UIDS = 500000
+
+
+def scan_event_uid(data):
+    """UID of the <event> element in a CoT datagram, or None."""
+    start = data.find(b'<event')
+    if start < 0:
+        return None
+    end = data.find(b'>', start)
+    if end < 0:
+        return None
+    # Match ' uid=' so attributes like 'access_uid=' are not mistaken for it
+    position = data.find(b' uid=', start, end)
+    if position < 0:
+        return None
+    position += 5
+    quote = data[position:position + 1]
+    if quote not in (b'"', b"'"):
+        return None
+    close = data.find(quote, position + 1, end)
+    if close < 0:
+        return None
+    uid = data[position + 1:close].decode('utf-8', errors='replace')
+    return unescape(uid, {'&quot;': '"', '&apos;': "'"}) if '&' in uid else uid
+
+
+class _TTLCache:
+    """Keys with an expiry, oldest first, purged as time moves on."""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, key, now):
+        self._items[key] = now + self.ttl
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        expiry = self._items.get(key)
+        return expiry is not None and expiry > time.monotonic()
+
+    def purge(self, now):
+        # Entries are ordered by last refresh, so expired ones are at the front
+        while self._items:
+            key, expiry = next(iter(self._items.items()))
+            if expiry > now:
+                break
+            del self._items[key]
+
+
+class PeerListener:
+    """Multicast CoT listener with a TTL cache of UIDs announced by peers."""
+
+    def __init__(self, group='239.2.3.1', port=6969, window=60.0):
+        self.group = group
+        self.port = port
+        self.received = 0
+        self.own_packets = 0
+        self.suppressed = 0
+        self._peer_uids = _TTLCache(window, MAX_UIDS)
+        self._own_digests = _TTLCache(OWN_PACKET_TTL, MAX_UIDS)
+        self._lock = threading.Lock()
+        self._running = False
+        self._sock = None
+
+    @property
+    def window(self):
+        return self._peer_uids.ttl
+
+    @window.setter
+    def window(self, seconds):
+        self._peer_uids.ttl = seconds
+
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)  # Share the port with ATAK and peers on this host
+        sock.bind(('', self.port))
+        membership = struct.pack('4s4s', socket.inet_aton(self.group), socket.inet_aton('0.0.0.0'))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.settimeout(1.0)
+        self._sock = sock
+        self._running = True
+        threading.Thread(target=self._listen_loop, name='peer-listener', daemon=True).start()
+        logger.info(f'Listening for peer CoT on {self.group}:{self.port}')
+
+    def stop(self):
+        self._running = False
+
+    def _listen_loop(self):
+        last_purge = time.monotonic()
+        while self._running:
+            try:
+                data, _ = self._sock.recvfrom(65535)
+                self.observe(data)
+            except socket.timeout:
+                pass
+            except OSError as e:
+                logger.error(f'Peer listener stopped: {e}')
+                break
+            now = time.monotonic()
+            if now - last_purge >= 1.0:
+                with self._lock:
+                    self._own_digests.purge(now)
+                    self._peer_uids.purge(now)
+                last_purge = now
+        self._sock.close()
+
+    def observe(self, data):
+        """Record one received datagram."""
+        now = time.monotonic()
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            self.received += 1
+            if digest in self._own_digests:
+                self.own_packets += 1
+                return
+        uid = scan_event_uid(data)
+        if uid is None:
+            return
+        with self._lock:
+            self._peer_uids.add(uid, now)
+
+    def note_sent(self, data):
+        """Remember a payload we sent so its multicast loopback is not taken for a peer."""
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            self._own_digests.add(digest, time.monotonic())
+
+    def announced(self, uid):
+        """True if a peer sent CoT for `uid` within the window. Counts the suppression."""
+        with self._lock:
+            if uid in self._peer_uids:
+                self.suppressed += 1
+                return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {'received': self.received, 'own_packets': self.own_packets,
+                    'peer_uids': len(self._peer_uids), 'suppressed': self.suppressed}
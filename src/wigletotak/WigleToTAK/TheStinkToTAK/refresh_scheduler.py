@@ -0,0 +1,99 @@
+"""
+Heap-based refresh scheduler for devices already announced to TAK.
+
+Active devices are re-sent every `interval` seconds with a short stale time,
+so TAK clients that join late still receive them, and devices that have not
+been seen for `expire_after` seconds simply stop being refreshed and age out
+of the map on their own. Each device gets a random phase within the interval
+and callers drain at most a fixed number of refreshes per tick, so thousands
+of devices never fire in one burst.
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class _Entry:
+    __slots__ = ('key', 'state', 'last_seen')
+
+    def __init__(self, key, state, last_seen):
+        self.key = key
+        self.state = state
+        self.last_seen = last_seen
+
+
+class RefreshScheduler:
+    """Min-heap of next refresh times keyed by device."""
+
+    def __init__(self, interval=60.0, expire_after=600.0, max_per_second=100):
+        self.interval = float(interval)
+        self.expire_after = float(expire_after)
+        self.max_per_second = max_per_second
+        self._heap = []  # (due, tiebreak, key)
+        self._entries = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+            self._entries.clear()
+
+    def touch(self, key, state, now=None):
+        """Mark `key` as seen with its latest `state`, scheduling it if it is new. O(log n)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.state = state
+                entry.last_seen = now
+                return
+            self._entries[key] = _Entry(key, state, now)
+            # Random phase spreads first refreshes evenly across one interval
+            due = now + random.uniform(0, self.interval)
+            heapq.heappush(self._heap, (due, next(self._counter), key))
+
+    def pop_due(self, limit, now=None):
+        """
+        Return up to `limit` (key, state) pairs whose refresh is due.
+
+        Returned devices are rescheduled one interval later, keeping their
+        phase. Devices unseen for longer than `expire_after` are dropped.
+        """
+        now = time.monotonic() if now is None else now
+        due_items = []
+        with self._lock:
+            while self._heap and len(due_items) < limit and self._heap[0][0] <= now:
+                due, _, key = heapq.heappop(self._heap)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if now - entry.last_seen > self.expire_after:
+                    del self._entries[key]
+                    continue
+                due_items.append((key, entry.state))
+                next_due = due + self.interval
+                if next_due <= now:
+                    # We fell behind; re-spread instead of bunching up behind `now`
+                    next_due = now + random.uniform(0, self.interval)
+                heapq.heappush(self._heap, (next_due, next(self._counter), key))
+        return due_items
+
+    def run(self, send, keep_running, tick=0.1):
+        """
+        Drain due refreshes through `send(key, state)` until `keep_running()` is false.
+
+        At most `max_per_second * tick` refreshes are sent per tick; the rate
+        is read every tick so changes apply to a running loop.
+        """
+        while keep_running():
+            started = time.monotonic()
+            per_tick = max(1, int(self.max_per_second * tick))
+            for key, state in self.pop_due(per_tick, started):
+                send(key, state)
+            time.sleep(max(tick - (time.monotonic() - started), 0))
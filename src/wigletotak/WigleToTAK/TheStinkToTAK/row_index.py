@@ -0,0 +1,173 @@
+"""
+Sidecar row-offset index for random access into wiglecsv sessions.
+
+`<session>.wiglecsv.idx` holds a 16-byte header (magic, version, bytes of
+the session covered) followed by a little-endian uint64 array with the byte
+offset of every complete line. The array is memory-mapped for reads and
+extended incrementally as the session grows, using vectorized newline
+scanning, so paging to any row is a single seek.
+"""
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+
+import numpy as np
+
+from wiglecsv import is_header, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WRIX'
+VERSION = 1
+HEADER = struct.Struct('<4sIQ')  # magic, version, covered bytes
+SCAN_BLOCK = 16 * 1024 * 1024
+
+
+def sidecar_path(path):
+    """Index location next to the session, or in the temp dir if that is not writable."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if os.access(directory, os.W_OK):
+        return path + '.idx'
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f'{os.path.basename(path)}.{digest}.idx')
+
+
+class RowIndex:
+    """Line-start offsets of one wiglecsv file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = sidecar_path(path)
+        self.covered = 0
+        self._offsets = np.empty(0, dtype='<u8')
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                magic, version, covered = HEADER.unpack(f.read(HEADER.size))
+        except (OSError, struct.error):
+            self._reset()
+            return
+        if magic != MAGIC or version != VERSION or covered > os.path.getsize(self.path):
+            # Unknown format, or the session was truncated/replaced since indexing
+            self._reset()
+            return
+        self.covered = covered
+        self._map()
+
+    def _reset(self):
+        with open(self.index_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0))
+        self.covered = 0
+        self._offsets = np.empty(0, dtype='<u8')
+
+    def _map(self):
+        size = os.path.getsize(self.index_path) - HEADER.size
+        count = size // 8
+        if count:
+            self._offsets = np.memmap(self.index_path, dtype='<u8', mode='r', offset=HEADER.size, shape=(count,))
+        else:
+            self._offsets = np.empty(0, dtype='<u8')
+
+    def update(self):
+        """Index rows appended since the last call. Returns the number of new rows."""
+        with self._lock:
+            size = os.path.getsize(self.path)
+            if size < self.covered:
+                self._reset()
+            if size == self.covered:
+                return 0
+
+            added = 0
+            line_start = self.covered
+            with open(self.path, 'rb') as src, open(self.index_path, 'r+b') as idx:
+                idx.seek(0, os.SEEK_END)
+                src.seek(self.covered)
+                position = self.covered
+                while position < size:
+                    block = src.read(min(SCAN_BLOCK, size - position))
+                    if not block:
+                        break
+                    newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10).astype(np.uint64)
+                    if len(newlines):
+                        ends = newlines + np.uint64(position + 1)
+                        starts = np.empty(len(ends), dtype='<u8')
+                        starts[0] = line_start
+                        starts[1:] = ends[:-1]
+                        idx.write(starts.tobytes())
+                        added += len(starts)
+                        line_start = int(ends[-1])
+                    position += len(block)
+                # Only complete lines are indexed; a partial last line is picked up next time
+                self.covered = line_start
+                idx.seek(0)
+                idx.write(HEADER.pack(MAGIC, VERSION, self.covered))
+            self._map()
+            return added
+
+    def row_span(self, row):
+        """(start, end) byte offsets of `row`, end excluding the newline."""
+        start = int(self._offsets[row])
+        end = int(self._offsets[row + 1]) if row + 1 < len(self._offsets) else self.covered
+        return start, end - 1
+
+    def read_rows(self, offset, limit):
+        """Raw text of rows [offset, offset + limit), using one seek and one read."""
+        count = len(self._offsets)
+        if offset >= count or limit <= 0:
+            return []
+        last = min(offset + limit, count) - 1
+        start = int(self._offsets[offset])
+        end = self.row_span(last)[1] + 1
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        return data.decode('utf-8', errors='replace').split('\n')[:last - offset + 1]
+
+    def row_time(self, row):
+        fields = self.read_rows(row, 1)[0].strip().split(',')
+        if len(fields) < 10 or is_header(fields):
+            return None
+        return parse_timestamp(fields[3], default=float('nan'))
+
+    def find_time(self, timestamp):
+        """
+        First row whose FirstSeen is at or after `timestamp` (epoch seconds).
+
+        Binary search over the index; assumes rows are written in time order,
+        as Kismet does. Header and unparseable rows sort before everything.
+        """
+        lo, hi = 0, len(self._offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row_time = self.row_time(mid)
+            if row_time is None or row_time != row_time or row_time < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path):
+    """Shared, up-to-date RowIndex for `path`."""
+    key = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = RowIndex(path)
+    added = index.update()
+    if added:
+        logger.debug(f'Indexed {added} new rows of {path} ({len(index)} total)')
+    return index
@@ -0,0 +1,336 @@
+"""
+Compact binary sighting batches between WigleToTAK collectors and an aggregator.
+
+Collectors forward the first sighting of every MAC and after that only
+material changes (stronger RSSI, a new position, or a periodic refresh) as
+batches over UDP (one datagram per batch, kept under the usual MTU) or TCP
+(each batch prefixed with its length). The aggregator decodes them, tags each sighting with the
+sending node and is the only node that emits CoT.
+
+Batch layout (little-endian):
+    header  '<4sBBH'  magic b'WTSB', version, node id length, record count
+    node id bytes
+    records '<6sIiihHhHBBB' + SSID bytes + AuthMode bytes
+            MAC, FirstSeen (epoch s), lat/lon (1e-7 degrees), RSSI, channel,
+            altitude (m), accuracy (m), type code, SSID length, AuthMode length
+"""
+import datetime
+import logging
+import math
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from wiglecsv import int_to_mac, mac_to_int, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'WTSB'
+VERSION = 1
+HEADER = struct.Struct('<4sBBH')
+RECORD = struct.Struct('<6sIiihHhHBBB')
+FRAME_LENGTH = struct.Struct('<I')
+MAX_DATAGRAM = 1400  # Stay below a typical 1500 byte MTU
+MAX_FRAME = 16 * 1024 * 1024
+METERS_PER_DEGREE = 111195.0
+DEVICE_TYPES = ('', 'WIFI', 'BT', 'BLE', 'GSM', 'CDMA', 'WCDMA', 'LTE', 'NR')
+_TYPE_CODES = {name: code for code, name in enumerate(DEVICE_TYPES)}
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def _clamp(value, lo, hi):
+    return max(lo, min(hi, value))
+
+
+def _number(text, cast=float):
+    try:
+        return cast(float(text))
+    except (ValueError, TypeError):
+        return cast(0)
+
+
+def encode_record(fields):
+    """Binary record for one wiglecsv row (list of fields), or None if the MAC is unusable."""
+    mac_int = mac_to_int(fields[0])
+    if mac_int is None:
+        return None
+    ssid = fields[1].encode('utf-8')[:255]
+    authmode = fields[2].encode('utf-8')[:255]
+    device_type = fields[10] if len(fields) > 10 else ''
+    return RECORD.pack(
+        mac_int.to_bytes(6, 'big'),
+        _clamp(int(parse_timestamp(fields[3])), 0, 0xFFFFFFFF),
+        _clamp(round(_number(fields[6]) * 1e7), -900000000, 900000000),
+        _clamp(round(_number(fields[7]) * 1e7), -1800000000, 1800000000),
+        _clamp(_number(fields[5], int), -32768, 32767),
+        _clamp(_number(fields[4], int), 0, 0xFFFF),
+        _clamp(_number(fields[8], int), -32768, 32767),
+        _clamp(_number(fields[9], int), 0, 0xFFFF),
+        _TYPE_CODES.get(device_type.upper(), 255),
+        len(ssid),
+        len(authmode),
+    ) + ssid + authmode
+
+
+def encode_batch(node_id, records):
+    node = node_id.encode('utf-8')[:255]
+    return HEADER.pack(MAGIC, VERSION, len(node), len(records)) + node + b''.join(records)
+
+
+def decode_batch(data):
+    """(node_id, [fields, ...]) from one batch. Raises ProtocolError on malformed input."""
+    try:
+        magic, version, node_length, count = HEADER.unpack_from(data, 0)
+    except struct.error:
+        raise ProtocolError('Truncated batch header')
+    if magic != MAGIC or version != VERSION:
+        raise ProtocolError(f'Unknown batch format {magic!r} v{version}')
+    offset = HEADER.size
+    node_id = data[offset:offset + node_length].decode('utf-8', errors='replace')
+    offset += node_length
+
+    rows = []
+    for _ in range(count):
+        try:
+            (mac, timestamp, lat, lon, rssi, channel, altitude, accuracy,
+             type_code, ssid_length, auth_length) = RECORD.unpack_from(data, offset)
+        except struct.error:
+            raise ProtocolError('Truncated record')
+        offset += RECORD.size
+        ssid = data[offset:offset + ssid_length].decode('utf-8', errors='replace')
+        offset += ssid_length
+        authmode = data[offset:offset + auth_length].decode('utf-8', errors='replace')
+        offset += auth_length
+        if offset > len(data):
+            raise ProtocolError('Truncated record strings')
+        firstseen = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        rows.append([
+            int_to_mac(int.from_bytes(mac, 'big')), ssid, authmode, firstseen, str(channel), str(rssi),
+            f'{lat / 1e7:.7f}', f'{lon / 1e7:.7f}', str(altitude), str(accuracy),
+            DEVICE_TYPES[type_code] if type_code < len(DEVICE_TYPES) else '',
+        ])
+    return node_id, rows
+
+
+class SightingForwarder:
+    """Collector side: batches sightings and sends them to the aggregator."""
+
+    def __init__(self, node_id, host, port, transport='udp', flush_interval=0.5, max_pending=100000,
+                 min_rssi_gain=5.0, min_move_m=25.0, refresh_seconds=60.0):
+        if transport not in ('udp', 'tcp'):
+            raise ValueError(f'Unknown transport: {transport}')
+        self.node_id = node_id
+        self.address = (host, port)
+        self.transport = transport
+        self.flush_interval = flush_interval
+        self.min_rssi_gain = min_rssi_gain
+        self.min_move_m = min_move_m
+        self.refresh_seconds = refresh_seconds
+        self.sent_batches = 0
+        self.sent_sightings = 0
+        self.dropped = 0
+        self.suppressed = 0
+        self._forwarded = {}  # MAC -> (rssi, lat, lon, timestamp) of the last forwarded sighting
+        self._pending = deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._sock = None
+        self._flusher = threading.Thread(target=self._flush_loop, name='sighting-forwarder', daemon=True)
+        self._flusher.start()
+
+    def submit(self, fields):
+        with self._lock:
+            if not self._is_material(fields):
+                self.suppressed += 1
+                return
+        record = encode_record(fields)
+        if record is None:
+            return
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1  # The aggregator is unreachable and the backlog is full
+            self._pending.append(record)
+
+    def _is_material(self, fields):
+        """First sighting of a MAC, or one that is stronger, has moved or is due for a refresh."""
+        rssi, lat, lon = _number(fields[5]), _number(fields[6]), _number(fields[7])
+        timestamp = parse_timestamp(fields[3])
+        last = self._forwarded.get(fields[0])
+        if last is not None:
+            last_rssi, last_lat, last_lon, last_timestamp = last
+            if lat == 0.0 and lon == 0.0:
+                lat, lon = last_lat, last_lon  # No fix: keep comparing against the last position
+            dy = (lat - last_lat) * METERS_PER_DEGREE
+            dx = (lon - last_lon) * METERS_PER_DEGREE * math.cos(math.radians(last_lat))
+            if rssi < last_rssi + self.min_rssi_gain and math.hypot(dx, dy) < self.min_move_m and \
+                    timestamp - last_timestamp < self.refresh_seconds:
+                return False
+        self._forwarded[fields[0]] = (rssi, lat, lon, timestamp)
+        return True
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f'Error forwarding sightings to {self.address[0]}:{self.address[1]}: {e}')
+                self._close()
+
+    def flush(self):
+        with self._lock:
+            records, self._pending = list(self._pending), deque(maxlen=self._pending.maxlen)
+        if not records:
+            return
+        limit = MAX_DATAGRAM if self.transport == 'udp' else MAX_FRAME
+        sent = 0
+        try:
+            for batch in self._batches(records, limit):
+                self._send(batch[0])
+                sent += batch[1]
+                self.sent_batches += 1
+                self.sent_sightings += batch[1]
+        except OSError:
+            # Put back what was not sent; it goes out after reconnecting
+            with self._lock:
+                self._pending.extendleft(reversed(records[sent:]))
+            raise
+
+    def _batches(self, records, limit):
+        budget = limit - HEADER.size - len(self.node_id.encode('utf-8')[:255])
+        batch, size = [], 0
+        for record in records:
+            if batch and (size + len(record) > budget or len(batch) == 0xFFFF):
+                yield encode_batch(self.node_id, batch), len(batch)
+                batch, size = [], 0
+            batch.append(record)
+            size += len(record)
+        if batch:
+            yield encode_batch(self.node_id, batch), len(batch)
+
+    def _send(self, data):
+        if self.transport == 'udp':
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.sendto(data, self.address)
+        else:
+            if self._sock is None:
+                self._sock = socket.create_connection(self.address, timeout=5)
+            self._sock.sendall(FRAME_LENGTH.pack(len(data)) + data)
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {'node_id': self.node_id, 'transport': self.transport, 'sent_batches': self.sent_batches,
+                'sent_sightings': self.sent_sightings, 'pending': pending, 'dropped': self.dropped,
+                'suppressed': self.suppressed}
+
+
+class AggregatorServer:
+    """Aggregator side: receives batches over UDP and TCP and hands each sighting to `handler(node_id, fields)`."""
+
+    def __init__(self, host, port, handler):
+        self.host = host
+        self.port = port
+        self.handler = handler
+        self.batches = 0
+        self.sightings = 0
+        self.errors = 0
+        self.nodes = {}  # node id -> sightings received
+        self._lock = threading.Lock()
+
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._udp.bind((host, port))
+        self._tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._tcp.bind((host, self._udp.getsockname()[1]))
+        self._tcp.listen(16)
+        self.port = self._udp.getsockname()[1]
+
+    def start(self):
+        threading.Thread(target=self._udp_loop, name='aggregator-udp', daemon=True).start()
+        threading.Thread(target=self._tcp_loop, name='aggregator-tcp', daemon=True).start()
+        logger.info(f'Aggregator listening for collectors on {self.host}:{self.port} (UDP and TCP)')
+
+    def _handle(self, data, peer):
+        try:
+            node_id, rows = decode_batch(data)
+        except ProtocolError as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning(f'Dropped malformed batch from {peer[0]}: {e}')
+            return
+        with self._lock:
+            self.batches += 1
+            self.sightings += len(rows)
+            self.nodes[node_id] = self.nodes.get(node_id, 0) + len(rows)
+        for fields in rows:
+            try:
+                self.handler(node_id, fields)
+            except Exception as e:
+                # One bad sighting (or a failed CoT send) must not stop the receiving thread
+                with self._lock:
+                    self.errors += 1
+                logger.error(f'Error handling sighting {fields[0]} from {node_id}: {e}')
+
+    def _udp_loop(self):
+        while True:
+            try:
+                data, peer = self._udp.recvfrom(65535)
+                self._handle(data, peer)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                logger.error(f'Error receiving collector batch: {e}')
+
+    def _tcp_loop(self):
+        while True:
+            conn, peer = self._tcp.accept()
+            threading.Thread(target=self._tcp_connection, args=(conn, peer), daemon=True).start()
+
+    def _tcp_connection(self, conn, peer):
+        with conn:
+            try:
+                while True:
+                    header = self._recv_exact(conn, FRAME_LENGTH.size)
+                    if header is None:
+                        return
+                    (length,) = FRAME_LENGTH.unpack(header)
+                    if length > MAX_FRAME:
+                        logger.warning(f'Closing collector {peer[0]}: frame of {length} bytes')
+                        return
+                    data = self._recv_exact(conn, length)
+                    if data is None:
+                        return
+                    self._handle(data, peer)
+            except OSError as e:
+                logger.info(f'Collector {peer[0]} disconnected: {e}')
+
+    @staticmethod
+    def _recv_exact(conn, size):
+        chunks = []
+        while size:
+            chunk = conn.recv(min(size, 1 << 20))
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def stats(self):
+        with self._lock:
+            return {'port': self.port, 'batches': self.batches, 'sightings': self.sightings,
+                    'errors': self.errors, 'nodes': dict(self.nodes)}
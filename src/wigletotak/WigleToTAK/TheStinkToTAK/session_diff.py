@@ -0,0 +1,137 @@
+"""
+Cross-session device diffing for wiglecsv files.
+
+Each session is reduced to a sorted, unique numpy array of 48-bit MAC
+integers. MACs are decoded straight from the raw bytes with a vectorized
+hex lookup, so no per-row Python strings are built, and new / gone / common
+devices are numpy set operations over the sorted arrays.
+
+Command line:
+    python session_diff.py old.wiglecsv new.wiglecsv [--show new gone common]
+"""
+import argparse
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from wiglecsv import int_to_mac
+
+READ_BLOCK = 16 * 1024 * 1024
+MAC_CHARS = 17  # "AA:BB:CC:DD:EE:FF"
+_DIGIT_COLUMNS = np.array([0, 1, 3, 4, 6, 7, 9, 10, 12, 13, 15, 16])
+_COLON_COLUMNS = np.array([2, 5, 8, 11, 14])
+_SHIFTS = np.arange(44, -1, -4, dtype=np.uint64)
+
+# ASCII byte -> hex nibble, 255 for anything that is not a hex digit
+_HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+for _i, _c in enumerate(b'0123456789abcdef'):
+    _HEX_VALUES[_c] = _i
+for _i, _c in enumerate(b'ABCDEF'):
+    _HEX_VALUES[_c] = 10 + _i
+
+SessionDiff = namedtuple('SessionDiff', ['new', 'gone', 'common'])
+
+_cache = {}  # abs path -> (size, mtime_ns, macs)
+_cache_lock = threading.Lock()
+
+
+def _block_macs(block):
+    """Unique MAC integers of the lines in `block` (which ends on a line boundary)."""
+    data = np.frombuffer(block, dtype=np.uint8)
+    starts = np.concatenate([[0], np.flatnonzero(data == 10)[:-1] + 1])
+    starts = starts[starts + MAC_CHARS < len(data)]
+    if not len(starts):
+        return np.empty(0, dtype=np.uint64)
+    chars = data[starts[:, None] + np.arange(MAC_CHARS + 1)]
+    # Headers and malformed rows fail the "xx:xx:xx:xx:xx:xx," shape check and are dropped
+    nibbles = _HEX_VALUES[chars[:, _DIGIT_COLUMNS]]
+    valid = (nibbles < 16).all(axis=1) & (chars[:, _COLON_COLUMNS] == ord(':')).all(axis=1) \
+        & (chars[:, MAC_CHARS] == ord(','))
+    values = (nibbles[valid].astype(np.uint64) << _SHIFTS).sum(axis=1, dtype=np.uint64)
+    return np.unique(values)
+
+
+def session_macs(path):
+    """Sorted unique 48-bit MAC integers seen in one session, cached until the file changes."""
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+
+    parts = []
+    carry = b''
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK)
+            if not block:
+                break
+            block = carry + block
+            end = block.rfind(b'\n') + 1
+            carry = block[end:]
+            if end:
+                parts.append(_block_macs(block[:end]))
+    if carry:
+        parts.append(_block_macs(carry + b'\n'))
+    macs = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+
+    with _cache_lock:
+        _cache[key] = (stat.st_size, stat.st_mtime_ns, macs)
+    return macs
+
+
+def union_macs(paths):
+    arrays = [session_macs(path) for path in paths]
+    if not arrays:
+        return np.empty(0, dtype=np.uint64)
+    return arrays[0] if len(arrays) == 1 else np.unique(np.concatenate(arrays))
+
+
+def contains_mac(macs, value):
+    """Whether MAC integer `value` is in the sorted array `macs`, by binary search."""
+    i = np.searchsorted(macs, np.uint64(value))
+    return i < len(macs) and macs[i] == value
+
+
+def diff_sessions(baseline_paths, current_paths):
+    """New, gone and common devices of the current sessions relative to the baseline sessions."""
+    baseline = union_macs(baseline_paths)
+    current = union_macs(current_paths)
+    return SessionDiff(
+        new=np.setdiff1d(current, baseline, assume_unique=True),
+        gone=np.setdiff1d(baseline, current, assume_unique=True),
+        common=np.intersect1d(baseline, current, assume_unique=True),
+    )
+
+
+def format_macs(macs, limit=None):
+    return [int_to_mac(value) for value in (macs if limit is None else macs[:limit]).tolist()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the devices seen in wiglecsv sessions')
+    parser.add_argument('sessions', nargs='+',
+                        help='Baseline session(s) followed by the current session (the last file)')
+    parser.add_argument('--show', nargs='*', default=['new'], choices=SessionDiff._fields,
+                        help='Device lists to print (default: new)')
+    parser.add_argument('--limit', type=int, help='Print at most this many MACs per list')
+    args = parser.parse_args()
+    if len(args.sessions) < 2:
+        parser.error('Need at least two sessions')
+
+    started = time.perf_counter()
+    diff = diff_sessions(args.sessions[:-1], args.sessions[-1:])
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f'new: {len(diff.new)}  gone: {len(diff.gone)}  common: {len(diff.common)}  ({elapsed:.1f} ms)')
+    for name in args.show:
+        print(f'\n# {name}')
+        for mac in format_macs(getattr(diff, name), args.limit):
+            print(mac)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Streaming export of wiglecsv sessions as KML, GeoJSON or CSV.
+
+Every generator here reads the session line by line and yields text chunks,
+so Flask can send them as a chunked response. Only the set of MACs already
+exported is kept in memory, never the rows themselves.
+"""
+import csv
+import io
+import json
+from xml.sax.saxutils import escape
+
+from wiglecsv import WIGLE_FIELDS, iter_sightings, parse_position
+
+CHUNK_BYTES = 64 * 1024
+
+EXPORT_FORMATS = {
+    'kml': ('application/vnd.google-earth.kml+xml', '.kml'),
+    'geojson': ('application/geo+json', '.geojson'),
+    'csv': ('text/csv', '.csv'),
+}
+
+
+def iter_session_devices(path, is_excluded):
+    """
+    Yield the first sighting with a position fix for each MAC in `path`.
+
+    `is_excluded(ssid, mac)` applies the same whitelist rules as the CoT
+    broadcaster.
+    """
+    seen = set()
+    for sighting in iter_sightings(path):
+        if sighting.mac in seen or is_excluded(sighting.ssid, sighting.mac):
+            continue
+        position = parse_position(sighting)
+        if position is None:
+            continue
+        seen.add(sighting.mac)
+        yield sighting, position
+
+
+def _chunked(pieces):
+    # Group small strings into ~64 KB chunks to keep per-write overhead low
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_BYTES:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _kml_pieces(devices, device_colors, title):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n'
+           f'<name>{escape(title)}</name>\n')
+    for sighting, (lat, lon, rssi) in devices:
+        color_argb, line_color, poly_color = device_colors(sighting.ssid, sighting.mac)
+        name = sighting.ssid if sighting.ssid.strip() else sighting.mac
+        yield (f'<Placemark><name>{escape(name)}</name>'
+               f'<description>MAC: {escape(sighting.mac)}, Channel: {escape(sighting.channel)}, '
+               f'RSSI: {rssi:g}, Authentication: {escape(sighting.authmode)}, '
+               f'Device: {escape(sighting.device_type)}, FirstSeen: {escape(sighting.firstseen)}</description>'
+               f'<Style><IconStyle><color>{line_color}</color></IconStyle></Style>'
+               f'<Point><coordinates>{lon},{lat},{escape(sighting.altitudemeters or "0")}</coordinates></Point>'
+               '</Placemark>\n')
+    yield '</Document></kml>\n'
+
+
+def _geojson_pieces(devices, device_colors):
+    yield '{"type":"FeatureCollection","features":[\n'
+    separator = ''
+    for sighting, (lat, lon, rssi) in devices:
+        color_argb, line_color, poly_color = device_colors(sighting.ssid, sighting.mac)
+        properties = dict(zip(WIGLE_FIELDS, sighting))
+        properties['rssi'] = rssi
+        properties['color_argb'] = color_argb
+        # KML colors are aabbggrr, GeoJSON consumers expect #rrggbb
+        properties['color'] = f'#{line_color[6:8]}{line_color[4:6]}{line_color[2:4]}'
+        feature = {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': properties,
+        }
+        yield separator + json.dumps(feature, separators=(',', ':'))
+        separator = ',\n'
+    yield '\n]}\n'
+
+
+def _csv_pieces(devices, device_colors):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(list(WIGLE_FIELDS) + ['color_argb'])
+    for sighting, position in devices:
+        color_argb, line_color, poly_color = device_colors(sighting.ssid, sighting.mac)
+        writer.writerow(list(sighting) + [color_argb])
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue()
+
+
+def generate_export(path, fmt, device_colors, is_excluded, title='WigleToTAK'):
+    """
+    Chunked text generator exporting the deduplicated devices of a session.
+
+    `device_colors(ssid, mac)` returns (color_argb, line_color, poly_color)
+    exactly as used for the CoT ellipse styles.
+    """
+    devices = iter_session_devices(path, is_excluded)
+    if fmt == 'kml':
+        pieces = _kml_pieces(devices, device_colors, title)
+    elif fmt == 'geojson':
+        pieces = _geojson_pieces(devices, device_colors)
+    elif fmt == 'csv':
+        pieces = _csv_pieces(devices, device_colors)
+    else:
+        raise ValueError(f'Unsupported export format: {fmt}')
+    return _chunked(pieces)
@@ -0,0 +1,173 @@
+"""
+Running RF-environment statistics for a session.
+
+The broadcast loops feed every row to `SessionStats.observe`, which does a
+constant amount of dictionary work per row. Channel, band, encryption,
+device type and vendor breakdowns count unique devices (each MAC once, on
+its first sighting); sightings per minute count rows. `snapshot()` serves
+the current totals without touching the session file. Parallel workers
+count their shard with `ShardCounts` and the parent folds the shards in, in
+file order, with `SessionStats.merge`.
+
+Vendor names come from a Wireshark `manuf` file when one is installed;
+otherwise devices are grouped by OUI. Locally administered (randomized)
+MACs are grouped together since their OUI means nothing.
+"""
+import os
+import threading
+from collections import Counter, OrderedDict
+
+MAX_MINUTES = 24 * 60  # Per-minute buckets kept
+MANUF_PATHS = ('/usr/share/wireshark/manuf', '/usr/share/wireshark/wireshark/manuf', '/etc/manuf')
+
+_vendors = None
+_vendors_lock = threading.Lock()
+
+
+def load_vendors(paths=MANUF_PATHS):
+    """OUI ('AA:BB:CC') -> short vendor name from the first readable manuf file."""
+    vendors = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                parts = line.rstrip('\n').split('\t')
+                # Only plain 24-bit OUIs; /28 and /36 ranges would need prefix matching
+                if len(parts) >= 2 and len(parts[0]) == 8:
+                    vendors[parts[0].upper()] = parts[1].strip()
+        break
+    return vendors
+
+
+def vendor_for(mac):
+    global _vendors
+    if _vendors is None:
+        with _vendors_lock:
+            if _vendors is None:
+                _vendors = load_vendors()
+    oui = mac[:8].upper()
+    try:
+        if int(oui[1], 16) & 0x2:
+            return 'Randomized'
+    except (ValueError, IndexError):
+        return 'Unknown'
+    return _vendors.get(oui, oui)
+
+
+def wifi_band(channel):
+    try:
+        channel = int(channel)
+    except ValueError:
+        return 'Unknown'
+    if 1 <= channel <= 14:
+        return '2.4 GHz'
+    if 32 <= channel <= 177:
+        return '5 GHz'
+    return 'Other'
+
+
+def encryption(authmode):
+    """Open / WEP / WPA / WPA2 / WPA3 from a Kismet AuthMode string like [WPA2-PSK-CCMP][ESS]."""
+    mode = authmode.upper()
+    if 'WPA3' in mode or 'SAE' in mode or 'OWE' in mode:
+        return 'WPA3'
+    if 'WPA2' in mode or 'RSN' in mode:
+        return 'WPA2'
+    if 'WPA' in mode:
+        return 'WPA'
+    if 'WEP' in mode:
+        return 'WEP'
+    return 'Open'
+
+
+class ShardCounts:
+    """Counts of one block of rows, gathered without a SessionStats (e.g. in a worker process)."""
+
+    def __init__(self):
+        self.sightings = 0
+        self.per_minute = {}  # Minute -> rows, in order of first appearance
+        self.first_sightings = {}  # MAC -> (authmode, channel, device type) of its first row
+
+    def observe(self, fields):
+        mac, ssid, authmode, firstseen, channel = fields[:5]
+        self.sightings += 1
+        minute = firstseen[:16]
+        self.per_minute[minute] = self.per_minute.get(minute, 0) + 1
+        if mac not in self.first_sightings:
+            device_type = (fields[10] if len(fields) > 10 else '').upper() or 'WIFI'
+            self.first_sightings[mac] = (authmode, channel, device_type)
+
+
+class SessionStats:
+    """Incrementally maintained counters for one session."""
+
+    def __init__(self, session):
+        self.session = session
+        self.sightings = 0
+        self._devices = set()
+        self.channels = Counter()
+        self.bands = Counter()
+        self.encryption = Counter()
+        self.device_types = Counter()
+        self.vendors = Counter()
+        self.per_minute = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, fields):
+        """Count one sighting row (wiglecsv fields). O(1)."""
+        mac, ssid, authmode, firstseen, channel = fields[:5]
+        device_type = (fields[10] if len(fields) > 10 else '').upper() or 'WIFI'
+        minute = firstseen[:16]  # "YYYY-MM-DD HH:MM"
+        with self._lock:
+            self.sightings += 1
+            self._add_minute(minute, 1)
+            self._add_device(mac, authmode, channel, device_type)
+
+    def merge(self, counts):
+        """Fold in the ShardCounts of the rows that follow the ones counted so far."""
+        with self._lock:
+            self.sightings += counts.sightings
+            for minute, rows in counts.per_minute.items():
+                self._add_minute(minute, rows)
+            for mac, (authmode, channel, device_type) in counts.first_sightings.items():
+                self._add_device(mac, authmode, channel, device_type)
+
+    def _add_minute(self, minute, rows):
+        count = self.per_minute.get(minute)
+        if count is None:
+            self.per_minute[minute] = rows
+            if len(self.per_minute) > MAX_MINUTES:
+                self.per_minute.popitem(last=False)
+        else:
+            self.per_minute[minute] = count + rows
+
+    def _add_device(self, mac, authmode, channel, device_type):
+        if mac in self._devices:
+            return
+        self._devices.add(mac)
+        self.device_types[device_type] += 1
+        self.vendors[vendor_for(mac)] += 1
+        if device_type == 'WIFI':
+            self.channels[channel] += 1
+            self.bands[wifi_band(channel)] += 1
+            self.encryption[encryption(authmode)] += 1
+        else:
+            self.bands[device_type] += 1
+
+    def snapshot(self, top=20):
+        with self._lock:
+            minutes = list(self.per_minute.items())
+            return {
+                'session': self.session,
+                'devices': len(self._devices),
+                'sightings': self.sightings,
+                'channels': dict(self.channels.most_common(top)),
+                'bands': dict(self.bands),
+                'encryption': dict(self.encryption),
+                'device_types': dict(self.device_types),
+                'vendors': dict(self.vendors.most_common(top)),
+                'sightings_per_minute': [{'minute': minute, 'sightings': count} for minute, count in minutes[-60:]],
+            }
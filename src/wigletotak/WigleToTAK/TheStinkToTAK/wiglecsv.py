@@ -0,0 +1,80 @@
+"""
+Helpers for reading Kismet/WiGLE .wiglecsv session files.
+
+A session starts with a "WigleWifi-1.x" pre-header and a column header,
+followed by one sighting per line:
+MAC,SSID,AuthMode,FirstSeen,Channel,RSSI,CurrentLatitude,CurrentLongitude,AltitudeMeters,AccuracyMeters,Type
+"""
+import datetime
+import time
+from collections import namedtuple
+
+WIGLE_FIELDS = ('mac', 'ssid', 'authmode', 'firstseen', 'channel', 'rssi',
+                'currentlatitude', 'currentlongitude', 'altitudemeters', 'accuracymeters', 'device_type')
+
+Sighting = namedtuple('Sighting', WIGLE_FIELDS)
+
+
+def is_header(fields):
+    return fields[0] == 'MAC' or fields[0].startswith('WigleWifi')
+
+
+def parse_line(line):
+    """Parse one wiglecsv line into a Sighting, or None for headers and short rows."""
+    fields = line.strip().split(',')
+    if len(fields) < 10 or is_header(fields):
+        return None
+    if len(fields) == 10:
+        fields.append('')
+    return Sighting(*fields[:11])
+
+
+def parse_position(sighting):
+    """(lat, lon, rssi) as floats, or None if the row has no usable fix."""
+    try:
+        lat = float(sighting.currentlatitude)
+        lon = float(sighting.currentlongitude)
+        rssi = float(sighting.rssi)
+    except ValueError:
+        return None
+    if lat == 0.0 and lon == 0.0:
+        return None
+    return lat, lon, rssi
+
+
+def mac_to_int(mac):
+    """48-bit integer for a MAC address in any common notation, or None if it is not one."""
+    digits = mac.strip().replace(':', '').replace('-', '').replace('.', '')
+    if len(digits) != 12:
+        return None
+    try:
+        return int(digits, 16)
+    except ValueError:
+        return None
+
+
+def int_to_mac(value):
+    """Colon-separated upper-case MAC for a 48-bit integer."""
+    digits = f'{int(value):012X}'
+    return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def parse_timestamp(firstseen, default=None):
+    """Epoch seconds for a FirstSeen value ("2025-06-15 21:45:00" or ISO 8601 with Z)."""
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%SZ'):
+        try:
+            stamp = datetime.datetime.strptime(firstseen.strip(), fmt)
+        except ValueError:
+            continue
+        return stamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return time.time() if default is None else default
+
+
+def iter_sightings(path, start_position=0):
+    """Yield Sightings from `path`, starting at byte offset `start_position`."""
+    with open(path, 'r', errors='replace') as file:
+        file.seek(start_position)
+        for line in file:
+            sighting = parse_line(line)
+            if sighting is not None:
+                yield sighting